@@ -0,0 +1,170 @@
+import asyncio
+
+import pyskip
+
+
+class AsyncSkiplist(object):
+    """
+    An asyncio-friendly facade over a ``Skiplist``.
+
+    Writes are serialized through an ``asyncio.Lock``. Long traversals (range
+    scans & batch writes) hand control back to the event loop every
+    ``yield_every`` nodes, so other coroutines stay responsive while they
+    run.
+
+    Scans follow links (or look values up) rather than tracking offsets, so
+    a write that slips in while a scan is paused can't derail it. The scan
+    just may or may not see that write.
+
+    This lives in its own module, since it needs Python 3.6+.
+    """
+    skiplist_class = pyskip.Skiplist
+    yield_every = 100
+
+    def __init__(self, skiplist=None, yield_every=None):
+        if skiplist is None:
+            skiplist = self.skiplist_class()
+
+        if yield_every is not None:
+            self.yield_every = yield_every
+
+        self.skiplist = skiplist
+        self._lock = None
+
+    def __str__(self):
+        return 'AsyncSkiplist: {0} items'.format(len(self))
+
+    def __len__(self):
+        return len(self.skiplist)
+
+    def __aiter__(self):
+        return self.irange()
+
+    @property
+    def lock(self):
+        # Created on first use, so it belongs to the running loop.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        return self._lock
+
+    async def find(self, value):
+        """
+        Looks for a given value. Returns the node if found, ``None`` if not.
+        """
+        return self.skiplist.find(value)
+
+    async def contains(self, value):
+        """
+        Returns whether the value is in the skiplist.
+        """
+        return self.skiplist.find(value) is not None
+
+    async def insert(self, value, **kwargs):
+        """
+        Inserts a new value, once any other writers are done.
+        """
+        async with self.lock:
+            return self.skiplist.insert(value, **kwargs)
+
+    async def remove(self, value):
+        """
+        Removes the first occurrence of a value, once any other writers are
+        done.
+        """
+        async with self.lock:
+            return self.skiplist.remove(value)
+
+    async def insert_many(self, values, **kwargs):
+        """
+        Inserts a batch of values, in chunks of ``yield_every``, yielding to
+        the event loop between chunks.
+        """
+        results = []
+
+        async with self.lock:
+            for chunk in self._chunks(values):
+                results.extend(self.skiplist.insert_many(chunk, **kwargs))
+                await asyncio.sleep(0)
+
+        return results
+
+    async def remove_many(self, values):
+        """
+        Removes a batch of values, in chunks of ``yield_every``, yielding to
+        the event loop between chunks.
+        """
+        results = []
+
+        async with self.lock:
+            for chunk in self._chunks(values):
+                results.extend(self.skiplist.remove_many(chunk))
+                await asyncio.sleep(0)
+
+        return results
+
+    def _chunks(self, values):
+        values = list(values)
+
+        for start in range(0, len(values), self.yield_every):
+            yield values[start:start + self.yield_every]
+
+    async def irange(self, lo=None, hi=None, inclusive=(True, True),
+                     reverse=False):
+        """
+        Asynchronously yields the nodes whose values fall between ``lo`` &
+        ``hi`` (see ``Skiplist.irange``), yielding to the event loop every
+        ``yield_every`` nodes.
+        """
+        if reverse:
+            nodes = self._reverse_nodes(lo, hi, inclusive)
+        else:
+            nodes = self.skiplist.irange(lo, hi, inclusive=inclusive)
+
+        count = 0
+
+        for node in nodes:
+            yield node
+            count += 1
+
+            if count % self.yield_every == 0:
+                await asyncio.sleep(0)
+
+    def _reverse_nodes(self, lo, hi, inclusive):
+        """
+        Walks backward a value at a time: each step looks up the run of
+        nodes before the current one afresh, so it copes with writes made
+        between steps.
+        """
+        include_lo, include_hi = inclusive
+        skip = self.skiplist
+
+        if hi is None:
+            upper = skip.max()
+        else:
+            upper = skip._predecessor(hi, strict=not include_hi)
+
+        while upper is not None:
+            value = upper.value
+
+            if lo is not None:
+                if value < lo or (value == lo and not include_lo):
+                    return
+
+            before = skip._predecessor(value, strict=True)
+
+            if before is None:
+                node = skip.layers[-1].head
+            else:
+                node = before.next
+
+            run = []
+
+            while node is not None and node.value == value:
+                run.append(node)
+                node = node.next
+
+            for node in reversed(run):
+                yield node
+
+            upper = before
@@ -1,135 +1,571 @@
+"""
+Benchmarks for pyskip.
+
+By default, runs the scaling suite: every workload, against every key
+distribution, for each structure, at each size. Each operation is timed on
+its own (with the garbage collector paused, as ``timeit`` does), so the
+report gives ops/sec plus p50 & p99 latencies. Peak memory to build each
+structure is measured separately, with ``tracemalloc``, so tracing doesn't
+slow the timed runs. Everything's seeded, so runs are reproducible, & the
+results can be written out as JSON for diffing between versions::
+
+    python bench.py --sizes 1000,10000 --json before.json
+
+The older, targeted benchmarks are still available by name::
+
+    python bench.py memory|batch|iteration|cache|pickle
+"""
+import argparse
+import bisect
+import gc
+import json
+import pickle
+import platform
 import random
+import sys
 import time
+import tracemalloc
 
 import pyskip
-import bintrees
 
 
-MAX_LOAD = 500
+SIZES = (1000, 10000, 100000, 1000000)
+OPERATIONS = 1000
+RANGE_SPAN = 100
+# Linear per operation, so it's only run at the smaller sizes.
+LINKED_LIST_MAX = 10000
+MEMORY_LOAD = 100000
+BATCH_LOAD = 100000
+BATCH_SIZE = 5000
+ITERATION_LOAD = 200000
+CACHE_LOAD = 100000
+CACHE_QUERIES = 200000
+CACHE_SIZE = 1000
+ZIPF_EXPONENT = 1.1
+PICKLE_LOAD = 1000000
 
 
-def load_skiplist():
-    skip = pyskip.Skiplist()
+class SkiplistTarget(object):
+    name = 'skiplist'
 
-    for i in range(MAX_LOAD):
-        print(i, end='\r')
-        skip.insert(i)
+    def __init__(self, values):
+        self.skip = pyskip.Skiplist.from_sorted(values)
 
-    print()
-    return skip
+    def insert(self, value):
+        self.skip.insert(value)
 
+    def find(self, value):
+        return self.skip.find(value)
 
-def load_sorted_list():
-    the_list = pyskip.SortedLinkedList()
+    def remove(self, value):
+        self.skip.remove(value)
 
-    for i in range(MAX_LOAD):
-        the_list.insert(pyskip.SingleNode(value=i))
+    def iterate(self):
+        return sum(1 for value in self.skip.values())
 
-    return the_list
+    def range(self, lo, hi):
+        return sum(1 for node in self.skip.irange(lo, hi))
 
 
-def load_binary_tree():
-    tree = bintrees.AVLTree()
+class SortedListTarget(object):
+    name = 'sorted_linked_list'
 
-    for i in range(MAX_LOAD):
-        tree.insert(i, True)
+    def __init__(self, values):
+        self.the_list = pyskip.SortedLinkedList.from_sorted(values)
 
-    return tree
+    def insert(self, value):
+        self.the_list.insert(pyskip.SingleNode(value=value))
 
+    def find(self, value):
+        return self.the_list.find(value)
 
-def contains_skiplist(skip, randoms):
-    for rand in randoms:
-        try:
-            assert rand in skip
-        except AssertionError:
-            print("{0} not in the skiplist?".format(rand))
+    def remove(self, value):
+        self.the_list.remove(pyskip.SingleNode(value=value))
 
+    def iterate(self):
+        return sum(1 for value in self.the_list.values())
 
-def contains_sorted_list(the_list, randoms):
-    for rand in randoms:
-        try:
-            assert rand in the_list
-        except AssertionError:
-            print("{0} not in the list?".format(rand))
+    def range(self, lo, hi):
+        count = 0
+        node = self.the_list.head
 
+        while node is not None and node.value < lo:
+            node = node.next
 
-def contains_binary_tree(tree, randoms):
-    for rand in randoms:
-        try:
-            assert rand in tree
-        except AssertionError:
-            print("{0} not in the tree?".format(rand))
+        while node is not None and node.value <= hi:
+            count += 1
+            node = node.next
 
+        return count
 
-def inserts_skiplist(skip, randoms):
-    for rand in randoms:
-        skip.insert(rand)
 
+class BisectTarget(object):
+    """
+    The stdlib baseline: a plain sorted list, maintained with ``bisect``.
+    """
+    name = 'bisect'
 
-def inserts_sorted_list(the_list, randoms):
-    for rand in randoms:
-        the_list.insert(pyskip.SingleNode(value=rand))
+    def __init__(self, values):
+        self.values = list(values)
 
+    def insert(self, value):
+        bisect.insort(self.values, value)
 
-def inserts_binary_tree(tree, randoms):
-    for rand in randoms:
-        tree.insert(rand, True)
+    def find(self, value):
+        offset = bisect.bisect_left(self.values, value)
 
+        if offset < len(self.values) and self.values[offset] == value:
+            return offset
 
-def run():
-    start = time.time()
-    skip = load_skiplist()
-    end = time.time()
-    print("Skiplist loaded in {0} seconds.".format(end - start))
+    def remove(self, value):
+        offset = bisect.bisect_left(self.values, value)
 
-    start = time.time()
-    the_list = load_sorted_list()
-    end = time.time()
-    print("Sorted Linked List loaded in {0} seconds.".format(end - start))
+        if offset < len(self.values) and self.values[offset] == value:
+            del self.values[offset]
 
-    start = time.time()
-    tree = load_binary_tree()
-    end = time.time()
-    print("Binary tree loaded in {0} seconds.".format(end - start))
+    def iterate(self):
+        return sum(1 for value in self.values)
 
-    print()
+    def range(self, lo, hi):
+        start = bisect.bisect_left(self.values, lo)
+        stop = bisect.bisect_right(self.values, hi)
+        return sum(1 for value in self.values[start:stop])
 
-    randoms = [random.randint(0, MAX_LOAD - 1) for i in range(20)]
 
-    start = time.time()
-    contains_skiplist(skip, randoms)
-    end = time.time()
-    print("Skiplist checked contains in {0} seconds.".format(end - start))
+TARGETS = (SkiplistTarget, SortedListTarget, BisectTarget)
+DISTRIBUTIONS = ('uniform', 'sequential', 'zipf')
+WORKLOADS = ('insert', 'find', 'remove', 'iterate', 'range', 'mixed')
 
-    start = time.time()
-    contains_sorted_list(the_list, randoms)
-    end = time.time()
-    print("Sorted Linked List checked contains in {0} seconds.".format(end - start))
 
-    start = time.time()
-    contains_binary_tree(tree, randoms)
-    end = time.time()
-    print("Binary tree checked contains in {0} seconds.".format(end - start))
+def zipf_queries(count, population, exponent=ZIPF_EXPONENT, rand=random):
+    """
+    Draws ``count`` values from ``range(population)``, with a Zipf-like skew
+    (the k-th most popular value turns up in proportion to 1 / k ** s).
+    """
+    ranked = list(range(population))
+    rand.shuffle(ranked)
+    weights = [1.0 / (rank ** exponent) for rank in range(1, population + 1)]
+    return rand.choices(ranked, weights=weights, k=count)
 
-    print()
 
-    randoms = [random.randint(0, MAX_LOAD - 1) for i in range(50)]
+def make_keys(distribution, size, count, rand):
+    """
+    Returns the ``size`` (sorted) keys to preload, ``count`` lookups of them,
+    & ``count`` fresh keys to insert, for a given key distribution.
+    """
+    if distribution == 'sequential':
+        keys = list(range(size))
+        lookups = [offset % size for offset in range(count)]
+        fresh = list(range(size, size + count))
+        return keys, lookups, fresh
 
-    start = time.time()
-    inserts_skiplist(skip, randoms)
-    end = time.time()
-    print("Skiplist inserted 50 new values in {0} seconds.".format(end - start))
+    keys = sorted(rand.randrange(size * 10) for i in range(size))
+    fresh = [rand.randrange(size * 10) for i in range(count)]
 
-    start = time.time()
-    inserts_sorted_list(the_list, randoms)
-    end = time.time()
-    print("Sorted Linked List inserted 50 new values in {0} seconds.".format(end - start))
+    if distribution == 'uniform':
+        lookups = [rand.choice(keys) for i in range(count)]
+    elif distribution == 'zipf':
+        ranks = zipf_queries(count, size, rand=rand)
+        lookups = [keys[offset] for offset in ranks]
+    else:
+        raise ValueError("Unknown distribution '{0}'.".format(distribution))
 
-    start = time.time()
-    inserts_binary_tree(tree, randoms)
-    end = time.time()
-    print("Binary tree inserted 50 new values in {0} seconds.".format(end - start))
+    return keys, lookups, fresh
+
+
+def workload_operations(workload, target, lookups, fresh, rand):
+    """
+    Returns the list of (timed) operations for a workload, each a function
+    of no arguments.
+    """
+    if workload == 'insert':
+        return [lambda value=value: target.insert(value) for value in fresh]
+
+    if workload == 'find':
+        return [lambda value=value: target.find(value) for value in lookups]
+
+    if workload == 'remove':
+        # Each lookup only once, so every removal finds something.
+        removals = list(dict.fromkeys(lookups))
+        return [lambda value=value: target.remove(value)
+                for value in removals]
+
+    if workload == 'iterate':
+        return [target.iterate for i in range(5)]
+
+    if workload == 'range':
+        return [
+            lambda value=value: target.range(value, value + RANGE_SPAN)
+            for value in lookups
+        ]
+
+    if workload != 'mixed':
+        raise ValueError("Unknown workload '{0}'.".format(workload))
+
+    # Mixed: mostly reads, with some churn. Removals take out a value
+    # inserted earlier in the run (or, before there are any, a preloaded
+    # one), so they always find something & the structure shrinks too.
+    operations = []
+    inserted = []
+
+    for lookup, value in zip(lookups, fresh):
+        choice = rand.random()
+
+        if choice < 0.5:
+            operations.append(lambda value=lookup: target.find(value))
+        elif choice < 0.8:
+            operations.append(lambda value=value: target.insert(value))
+            inserted.append(value)
+        else:
+            if inserted:
+                offset = rand.randrange(len(inserted))
+                inserted[offset], inserted[-1] = inserted[-1], inserted[offset]
+                value = inserted.pop()
+            else:
+                value = lookup
+
+            operations.append(lambda value=value: target.remove(value))
+
+    return operations
+
+
+def percentile(ordered, percent):
+    return ordered[int(round((len(ordered) - 1) * percent / 100.0))]
+
+
+def time_operations(operations):
+    """
+    Runs each operation, returning the latency of each (in seconds).
+    """
+    timer = time.perf_counter
+    latencies = []
+    gc.collect()
+    gc.disable()
+
+    try:
+        for operation in operations:
+            start = timer()
+            operation()
+            latencies.append(timer() - start)
+    finally:
+        gc.enable()
+
+    return latencies
+
+
+def peak_memory(target_class, keys):
+    """
+    Returns the peak memory (in bytes) traced while building a structure.
+    """
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        target = target_class(keys)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    del target
+    return peak
+
+
+def run_scaling(sizes, targets, distributions, workloads, operations, seed,
+                memory=True):
+    """
+    Runs the scaling suite, printing a line per result as it goes. Returns
+    the results.
+    """
+    results = []
+
+    for size in sizes:
+        for distribution in distributions:
+            rand = random.Random(
+                '{0}-{1}-{2}'.format(seed, size, distribution)
+            )
+            keys, lookups, fresh = make_keys(
+                distribution,
+                size,
+                operations,
+                rand
+            )
+
+            for target_class in targets:
+                if target_class is SortedListTarget and \
+                        size > LINKED_LIST_MAX:
+                    continue
+
+                peak = None
+
+                if memory:
+                    peak = peak_memory(target_class, keys)
+
+                for workload in workloads:
+                    target = target_class(keys)
+                    latencies = time_operations(workload_operations(
+                        workload,
+                        target,
+                        lookups,
+                        fresh,
+                        random.Random(seed)
+                    ))
+                    total = sum(latencies)
+                    ordered = sorted(latencies)
+                    result = {
+                        'structure': target_class.name,
+                        'size': size,
+                        'distribution': distribution,
+                        'workload': workload,
+                        'operations': len(latencies),
+                        'seconds': total,
+                        'ops_per_sec': len(latencies) / total,
+                        'p50_us': percentile(ordered, 50) * 1e6,
+                        'p99_us': percentile(ordered, 99) * 1e6,
+                        'peak_bytes': peak,
+                    }
+                    results.append(result)
+                    print("{structure:>18} n={size:<8} {distribution:<10} "
+                          "{workload:<8} {ops_per_sec:>12.0f} ops/sec  "
+                          "p50 {p50_us:>9.2f}us  p99 {p99_us:>9.2f}us".format(
+                              **result
+                          ))
+
+    return results
+
+
+def memory_per_key(skiplist_class, count=MEMORY_LOAD):
+    values = [random.random() for i in range(count)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    skip = skiplist_class()
+
+    for value in values:
+        skip.insert(value)
+
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / float(count)
+
+
+def run_memory():
+    for skiplist_class in (pyskip.Skiplist, pyskip.CompactSkiplist,
+                           pyskip.ArraySkiplist):
+        print("{0} uses {1:.1f} bytes/key ({2} keys).".format(
+            skiplist_class.__name__,
+            memory_per_key(skiplist_class),
+            MEMORY_LOAD
+        ))
+
+
+def run_batches():
+    base = pyskip.Skiplist.from_sorted(range(0, BATCH_LOAD * 2, 2))
+    # A batch of keys clustered around one spot, as with timestamps.
+    start = random.randint(0, BATCH_LOAD)
+    batch = [start + random.randint(0, BATCH_SIZE) for i in range(BATCH_SIZE)]
+
+    for label, single, many in (
+        ('inserted', 'insert', 'insert_many'),
+        ('checked', '__contains__', 'contains_many'),
+        ('removed', 'remove', 'remove_many'),
+    ):
+        skip = pyskip.Skiplist.from_sorted(node.value for node in base)
+        method = getattr(skip, single)
+
+        start_time = time.perf_counter()
+        for value in batch:
+            method(value)
+        single_time = time.perf_counter() - start_time
+
+        skip = pyskip.Skiplist.from_sorted(node.value for node in base)
+
+        start_time = time.perf_counter()
+        getattr(skip, many)(batch)
+        many_time = time.perf_counter() - start_time
+
+        print("Skiplist {0} {1} values in {2} seconds ({3}: {4} seconds, "
+              "{5:.1f}x).".format(
+                  label,
+                  BATCH_SIZE,
+                  single_time,
+                  many,
+                  many_time,
+                  single_time / many_time
+              ))
+
+
+def run_iteration():
+    the_list = pyskip.SortedLinkedList.from_sorted(range(ITERATION_LOAD))
+    skip = pyskip.Skiplist.from_sorted(range(ITERATION_LOAD))
+    end_node = pyskip.SingleNode(value=ITERATION_LOAD)
+
+    timings = (
+        ('Sorted Linked List iterated', lambda: sum(1 for n in the_list)),
+        ('Skiplist iterated', lambda: sum(1 for n in skip)),
+        ('Sorted Linked List found the last value',
+            lambda: the_list.find(ITERATION_LOAD - 1)),
+        ('Sorted Linked List inserted at the end',
+            lambda: the_list.insert(end_node)),
+        ('Sorted Linked List removed from the end',
+            lambda: the_list.remove(end_node)),
+    )
+
+    for label, func in timings:
+        start = time.perf_counter()
+        func()
+        end = time.perf_counter()
+        print("{0} in {1} seconds ({2} items).".format(
+            label,
+            end - start,
+            ITERATION_LOAD
+        ))
+
+
+def run_cache():
+    queries = zipf_queries(CACHE_QUERIES, CACHE_LOAD)
+
+    for cache_size in (None, CACHE_SIZE):
+        skip = pyskip.Skiplist.from_sorted(
+            range(CACHE_LOAD),
+            cache_size=cache_size
+        )
+
+        start = time.perf_counter()
+        for value in queries:
+            value in skip
+        end = time.perf_counter()
+
+        print("Skiplist (cache_size={0}) checked contains {1} times in {2} "
+              "seconds ({3:.0f} ops/sec, {4} hits, {5} misses).".format(
+                  cache_size,
+                  CACHE_QUERIES,
+                  end - start,
+                  CACHE_QUERIES / (end - start),
+                  skip.cache_hits,
+                  skip.cache_misses
+              ))
+
+
+def run_pickle():
+    skip = pyskip.Skiplist.from_sorted(range(PICKLE_LOAD))
+    # Don't charge the collection of all those new nodes to pickling.
+    gc.collect()
+
+    start = time.perf_counter()
+    data = pickle.dumps(skip, pickle.HIGHEST_PROTOCOL)
+    middle = time.perf_counter()
+    pickle.loads(data)
+    end = time.perf_counter()
+
+    print("Skiplist pickled {0} keys into {1} bytes ({2:.1f} bytes/key) in "
+          "{3} seconds & unpickled in {4} seconds.".format(
+              PICKLE_LOAD,
+              len(data),
+              len(data) / float(PICKLE_LOAD),
+              middle - start,
+              end - middle
+          ))
+
+
+# The targeted benchmarks, besides the default scaling sweep.
+SUITES = {
+    'memory': run_memory,
+    'batch': run_batches,
+    'iteration': run_iteration,
+    'cache': run_cache,
+    'pickle': run_pickle,
+}
+
+
+def names(choices):
+    """
+    Returns an argparse type for a comma-separated list of names, each of
+    which must be one of ``choices``.
+    """
+    def parse(text):
+        chosen = text.split(',')
+        unknown = [name for name in chosen if name not in choices]
+
+        if unknown:
+            raise argparse.ArgumentTypeError(
+                "unknown {0} (choose from {1})".format(
+                    ', '.join(unknown),
+                    ', '.join(choices)
+                )
+            )
+
+        return chosen
+
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        'suite',
+        nargs='?',
+        default='scaling',
+        choices=['scaling'] + sorted(SUITES)
+    )
+    parser.add_argument(
+        '--sizes',
+        default=','.join(str(size) for size in SIZES),
+        help="Comma-separated sizes to sweep."
+    )
+    structures = [target.name for target in TARGETS]
+    parser.add_argument(
+        '--structures',
+        type=names(structures),
+        default=','.join(structures)
+    )
+    parser.add_argument(
+        '--distributions',
+        type=names(DISTRIBUTIONS),
+        default=','.join(DISTRIBUTIONS)
+    )
+    parser.add_argument(
+        '--workloads',
+        type=names(WORKLOADS),
+        default=','.join(WORKLOADS)
+    )
+    parser.add_argument('--operations', type=int, default=OPERATIONS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-memory',
+        action='store_true',
+        help="Skip the (slow) tracemalloc builds."
+    )
+    parser.add_argument('--json', help="Also write the results here.")
+    args = parser.parse_args(argv)
+
+    if args.suite != 'scaling':
+        random.seed(args.seed)
+        SUITES[args.suite]()
+        return
+
+    results = run_scaling(
+        sizes=[int(size) for size in args.sizes.split(',')],
+        targets=[
+            target for target in TARGETS if target.name in args.structures
+        ],
+        distributions=args.distributions,
+        workloads=args.workloads,
+        operations=args.operations,
+        seed=args.seed,
+        memory=not args.no_memory
+    )
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({
+                'python': sys.version,
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'seed': args.seed,
+                'operations': args.operations,
+                'results': results,
+            }, output, indent=2, sort_keys=True)
 
 
 if __name__ == '__main__':
-    run()
+    main()
@@ -1,4 +1,14 @@
+import array
+import bisect
+import collections
+import copy
+import mmap
+import os
 import random
+import struct
+import threading
+import weakref
+import zlib
 
 
 __author__ = 'Daniel Lindsley'
@@ -6,10 +16,258 @@ __license__ = 'BSD'
 __version__ = (0, 9, 0)
 
 
+# The snapshot file format (see ``Skiplist.dump``).
+SNAPSHOT_MAGIC = b'PYSKIP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<6sBcQ')
+
+# A write-ahead log record (see ``DurableSkiplist``): the operation, the value
+# kind, the payload length & a CRC32 of the payload.
+LOG_RECORD = struct.Struct('<ccII')
+LOG_INSERT = b'+'
+LOG_REMOVE = b'-'
+
+
+# The methods swapped out in stats mode (see ``Skiplist.enable_stats``).
+STATS_METHODS = (
+    'find',
+    'insert',
+    'remove',
+    '_predecessor',
+    '_predecessors',
+    '_climb',
+    'generate_height',
+    '_unlink',
+)
+
+
 class InsertError(Exception):
     pass
 
 
+class SnapshotError(Exception):
+    pass
+
+
+def sorted_runs(left, right, seek_left=None, seek_right=None):
+    """
+    Walks two sorted chains of nodes (from their first nodes) in lockstep,
+    yielding a ``(value, left_count, right_count)`` tuple for each distinct
+    value in either.
+
+    If a side's values are only of interest where they match the other
+    side's, a ``seek_*(node, value)`` function can be given for it, which
+    should jump ahead from ``node`` to the first node whose value is no
+    smaller than ``value``. Values found only on that side are then skipped
+    over rather than yielded.
+    """
+    while left is not None or right is not None:
+        if right is None or (left is not None and left.value < right.value):
+            if seek_left is not None:
+                if right is None:
+                    return
+
+                left = seek_left(left, right.value)
+                continue
+
+            value = left.value
+        elif left is None or right.value < left.value:
+            if seek_right is not None:
+                if left is None:
+                    return
+
+                right = seek_right(right, left.value)
+                continue
+
+            value = right.value
+        else:
+            value = left.value
+
+        left_count = right_count = 0
+
+        while left is not None and left.value == value:
+            left_count += 1
+            left = left.next
+
+        while right is not None and right.value == value:
+            right_count += 1
+            right = right.next
+
+        yield value, left_count, right_count
+
+
+class SetOperationsMixin(object):
+    """
+    Sorted set algebra, built on a lockstep walk of two sorted structures.
+
+    Duplicates are handled as a multiset: ``merge`` keeps every occurrence
+    from both sides, ``union`` keeps the larger count of each value,
+    ``intersection`` the smaller, ``difference`` what's left after taking
+    away the other's & ``symmetric_difference`` the absolute difference.
+
+    Each has an in-place variant (``merge_update``, ``update``,
+    ``intersection_update``, ``difference_update`` &
+    ``symmetric_difference_update``), which only touches the values whose
+    counts change.
+
+    Classes using it provide ``_runs`` (see ``sorted_runs``),
+    ``_from_values`` (to build a new one from sorted values) & ``_apply`` (to
+    add & remove sorted values in place).
+    """
+    def _combined(self, other, count, skip_self=False, skip_other=False):
+        values = []
+
+        for value, mine, theirs in self._runs(other, skip_self, skip_other):
+            values.extend([value] * count(mine, theirs))
+
+        return self._from_values(values)
+
+    def _adjust(self, other, count, skip_self=False, skip_other=False):
+        additions = []
+        removals = []
+
+        for value, mine, theirs in self._runs(other, skip_self, skip_other):
+            change = count(mine, theirs) - mine
+
+            if change > 0:
+                additions.extend([value] * change)
+            elif change < 0:
+                removals.extend([value] * -change)
+
+        self._apply(additions, removals)
+
+    def merge(self, other):
+        """
+        Returns a new structure with all the values from both.
+        """
+        return self._combined(other, lambda mine, theirs: mine + theirs)
+
+    def union(self, other):
+        """
+        Returns a new structure with the values in either.
+        """
+        return self._combined(other, max)
+
+    def intersection(self, other):
+        """
+        Returns a new structure with the values in both.
+        """
+        return self._combined(other, min, skip_self=True, skip_other=True)
+
+    def difference(self, other):
+        """
+        Returns a new structure with the values not in ``other``.
+        """
+        return self._combined(
+            other,
+            lambda mine, theirs: max(mine - theirs, 0),
+            skip_other=True
+        )
+
+    def symmetric_difference(self, other):
+        """
+        Returns a new structure with the values in one or the other, but not
+        both.
+        """
+        return self._combined(
+            other,
+            lambda mine, theirs: abs(mine - theirs)
+        )
+
+    def merge_update(self, other):
+        """
+        Adds all the values from ``other``.
+        """
+        self._adjust(
+            other,
+            lambda mine, theirs: mine + theirs,
+            skip_self=True
+        )
+
+    def update(self, other):
+        """
+        Adds the values from ``other`` that aren't already present.
+        """
+        self._adjust(other, max, skip_self=True)
+
+    def intersection_update(self, other):
+        """
+        Keeps only the values also in ``other``.
+        """
+        self._adjust(other, min, skip_other=True)
+
+    def difference_update(self, other):
+        """
+        Removes the values in ``other``.
+        """
+        self._adjust(
+            other,
+            lambda mine, theirs: max(mine - theirs, 0),
+            skip_self=True,
+            skip_other=True
+        )
+
+    def symmetric_difference_update(self, other):
+        """
+        Keeps the values in one or the other, but not both.
+        """
+        self._adjust(
+            other,
+            lambda mine, theirs: abs(mine - theirs),
+            skip_self=True
+        )
+
+
+class CountingKey(object):
+    """
+    Stands in for a value during a search, counting the comparisons made
+    against it (see ``Skiplist.enable_stats``).
+
+    Searches compare a node's value against the one being searched for
+    (``node.value < value``), which ends up at the reflected methods here.
+    Those that come out ``True`` mean the search moves right, so count as
+    hops (except while ``climbing`` back up from a finger, where the search
+    doesn't move at all).
+    """
+    __slots__ = ('value', 'record', 'climbing')
+
+    def __init__(self, value, record):
+        self.value = value
+        self.record = record
+        self.climbing = False
+
+    def _count(self, result, hop=False):
+        self.record['comparisons'] += 1
+
+        if hop and result and not self.climbing:
+            self.record['hops'] += 1
+
+        return result
+
+    def __gt__(self, other):
+        # ``other < value``
+        return self._count(self.value > other, hop=True)
+
+    def __ge__(self, other):
+        # ``other <= value``
+        return self._count(self.value >= other, hop=True)
+
+    def __lt__(self, other):
+        return self._count(self.value < other)
+
+    def __le__(self, other):
+        return self._count(self.value <= other)
+
+    def __eq__(self, other):
+        self.record['comparisons'] += 1
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
 class SingleNode(object):
     """
     A simple, singly linked list node.
@@ -43,9 +301,12 @@ class SingleNode(object):
 class LinkedList(object):
     """
     A simple linked list.
+
+    Keeps a running count of its nodes, so ``len()`` is O(1).
     """
     def __init__(self):
         self.head = None
+        self.size = 0
 
     def __str__(self):
         return 'LinkedList: {0} items starting with {1}'.format(
@@ -54,26 +315,14 @@ class LinkedList(object):
         )
 
     def __iter__(self):
-        self.current = self.head
-        return self
+        return self.nodes()
 
-    def __next__(self):
-        if self.current is None:
-            raise StopIteration()
-
-        cur = self.current
-        self.current = cur.next
-        return cur
-    # For Python 2.X-compat.
-    next = __next__
+    def __reversed__(self):
+        # Singly linked, so we've got to collect the nodes to go backward.
+        return reversed(list(self.nodes()))
 
     def __len__(self):
-        count = 0
-
-        for node in self:
-            count += 1
-
-        return count
+        return self.size
 
     def __getitem__(self, offset):
         if offset < 0:
@@ -81,21 +330,54 @@ class LinkedList(object):
                 "Can't do negative offsets with a singly linked list."
             )
 
-        for i, node in enumerate(self):
-            if offset == i:
-                return node
+        node = self.head
+        remaining = offset
 
-        raise IndexError("Index '{0}' out of range.".format(offset))
+        while node is not None and remaining:
+            node = node.next
+            remaining -= 1
+
+        if node is None:
+            raise IndexError("Index '{0}' out of range.".format(offset))
+
+        return node
 
     def __contains__(self, value):
         return self.find(value) is not None
 
+    def nodes(self):
+        """
+        Yields each node in the list.
+
+        Each call gets its own independent iterator, so nested or concurrent
+        iteration is safe.
+        """
+        node = self.head
+
+        while node is not None:
+            yield node
+            node = node.next
+
+    def values(self):
+        """
+        Yields each value in the list.
+        """
+        node = self.head
+
+        while node is not None:
+            yield node.value
+            node = node.next
+
     def find(self, value):
-        for node in self:
+        node = self.head
+
+        while node is not None:
             if node.value == value:
                 # We found it! Yay! Bail early.
                 return node
 
+            node = node.next
+
         return None
 
     def insert_first(self, insert_node):
@@ -104,6 +386,7 @@ class LinkedList(object):
         """
         insert_node.next = self.head
         self.head = insert_node
+        self.size += 1
         return insert_node
 
     def insert_after(self, existing_node, insert_node):
@@ -112,6 +395,7 @@ class LinkedList(object):
         """
         insert_node.next = existing_node.next
         existing_node.next = insert_node
+        self.size += 1
         return insert_node
 
     def remove_first(self):
@@ -123,6 +407,7 @@ class LinkedList(object):
 
         old_head = self.head
         self.head = self.head.next
+        self.size -= 1
         return old_head
 
     def remove_after(self, existing_node):
@@ -134,25 +419,101 @@ class LinkedList(object):
 
         old_next = existing_node.next
         existing_node.next = existing_node.next.next
+        self.size -= 1
         return old_next
 
 
-class SortedLinkedList(LinkedList):
+class SortedLinkedList(SetOperationsMixin, LinkedList):
     """
     A linked list that maintains the correct sort order.
+
+    Supports sorted set algebra with another ``SortedLinkedList`` (see
+    ``SetOperationsMixin``), in a single pass over both.
     """
+    @classmethod
+    def from_sorted(cls, values, node_class=SingleNode):
+        """
+        Builds a new list from already-sorted values in a single pass.
+
+        Raises an ``InsertError`` if the values turn out not to be sorted.
+        """
+        the_list = cls()
+        tail = None
+
+        for value in values:
+            new_node = node_class(value=value)
+
+            if tail is None:
+                the_list.insert_first(new_node)
+            else:
+                # Complains (via ``InsertError``) if we're out of order.
+                the_list.insert_after(tail, new_node)
+
+            tail = new_node
+
+        return the_list
+
+    def bulk_insert(self, values, node_class=SingleNode):
+        """
+        Inserts many (unsorted) values at once.
+
+        The values are sorted first, then merged into the list in a single
+        pass, rather than rescanning from the head for each one.
+        """
+        previous = None
+        node = self.head
+
+        for value in sorted(values):
+            while node is not None and node.value <= value:
+                previous = node
+                node = node.next
+
+            new_node = node_class(value=value)
+
+            if previous is None:
+                self.insert_first(new_node)
+            else:
+                self.insert_after(previous, new_node)
+
+            previous = new_node
+
+    def _runs(self, other, skip_self=False, skip_other=False):
+        # No upper layers to gallop along, so just walk both.
+        return sorted_runs(self.head, other.head)
+
+    def _from_values(self, values):
+        return self.from_sorted(values)
+
+    def _apply(self, additions, removals):
+        previous = None
+        node = self.head
+
+        for value in removals:
+            while node.value < value:
+                previous = node
+                node = node.next
+
+            if previous is None:
+                self.remove_first()
+                node = self.head
+            else:
+                self.remove_after(previous)
+                node = previous.next
+
+        self.bulk_insert(additions)
+
     def find(self, value):
         # We can be more efficient here, since we know we're sorted.
-        for node in self:
-            if node.value == value:
-                # We found it! Yay! Bail early.
-                return node
+        node = self.head
 
-            if node.value > value:
-                # We've exceeded the value & we didn't already come across it.
-                # Must not be here. Bail.
-                return None
+        while node is not None and node.value < value:
+            node = node.next
 
+        if node is not None and node.value == value:
+            # We found it! Yay!
+            return node
+
+        # We've exceeded the value (or run out) without coming across it.
         return None
 
     def insert_after(self, existing_node, new_node):
@@ -174,181 +535,3713 @@ class SortedLinkedList(LinkedList):
         return super(SortedLinkedList, self).insert_first(new_node)
 
     def insert(self, new_node):
-        if not self.head or new_node < self.head:
-            self.insert_first(new_node)
-            return
+        """
+        Inserts the new node in sorted order (after any equal values).
+        """
+        value = new_node.value
 
-        previous = self.head
+        if self.head is None or value < self.head.value:
+            return self.insert_first(new_node)
 
-        for node in self:
-            if previous <= new_node <= node:
-                self.insert_after(previous, new_node)
-                return
+        previous = self.head
+        node = previous.next
 
+        while node is not None and node.value <= value:
             previous = node
+            node = node.next
 
         return self.insert_after(previous, new_node)
 
     def remove(self, remove_node):
-        previous = self.head
+        """
+        Removes the first node with the same value as the provided one.
 
-        for node in self:
-            if node == remove_node:
-                return self.remove_after(previous)
+        Returns the removed node, or ``None`` if no node matched.
+        """
+        value = remove_node.value
+        previous = None
+        node = self.head
 
+        while node is not None and node.value < value:
             previous = node
+            node = node.next
 
-        return None
+        if node is None or node.value != value:
+            return None
+
+        if previous is None:
+            return self.remove_first()
+
+        return self.remove_after(previous)
 
 
 class SkiplistNode(SingleNode):
-    def __init__(self, value=None, next=None, down=None):
+    """
+    A node within one layer of a skiplist.
+
+    ``down`` points at the node holding the same value in the layer below.
+    ``width`` is the number of bottom layer positions between the previous
+    node in the same layer & this one (for a layer's head, its one-based
+    position in the bottom layer).
+    """
+    def __init__(self, value=None, next=None, down=None, width=1):
         super(SkiplistNode, self).__init__(value=value, next=next)
         self.down = down
+        self.width = width
 
 
-class Skiplist(object):
+class SkiplistFinger(object):
     """
-    Implements a basic skiplist.
+    Remembers where a search in a ``Skiplist`` ended up, so the next one can
+    start from there.
 
-    A skiplist provides a quickly searchable structure (like a balanced binary
-    tree) that also updates fairly cheaply (no nasty rebalancing acts).
+    Pass one to ``find``, ``insert`` or ``remove`` (as ``finger=``). A search
+    for a nearby value only climbs as high as it needs to, then heads over &
+    back down, making it O(log d) in the distance ``d`` from the last search
+    rather than O(log n). If the skiplist was changed by something else in
+    the meantime, the next search just starts from the top.
 
-    In other words, it's awesome.
+    ``node`` is the bottom layer node the last search landed on: the node
+    found or inserted, or the first one after where the value would go.
+    """
+    def __init__(self, skiplist):
+        self.skiplist = skiplist
+        self.hint = None
+        self.version = None
+        self.node = None
 
-    See http://en.wikipedia.org/wiki/Skip_list for more information.
+    def __repr__(self):
+        return "{0}: {1}".format(self.__class__.__name__, self.node)
+
+    def get_hint(self):
+        """
+        Returns the recorded search path, or ``None`` if the skiplist has
+        changed since it was recorded.
+        """
+        if self.version != self.skiplist.version:
+            return None
+
+        return self.hint
+
+    def update(self, hint, node):
+        """
+        Records where a search ended up.
+        """
+        self.hint = hint
+        self.version = self.skiplist.version
+        self.node = node
+
+
+class SkiplistSnapshot(object):
     """
-    list_class = SortedLinkedList
-    node_class = SkiplistNode
-    max_layers = 32
+    A read-only view of a ``Skiplist`` as it was when ``snapshot`` was
+    called.
 
-    def __init__(self, list_class=None, node_class=None, max_layers=None):
-        if list_class is not None:
-            self.list_class = list_class
+    It shares the live skiplist's nodes rather than copying them. The
+    skiplist logs which nodes are inserted & removed while snapshots are
+    open, so a snapshot sees the live nodes, less any inserted since it was
+    taken, plus any removed since. Writers aren't blocked & the log is
+    dropped once every snapshot is closed (or garbage collected).
 
-        if node_class is not None:
-            self.node_class = node_class
+    Supports ``len``, ``in``, ``find``, ``irange`` & iteration, all of which
+    yield (or return) nodes. Scans work through the range a batch at a time
+    (never splitting a run of equal values), so changes made between
+    batches can't throw them off.
+    """
+    batch_size = 100
 
-        if max_layers is not None:
-            self.max_layers = max_layers
+    def __init__(self, skiplist, start):
+        self.skiplist = skiplist
+        self.start = start
+        self.version = skiplist.version
+        self.closed = False
+        # The changes since the snapshot (see ``_changes``), brought up to
+        # date with the skiplist's log as of ``_delta_stamp``.
+        self._delta_stamp = start
+        self._added = set()
+        self._removed = []
+        self._keys = []
+        self._live_added = 0
 
-        self.layers = [
-            self.list_class()
-        ]
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def __str__(self):
-        return 'Skiplist: {0} items'.format(len(self.layers[-1]))
+        return 'SkiplistSnapshot: {0} items'.format(len(self))
 
     def __len__(self):
-        return len(self.layers[-1])
+        added, removed, keys, live_added = self._changes()
+        return len(self.skiplist) - live_added + len(removed)
 
     def __contains__(self, value):
         return self.find(value) is not None
 
     def __iter__(self):
-        return iter(self.layers[-1])
+        return self.irange()
 
-    def generate_height(self):
+    def close(self):
         """
-        Generates a random height (between ``2`` & ``self.max_layers``) to fill
-        in.
+        Releases the snapshot, letting the skiplist drop its logged changes.
         """
-        return random.randint(2, self.max_layers)
+        if not self.closed:
+            self.closed = True
+            self._added = self._removed = self._keys = None
+            self.skiplist._release(weakref.ref(self))
 
-    def find(self, value):
+    def _changes(self):
         """
-        Looks for a given value within the skiplist.
+        Works out what's happened since the snapshot was taken, folding in
+        just the changes logged since the last call.
 
-        Returns the node if found, ``None`` if the value was not found.
+        Returns the ids of the nodes inserted since, the nodes removed since
+        (excluding any also inserted since) in sorted order, their values &
+        how many of the inserted nodes are still in the skiplist.
         """
-        layer_offset = 0
-        current = self.layers[layer_offset].head
-        is_first = True
+        if self.closed:
+            raise ValueError("The snapshot has been closed.")
 
-        while True:
-            if current is None:
-                # We've exhausted all options. Bail out.
-                break
+        skip = self.skiplist
+        stamp = skip.history_base + len(skip.history)
 
-            if current.value == value:
-                # We found it! Bail out.
-                return current
-            elif current.value > value:
-                if is_first:
-                    # We're at the beginning of the list, but there may be
-                    # levels below with numbers befor this one.
-                    layer_offset += 1
-
-                    if layer_offset <= len(self.layers) - 1:
-                        current = self.layers[layer_offset].head
-                        continue
-                    else:
-                        break
+        if stamp != self._delta_stamp:
+            added = self._added
+            removed = self._removed
+            keys = self._keys
+            since = skip.history[self._delta_stamp - skip.history_base:]
 
-            if current.next and current.next.value <= value:
-                # The next node in the current layer might match.
-                current = current.next
-                is_first = False
-                continue
-            else:
-                # Either the next node is too high or we reached the end of that
-                # layer. Attempt to descend.
-                if current.down is not None:
-                    current = current.down
-                    layer_offset += 1
-                    continue
+            for node, inserted in since:
+                if inserted:
+                    added.add(id(node))
+                    self._live_added += 1
+                elif id(node) in added:
+                    # In & out again since the snapshot.
+                    self._live_added -= 1
                 else:
-                    break
+                    # After any equal values, so they stay in removal order.
+                    offset = bisect.bisect_right(keys, node.value)
+                    keys.insert(offset, node.value)
+                    removed.insert(offset, node)
+
+            self._delta_stamp = stamp
+
+        return self._added, self._removed, self._keys, self._live_added
+
+    def find(self, value):
+        """
+        Looks for a given value as of the snapshot. Returns a node holding
+        it if found, ``None`` if not.
+        """
+        added, removed, keys, live_added = self._changes()
+        offset = bisect.bisect_left(keys, value)
+
+        if offset < len(keys) and keys[offset] == value:
+            return removed[offset]
+
+        node = self.skiplist.ceiling(value)
+
+        while node is not None and node.value == value:
+            if id(node) not in added:
+                return node
+
+            node = node.next
 
         return None
 
-    def insert(self, value, **kwargs):
-        num_layers = len(self.layers)
-        height = self.generate_height()
+    def _batch(self, lo, hi, inclusive, limit):
+        """
+        Collects up to (around) ``limit`` nodes from the start of the range,
+        as of the snapshot, finishing any run of equal values.
 
-        # Make sure we have enough layers to accommodate.
-        if height > num_layers:
-            for i in range(num_layers, height):
-                self.layers.insert(0, self.list_class())
+        Returns the nodes & whether there may be more.
+        """
+        added, removed, keys, live_added = self._changes()
+        include_lo, include_hi = inclusive
+        live = self.skiplist.irange(lo, hi, inclusive)
 
-        down = None
+        if lo is None:
+            start = 0
+        elif include_lo:
+            start = bisect.bisect_left(keys, lo)
+        else:
+            start = bisect.bisect_right(keys, lo)
 
-        for i in range(height):
-            new_node = self.node_class(value=value, **kwargs)
-            self.layers[num_layers - (i + 1)].insert(new_node)
-            new_node.down = down
-            down = new_node
+        if hi is None:
+            stop = len(keys)
+        elif include_hi:
+            stop = bisect.bisect_right(keys, hi)
+        else:
+            stop = bisect.bisect_left(keys, hi)
 
-    def remove(self, value):
-        node = self.find(value)
+        batch = []
+        node = next(live, None)
 
-        if node is None:
-            return None
+        while True:
+            while node is not None and id(node) in added:
+                node = next(live, None)
 
-        # FIXME: This is bad.
-        #        The other operations can be O(log N), but without knowing what
-        #        layer offset we found the node in, we can't properly remove it
-        #        without reaching in.
-        #        For now, let's settle on something that works but is slow.
-        for layer in self.layers:
-            layer.remove(node)
+            # Merge the two, with removed nodes first amongst equal values.
+            if start < stop and (node is None or keys[start] <= node.value):
+                candidate = removed[start]
+                start += 1
+            elif node is not None:
+                candidate = node
+                node = next(live, None)
+            else:
+                return batch, False
 
-    def debug(self, column_width=4):
+            if (limit is not None and len(batch) >= limit and
+                    candidate.value != batch[-1].value):
+                return batch, True
+
+            batch.append(candidate)
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True), reverse=False):
         """
-        Prints a representation of the skiplist's structure.
+        Lazily yields the nodes whose values fell between ``lo`` & ``hi``
+        when the snapshot was taken (see ``Skiplist.irange``).
 
-        Default ``column_width`` parameter is ``4``.
+        With ``reverse=True``, the range is collected in one go, then
+        yielded backward.
         """
-        column_format_string = "{:" + str(column_width) + "} "
-        full = self.layers[-1]
+        if reverse:
+            batch, more = self._batch(lo, hi, inclusive, None)
 
-        for layer_offset, layer in enumerate(self.layers):
-            print("{:<3}".format(layer_offset), end=": ")
+            for node in reversed(batch):
+                yield node
 
-            for node in full:
-                if node.value in layer:
-                    print(column_format_string.format(node.value), end="")
-                else:
-                    print("     ", end="")
+            return
+
+        include_hi = inclusive[1]
+
+        while True:
+            batch, more = self._batch(lo, hi, inclusive, self.batch_size)
+
+            for node in batch:
+                yield node
+
+            if not more:
+                return
+
+            lo = batch[-1].value
+            inclusive = (False, include_hi)
+
+    def values(self):
+        """
+        Yields each value, as of the snapshot.
+        """
+        for node in self.irange():
+            yield node.value
+
+
+class Skiplist(SetOperationsMixin):
+    """
+    Implements a basic skiplist.
+
+    A skiplist provides a quickly searchable structure (like a balanced binary
+    tree) that also updates fairly cheaply (no nasty rebalancing acts).
+
+    In other words, it's awesome.
+
+    Supports sorted set algebra with another ``Skiplist`` (see
+    ``SetOperationsMixin``). Where only matching values matter from one
+    side (as with ``intersection``), that side is galloped through with
+    finger searches, so a small skiplist against a big one costs
+    O(k log(n / k)) rather than O(n).
+
+    See http://en.wikipedia.org/wiki/Skip_list for more information.
+    """
+    list_class = SortedLinkedList
+    node_class = SkiplistNode
+    snapshot_class = SkiplistSnapshot
+    max_layers = 32
+    probability = 0.5
+    cache_size = None
+
+    def __init__(self, list_class=None, node_class=None, max_layers=None,
+                 probability=None, cache_size=None, seed=None):
+        if list_class is not None:
+            self.list_class = list_class
+
+        if node_class is not None:
+            self.node_class = node_class
+
+        if max_layers is not None:
+            self.max_layers = max_layers
+
+        if probability is not None:
+            self.probability = probability
+
+        if cache_size is not None:
+            self.cache_size = cache_size
+
+        self.layers = [
+            self.list_class()
+        ]
+        # Each skiplist has its own source of tower heights, so a ``seed``
+        # makes the structure (& so its performance) reproducible.
+        self.seed = seed
+        self.random = random.Random(seed)
+        # Bumped on every change, so fingers can tell if they're stale.
+        self.version = 0
+        # An optional LRU cache of values to their (bottom layer) nodes, in
+        # front of ``find``. Values need to be hashable to use it.
+        self.cache = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        if self.cache_size:
+            self.cache = collections.OrderedDict()
+
+        self._reset_history()
+        self._stats = None
+
+    def __str__(self):
+        return 'Skiplist: {0} items'.format(len(self.layers[-1]))
+
+    def __len__(self):
+        return len(self.layers[-1])
+
+    def __contains__(self, value):
+        return self.find(value) is not None
+
+    def __iter__(self):
+        return self.layers[-1].nodes()
+
+    def __reversed__(self):
+        return self.irange(reverse=True)
+
+    def __getitem__(self, offset):
+        return self.select(offset)
+
+    @classmethod
+    def from_sorted(cls, values, deterministic=False, **kwargs):
+        """
+        Builds a new skiplist from already-sorted values in a single, linear
+        pass (no searching involved).
+
+        By default, heights are random (as with ``insert``). With
+        ``deterministic=True``, they're assigned evenly instead: every
+        ``1 / probability``-th value is promoted a layer, every
+        ``(1 / probability) ** 2``-th is promoted two & so on.
+
+        Any other keyword arguments are passed along to the constructor.
+        Raises an ``InsertError`` if the values turn out not to be sorted.
+        """
+        skip = cls(**kwargs)
+        skip._build(values, deterministic=deterministic)
+        return skip
+
+    def _build(self, values, deterministic=False, heights=None,
+               payloads=None):
+        """
+        Fills an empty skiplist from sorted values, appending a tower at the
+        end of the layers for each one.
+
+        ``heights`` can provide the height of each tower (in the same order
+        as ``values``), rather than generating them. Likewise, ``payloads``
+        can provide the extra keyword arguments for each value's nodes.
+        """
+        if heights is not None:
+            heights = iter(heights)
+
+        if payloads is not None:
+            payloads = iter(payloads)
+
+        tails = [None]
+        tail_positions = [-1]
+        base = None
+
+        if self.probability:
+            base = max(int(round(1.0 / self.probability)), 2)
+
+        for index, value in enumerate(values):
+            if index and value < tails[0].value:
+                raise InsertError("Values must be provided in sorted order.")
+
+            if heights is not None:
+                height = next(heights)
+            elif not deterministic:
+                height = self.generate_height()
+            else:
+                height = 1
+                remaining = index + 1
+
+                while base and remaining % base == 0 and \
+                        height < self.max_layers:
+                    remaining //= base
+                    height += 1
+
+            while height > len(self.layers):
+                self.layers = [self.list_class()] + self.layers
+                tails.append(None)
+                tail_positions.append(-1)
+
+            down = None
+            payload = {}
+
+            if payloads is not None:
+                payload = next(payloads)
+
+            for level in range(height):
+                layer = self.layers[-1 - level]
+                new_node = self.node_class(
+                    value=value,
+                    down=down,
+                    width=index - tail_positions[level],
+                    **payload
+                )
+
+                # The order's already been checked, so link it up directly.
+                if tails[level] is None:
+                    layer.head = new_node
+                else:
+                    tails[level].next = new_node
+
+                layer.size += 1
+
+                tails[level] = new_node
+                tail_positions[level] = index
+                down = new_node
+
+            if self.history is not None:
+                self.history.append((tails[0], True))
+
+        self.version += 1
+
+    def bulk_insert(self, values):
+        """
+        Inserts many (unsorted) values at once.
+
+        The values are sorted first. If the skiplist is empty, it's then
+        built in a single linear pass (see ``from_sorted``). Otherwise,
+        they're inserted as a batch (see ``insert_many``), each search
+        picking up from where the last one left off.
+        """
+        values = sorted(values)
+
+        if not len(self):
+            self._build(values)
+            return
+
+        self.insert_many(values)
+
+    def nodes(self):
+        """
+        Yields each (bottom layer) node in sorted order.
+        """
+        return self.layers[-1].nodes()
+
+    def values(self):
+        """
+        Yields each value in sorted order.
+        """
+        return self.layers[-1].values()
+
+    def heights(self):
+        """
+        Returns the height of each value's tower, in sorted order.
+
+        Each upper layer's widths add up to its nodes' bottom layer offsets,
+        so it's linear in the total number of nodes.
+        """
+        heights = [1] * len(self)
+
+        for layer in self.layers[:-1]:
+            offset = -1
+            node = layer.head
+
+            while node is not None:
+                offset += node.width
+                heights[offset] += 1
+                node = node.next
+
+        return heights
+
+    def dump(self, path):
+        """
+        Writes a compact binary snapshot of the skiplist to ``path``.
+
+        The values must all be ints (stored as 64-bit integers), all floats
+        (or a mix of ints & floats, stored as doubles), all ``str`` (stored
+        as UTF-8) or all ``bytes``. Any other data on the nodes isn't saved.
+
+        The layout (all little-endian) is a 16 byte header (the magic
+        ``PYSKIP``, a format version byte, a key kind byte of ``q``, ``d``,
+        ``s`` or ``b`` & the number of values as a ``uint64``), then the
+        sorted keys, then one byte per value giving its tower height. Ints
+        & floats are fixed-width. Strings & bytes are stored as
+        ``count + 1`` ``uint64`` offsets followed by the concatenated data.
+        """
+        values = list(self.values())
+        kind = snapshot_kind(values)
+
+        with open(path, 'wb') as snapshot:
+            snapshot.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                SNAPSHOT_VERSION,
+                kind,
+                len(values)
+            ))
+
+            if kind in (b'q', b'd'):
+                snapshot.write(array.array(kind.decode('ascii'), values)
+                               .tobytes())
+            else:
+                if kind == b's':
+                    values = [value.encode('utf-8') for value in values]
+
+                offsets = array.array('Q', [0])
+
+                for value in values:
+                    offsets.append(offsets[-1] + len(value))
+
+                snapshot.write(offsets.tobytes())
+                snapshot.write(b''.join(values))
+
+            snapshot.write(bytes(bytearray(self.heights())))
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Builds a new skiplist from a snapshot written by ``dump``, in a
+        single linear pass, with the same tower heights as before.
+
+        Any keyword arguments are passed along to the constructor. Raises a
+        ``SnapshotError`` if a stored height is out of range (below one, or
+        above ``max_layers``).
+        """
+        with MappedSkiplist(path) as mapped:
+            skip = cls(**kwargs)
+            heights = mapped.heights
+
+            if len(heights) and (min(heights) < 1 or
+                                 max(heights) > skip.max_layers):
+                raise SnapshotError(
+                    "'{0}' has heights outside 1 to {1}.".format(
+                        path,
+                        skip.max_layers
+                    )
+                )
+
+            skip._build(iter(mapped), heights=heights)
+            return skip
+
+    def __getstate__(self):
+        """
+        Flattens the skiplist for pickling, as a list of the sorted values &
+        a byte per value for its tower height (rather than letting pickle
+        recurse through every node).
+
+        Any extra attributes on the bottom layer nodes (say, ``SkipDict``'s
+        keys & data) are kept alongside, a dict per value.
+        """
+        state = dict(self.__dict__)
+        del state['layers']
+        state['cache'] = None
+
+        for name in ('history', 'history_base', 'snapshots'):
+            del state[name]
+
+        # Stats mode swaps in instance methods, which can't be pickled.
+        for name in STATS_METHODS:
+            state.pop(name, None)
+
+        state['_stats'] = None
+        values = list(self.values())
+        payloads = None
+
+        for offset, node in enumerate(self.layers[-1].nodes()):
+            payload = self._payload(node)
+
+            if payload is None:
+                continue
+
+            if payloads is None:
+                payloads = [{} for value in values]
+
+            payloads[offset] = payload
+
+        state['values'] = values
+        state['heights'] = bytes(bytearray(self.heights()))
+        state['payloads'] = payloads
+        return state
+
+    def _payload(self, node):
+        """
+        Returns a dict of any extra attributes on a bottom layer node (say,
+        ``SkipDict``'s keys & data), or ``None`` if there aren't any.
+        """
+        attributes = vars(node)
+
+        # Plain nodes only have the four linking attributes.
+        if len(attributes) <= 4:
+            return None
+
+        return dict(
+            (name, attribute)
+            for name, attribute in attributes.items()
+            if name not in ('value', 'next', 'down', 'width')
+        )
+
+    def __setstate__(self, state):
+        """
+        Rebuilds a pickled skiplist in a single linear pass.
+        """
+        state = dict(state)
+        values = state.pop('values')
+        heights = state.pop('heights')
+        payloads = state.pop('payloads')
+        self.__dict__.update(state)
+        self.layers = [self.list_class()]
+        self._reset_history()
+
+        if self.cache_size:
+            self.cache = collections.OrderedDict()
+
+        version = self.version
+        self._build(values, heights=bytearray(heights), payloads=payloads)
+        self.version = version
+
+    def __copy__(self):
+        """
+        Copies the skiplist's structure (new nodes, the same heights) while
+        sharing the values & any payloads.
+        """
+        skip = self.__class__.__new__(self.__class__)
+        skip.__setstate__(self.__getstate__())
+        # Its own generator (in the same state), so the two don't interleave
+        # their height draws.
+        skip.random = copy.copy(self.random)
+        return skip
+
+    def __deepcopy__(self, memo):
+        skip = self.__class__.__new__(self.__class__)
+        memo[id(self)] = skip
+        skip.__setstate__(copy.deepcopy(self.__getstate__(), memo))
+        return skip
+
+    def _reset_history(self):
+        # While any snapshots are open, every bottom layer node that's
+        # inserted or removed is logged (as ``(node, inserted)``), so they can
+        # work back from the live state. ``history_base`` is the overall
+        # position of ``history[0]``, since entries no snapshot needs are
+        # dropped from the front.
+        self.history = None
+        self.history_base = 0
+        self.snapshots = {}
+
+    def snapshot(self):
+        """
+        Returns a read-only, point-in-time view of the skiplist (see
+        ``SkiplistSnapshot``).
+
+        Nothing is copied. Until the snapshot is closed (or garbage
+        collected), changes are logged so it can work back from the live
+        state.
+        """
+        if self.history is None:
+            self.history = []
+
+        start = self.history_base + len(self.history)
+        snapshot = self.snapshot_class(self, start)
+        self.snapshots[weakref.ref(snapshot, self._release)] = snapshot.start
+        return snapshot
+
+    def _release(self, ref):
+        """
+        Forgets a snapshot, dropping any logged changes that no remaining
+        snapshot needs.
+        """
+        if self.snapshots.pop(ref, None) is None:
+            return
+
+        if not self.snapshots:
+            self._reset_history()
+            return
+
+        first = min(self.snapshots.values())
+        del self.history[:first - self.history_base]
+        self.history_base = first
+
+    def _spawn(self):
+        """
+        Returns a new, empty skiplist with the same settings.
+        """
+        return self.__class__(
+            list_class=self.list_class,
+            node_class=self.node_class,
+            max_layers=self.max_layers,
+            probability=self.probability,
+            cache_size=self.cache_size,
+            seed=self.seed
+        )
+
+    def _seeker(self):
+        """
+        Returns a function for ``sorted_runs`` that jumps ahead through the
+        skiplist, each finger search starting from where the last one left
+        off.
+        """
+        state = {'hint': None}
+
+        def seek(node, value):
+            # Short gaps are cheaper to just walk.
+            for step in range(4):
+                if node is None or not node.value < value:
+                    return node
+
+                node = node.next
+
+            hint = self._predecessors(value, strict=True, hint=state['hint'])
+            state['hint'] = hint
+            previous = hint[0][-1]
+
+            if previous is None:
+                return self.layers[-1].head
+
+            return previous.next
+
+        return seek
+
+    def _runs(self, other, skip_self=False, skip_other=False):
+        return sorted_runs(
+            self.layers[-1].head,
+            other.layers[-1].head,
+            self._seeker() if skip_self else None,
+            other._seeker() if skip_other else None
+        )
+
+    def _from_values(self, values):
+        skip = self._spawn()
+        skip._build(values)
+        return skip
+
+    def _apply(self, additions, removals):
+        self.remove_many(removals)
+        self.insert_many(additions)
+
+    def layer_counts(self):
+        """
+        Returns the number of nodes in each layer (top layer first).
+
+        The layers keep their own counts, so this is cheap enough to export
+        as a metric.
+        """
+        return [len(layer) for layer in self.layers]
+
+    def generate_height(self):
+        """
+        Generates a random height for a new node.
+
+        Heights are geometrically distributed: each additional layer is added
+        with a chance of ``self.probability``. The height is capped at one more
+        than the current number of layers (& never exceeds
+        ``self.max_layers``).
+        """
+        limit = min(len(self.layers) + 1, self.max_layers)
+        height = 1
+        rand = self.random.random
+
+        while height < limit and rand() < self.probability:
+            height += 1
+
+        return height
+
+    def _predecessors(self, value, strict=False, hint=None):
+        """
+        Descends once from the top layer, recording the last node in each
+        layer whose value is less than or equal to ``value``.
+
+        If ``strict`` is ``True``, records the last node whose value is
+        strictly less than ``value`` instead.
+
+        A ``hint`` (the result of an earlier call, on the skiplist as it is
+        now) lets the search start from there: it climbs only as high as it
+        needs to before heading right & back down, so nearby values are
+        found in O(log d) (for a distance of ``d``) rather than O(log n).
+
+        Returns a pair of lists with one entry per layer (top first): the
+        nodes & their positions in the bottom layer. A node of ``None`` (at
+        position ``-1``) means the value belongs before that layer's head.
+        """
+        layers = self.layers
+        update, positions, start = self._climb(value, strict, hint)
+        current = update[start]
+        position = positions[start]
+
+        for offset in range(start, len(layers)):
+            if current is None:
+                next_node = layers[offset].head
+            else:
+                next_node = current.next
+
+            if strict:
+                while next_node is not None and next_node.value < value:
+                    current = next_node
+                    position += current.width
+                    next_node = current.next
+            else:
+                while next_node is not None and next_node.value <= value:
+                    current = next_node
+                    position += current.width
+                    next_node = current.next
+
+            update[offset] = current
+            positions[offset] = position
+
+            if current is not None:
+                current = current.down
+
+        return update, positions
+
+    def _climb(self, value, strict, hint):
+        """
+        Works out where ``_predecessors`` should start its descent from.
+
+        Returns the recorded nodes & positions (see ``_predecessors``) &
+        the layer to start from: the top layer without a ``hint``, or
+        otherwise the lowest one the hint is still good for.
+        """
+        layers = self.layers
+
+        if hint is None:
+            return [None] * len(layers), [-1] * len(layers), 0
+
+        update, positions = hint
+        # Layers only ever come & go at the top.
+        missing = len(layers) - len(update)
+
+        if missing >= 0:
+            update = [None] * missing + update
+            positions = [-1] * missing + positions
+        else:
+            update = update[-missing:]
+            positions = positions[-missing:]
+
+        # Climb until the recorded node in a layer isn't past the value
+        # (we can't walk backward) & the next one is (so the layers above
+        # are already right).
+        start = len(layers) - 1
+
+        while True:
+            current = update[start]
+
+            if current is None:
+                ahead = False
+                next_node = layers[start].head
+            elif strict:
+                ahead = not current.value < value
+                next_node = current.next
+            else:
+                ahead = value < current.value
+                next_node = current.next
+
+            if not ahead:
+                if next_node is None:
+                    break
+
+                if strict and not next_node.value < value:
+                    break
+
+                if not strict and not next_node.value <= value:
+                    break
+
+            if start == 0:
+                if ahead:
+                    # Nothing recorded is usable, so start from the top.
+                    update[0] = None
+                    positions[0] = -1
+
+                break
+
+            start -= 1
+
+        return update, positions, start
+
+    def rank(self, value):
+        """
+        Returns the number of values in the skiplist that are strictly less
+        than ``value``.
+
+        This is also the offset the first occurrence of ``value`` has (or
+        would have) in the skiplist.
+        """
+        update, positions = self._predecessors(value, strict=True)
+        return positions[-1] + 1
+
+    def select(self, offset):
+        """
+        Returns the (bottom layer) node at a given offset in sorted order.
+
+        Negative offsets count back from the end. Raises an ``IndexError`` if
+        the offset is out of range.
+        """
+        size = len(self)
+
+        if offset < 0:
+            offset += size
+
+        if offset < 0 or offset >= size:
+            raise IndexError("Index '{0}' out of range.".format(offset))
+
+        current = None
+        position = -1
+
+        for layer in self.layers:
+            if current is None:
+                next_node = layer.head
+            else:
+                next_node = current.next
+
+            while next_node is not None and \
+                    position + next_node.width <= offset:
+                current = next_node
+                position += current.width
+                next_node = current.next
+
+            if position == offset:
+                break
+
+            if current is not None:
+                current = current.down
+
+        # If we matched in an upper layer, drop down to the bottom node.
+        while current.down is not None:
+            current = current.down
+
+        return current
+
+    def bisect_left(self, value):
+        """
+        Returns the offset at which ``value`` would be inserted before any
+        existing equal values. The same as ``rank``.
+        """
+        return self.rank(value)
+
+    def bisect_right(self, value):
+        """
+        Returns the offset at which ``value`` would be inserted after any
+        existing equal values (the number of values less than or equal to
+        ``value``).
+        """
+        update, positions = self._predecessors(value)
+        return positions[-1] + 1
+
+    def _predecessor(self, value, strict=False):
+        """
+        Descends to the last bottom layer node whose value is less than or
+        equal to (or, if ``strict``, strictly less than) ``value``.
+
+        Returns ``None`` if the value belongs before the bottom layer's head.
+        """
+        current = None
+
+        for layer in self.layers:
+            if current is None:
+                next_node = layer.head
+            else:
+                next_node = current.next
+
+            if strict:
+                while next_node is not None and next_node.value < value:
+                    current = next_node
+                    next_node = current.next
+            else:
+                while next_node is not None and next_node.value <= value:
+                    current = next_node
+                    next_node = current.next
+
+            if current is not None and current.down is not None:
+                current = current.down
+
+        return current
+
+    def floor(self, value):
+        """
+        Returns the last node whose value is less than or equal to ``value``,
+        or ``None`` if there isn't one.
+        """
+        return self._predecessor(value)
+
+    def ceiling(self, value):
+        """
+        Returns the first node whose value is greater than or equal to
+        ``value``, or ``None`` if there isn't one.
+        """
+        previous = self._predecessor(value, strict=True)
+
+        if previous is None:
+            node = self.layers[-1].head
+        else:
+            node = previous.next
+
+        # A (lock-free) reader can have a smaller value slip in just after
+        # the predecessor, so step past any.
+        while node is not None and node.value < value:
+            node = node.next
+
+        return node
+
+    def min(self):
+        """
+        Returns the node with the smallest value (``None`` if empty).
+        """
+        return self.layers[-1].head
+
+    def max(self):
+        """
+        Returns the (last) node with the largest value (``None`` if empty).
+        """
+        current = None
+
+        for layer in self.layers:
+            if current is None:
+                next_node = layer.head
+            else:
+                next_node = current.next
+
+            while next_node is not None:
+                current = next_node
+                next_node = current.next
+
+            if current is not None and current.down is not None:
+                current = current.down
+
+        return current
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True), reverse=False):
+        """
+        Lazily yields the nodes whose values fall between ``lo`` & ``hi``, in
+        sorted order.
+
+        Either bound may be ``None`` to leave that end open. ``inclusive`` is
+        a pair of booleans controlling whether each bound is included.
+
+        Going forward, it descends once to the start & then streams along the
+        bottom layer. With ``reverse=True``, the bounds are turned into
+        offsets & each node is looked up by position (O(log n) per node),
+        since the layers are only singly linked.
+        """
+        include_lo, include_hi = inclusive
+
+        if reverse:
+            if lo is None:
+                start = 0
+            elif include_lo:
+                start = self.bisect_left(lo)
+            else:
+                start = self.bisect_right(lo)
+
+            if hi is None:
+                stop = len(self)
+            elif include_hi:
+                stop = self.bisect_right(hi)
+            else:
+                stop = self.bisect_left(hi)
+
+            for offset in range(stop - 1, start - 1, -1):
+                yield self.select(offset)
+
+            return
+
+        if lo is None:
+            node = self.layers[-1].head
+        else:
+            previous = self._predecessor(lo, strict=include_lo)
+
+            if previous is None:
+                node = self.layers[-1].head
+            else:
+                node = previous.next
+
+            # As with ``ceiling``, step past anything that slipped in.
+            if include_lo:
+                while node is not None and node.value < lo:
+                    node = node.next
+            else:
+                while node is not None and node.value <= lo:
+                    node = node.next
+
+        if hi is None:
+            while node is not None:
+                yield node
+                node = node.next
+        elif include_hi:
+            while node is not None and node.value <= hi:
+                yield node
+                node = node.next
+        else:
+            while node is not None and node.value < hi:
+                yield node
+                node = node.next
+
+    def finger(self, value=None):
+        """
+        Returns a new ``SkiplistFinger`` for this skiplist, optionally
+        positioned at ``value`` already.
+        """
+        finger = SkiplistFinger(self)
+
+        if value is not None:
+            self.find(value, finger=finger)
+
+        return finger
+
+    def find(self, value, finger=None):
+        """
+        Looks for a given value within the skiplist.
+
+        If a ``finger`` is provided, the search starts from wherever it last
+        left off (& it's updated to point here afterward).
+
+        Returns the (bottom layer) node holding the first occurrence of the
+        value if found, ``None`` if the value was not found.
+        """
+        if finger is None:
+            return self._cached_find(value)
+        else:
+            hint = self._predecessors(
+                value,
+                strict=True,
+                hint=finger.get_hint()
+            )
+            previous = hint[0][-1]
+
+            if previous is None:
+                node = self.layers[-1].head
+            else:
+                node = previous.next
+
+            finger.update(hint, node)
+
+        if node is not None and node.value == value:
+            return node
+
+        return None
+
+    def _cached_find(self, value):
+        """
+        Looks a value up, going through the LRU cache (if enabled).
+        """
+        cache = self.cache
+
+        if cache is not None:
+            # Pop & re-add to mark it as the most recently used.
+            node = cache.pop(value, None)
+
+            if node is not None:
+                cache[value] = node
+                self.cache_hits += 1
+                return node
+
+            self.cache_misses += 1
+
+        node = self.ceiling(value)
+
+        if node is None or node.value != value:
+            return None
+
+        if cache is not None:
+            cache[value] = node
+
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+        return node
+
+    def clear_cache(self):
+        """
+        Empties the lookup cache (if enabled) & resets its counters.
+        """
+        if self.cache is not None:
+            self.cache.clear()
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def contains_many(self, values):
+        """
+        Checks whether each of a batch of values is in the skiplist.
+
+        The batch is searched in sorted order, with each search starting from
+        where the previous one left off.
+
+        Returns a list of booleans, in the same order as ``values``.
+        """
+        values = list(values)
+        results = [False] * len(values)
+        hint = None
+
+        for offset in sorted(range(len(values)), key=values.__getitem__):
+            value = values[offset]
+            hint = self._predecessors(value, strict=True, hint=hint)
+            previous = hint[0][-1]
+
+            if previous is None:
+                node = self.layers[-1].head
+            else:
+                node = previous.next
+
+            results[offset] = node is not None and node.value == value
+
+        return results
+
+    def insert(self, value, finger=None, **kwargs):
+        """
+        Inserts a new value into the skiplist.
+
+        Makes a single descent from the top layer to find the insertion point
+        in every layer, then splices in a tower of nodes from the bottom up.
+        Duplicates are placed after any existing equal values.
+
+        If a ``finger`` is provided, the search starts from wherever it last
+        left off (& it's updated to point at the new node afterward).
+
+        Returns the new bottom layer node.
+        """
+        if finger is None:
+            return self._insert(value, kwargs=kwargs)[0]
+
+        node, hint = self._insert(
+            value,
+            hint=finger.get_hint(),
+            kwargs=kwargs
+        )
+        finger.update(hint, node)
+        return node
+
+    def _insert(self, value, hint=None, kwargs=None):
+        """
+        Does the work of ``insert``, optionally starting the search from a
+        ``hint`` (see ``_predecessors``).
+
+        Returns the new bottom layer node, plus a hint pointing at the new
+        tower, for use with later values that are no smaller.
+        """
+        if kwargs is None:
+            kwargs = {}
+
+        height = self.generate_height()
+
+        # Make sure we have enough layers to accommodate. The list of layers
+        # is replaced (rather than changed in place), so anyone partway
+        # through a search keeps a consistent view.
+        while height > len(self.layers):
+            self.layers = [self.list_class()] + self.layers
+
+        update, positions = self._predecessors(value, hint=hint)
+        bottom = len(self.layers) - 1
+        index = positions[bottom] + 1
+        down = None
+
+        for offset in range(bottom, -1, -1):
+            layer = self.layers[offset]
+            previous = update[offset]
+
+            if previous is None:
+                following = layer.head
+            else:
+                following = previous.next
+
+            if offset <= bottom - height:
+                # Above the new tower, the next node just spans one more.
+                if following is not None:
+                    following.width += 1
+
+                continue
+
+            new_node = self.node_class(value=value, **kwargs)
+            new_node.down = down
+            new_node.width = index - positions[offset]
+
+            if following is not None:
+                following.width -= new_node.width - 1
+
+            if previous is None:
+                layer.insert_first(new_node)
+            else:
+                layer.insert_after(previous, new_node)
+
+            if down is None:
+                inserted = new_node
+
+            update[offset] = new_node
+            positions[offset] = index
+            down = new_node
+
+        if self.history is not None:
+            self.history.append((inserted, True))
+
+        self.version += 1
+        return inserted, (update, positions)
+
+    def insert_many(self, values, **kwargs):
+        """
+        Inserts a batch of values.
+
+        The batch is handled in sorted order, with each search starting from
+        where the previous one left off, so runs of nearby values need very
+        little pointer chasing.
+
+        Returns the new bottom layer nodes, in the same order as ``values``.
+        """
+        values = list(values)
+        results = [None] * len(values)
+        hint = None
+
+        for offset in sorted(range(len(values)), key=values.__getitem__):
+            results[offset], hint = self._insert(
+                values[offset],
+                hint=hint,
+                kwargs=kwargs
+            )
+
+        return results
+
+    def _unlink(self, update):
+        """
+        Unlinks the tower that follows the given (strict) predecessors in the
+        bottom layer, keeping the widths in every layer correct.
+
+        Empty layers left at the top are dropped. Returns the removed bottom
+        layer node.
+        """
+        bottom = len(self.layers) - 1
+        below = None
+        target = None
+        in_tower = True
+
+        for offset in range(bottom, -1, -1):
+            layer = self.layers[offset]
+            previous = update[offset]
+
+            if previous is None:
+                node = layer.head
+            else:
+                node = previous.next
+
+            # The tower ends once the next node in this layer isn't stacked
+            # on top of the one we just removed.
+            if in_tower and (node is None or node.down is not below):
+                in_tower = False
+
+            if not in_tower:
+                # Above the tower, the next node just spans one fewer.
+                if node is not None:
+                    node.width -= 1
+
+                continue
+
+            if node.next is not None:
+                node.next.width += node.width - 1
+
+            if previous is None:
+                layer.remove_first()
+            else:
+                layer.remove_after(previous)
+
+            if target is None:
+                target = node
+
+            below = node
+
+        while len(self.layers) > 1 and self.layers[0].head is None:
+            self.layers = self.layers[1:]
+
+        if self.cache is not None:
+            # The first occurrence of the value may have just changed.
+            self.cache.pop(target.value, None)
+
+        if self.history is not None:
+            self.history.append((target, False))
+
+        self.version += 1
+        return target
+
+    def remove(self, value, finger=None):
+        """
+        Removes the first occurrence of a value from the skiplist.
+
+        Makes a single descent to find the predecessors in each layer, then
+        unlinks the whole tower. Empty layers left at the top are dropped.
+
+        If a ``finger`` is provided, the search starts from wherever it last
+        left off (& it's updated to point just past the removed node
+        afterward).
+
+        Returns the removed (bottom layer) node, or ``None`` if the value was
+        not found.
+        """
+        hint = None
+
+        if finger is not None:
+            hint = finger.get_hint()
+
+        update, positions = self._predecessors(value, strict=True, hint=hint)
+        previous = update[-1]
+
+        if previous is None:
+            target = self.layers[-1].head
+        else:
+            target = previous.next
+
+        if target is None or target.value != value:
+            if finger is not None:
+                finger.update((update, positions), target)
+
+            return None
+
+        removed = self._unlink(update)
+
+        if finger is not None:
+            # The predecessors all stay put, so the path remains good.
+            finger.update((update, positions), removed.next)
+
+        return removed
+
+    def _remove_matching(self, value, match):
+        """
+        Removes the first node holding ``value`` that ``match`` accepts, in a
+        single descent (walking along the run of equal values from there).
+
+        Returns the removed (bottom layer) node, or ``None`` if no node
+        matched.
+        """
+        update, positions = self._predecessors(value, strict=True)
+        previous = update[-1]
+        position = positions[-1] + 1
+
+        if previous is None:
+            node = self.layers[-1].head
+        else:
+            node = previous.next
+
+        while node is not None and node.value == value and not match(node):
+            node = node.next
+            position += 1
+
+        if node is None or node.value != value:
+            return None
+
+        # Any earlier equal values in the upper layers come before the tower.
+        for offset, layer in enumerate(self.layers):
+            current = update[offset]
+            current_position = positions[offset]
+
+            if current is None:
+                next_node = layer.head
+            else:
+                next_node = current.next
+
+            while next_node is not None and \
+                    current_position + next_node.width < position:
+                current = next_node
+                current_position += current.width
+                next_node = current.next
+
+            update[offset] = current
+
+        return self._unlink(update)
+
+    def remove_many(self, values):
+        """
+        Removes the first occurrence of each of a batch of values.
+
+        Like ``insert_many``, the batch is handled in sorted order, with each
+        search starting from where the previous one left off.
+
+        Returns the removed nodes (or ``None`` for values that weren't
+        found), in the same order as ``values``.
+        """
+        values = list(values)
+        results = [None] * len(values)
+        hint = None
+
+        for offset in sorted(range(len(values)), key=values.__getitem__):
+            value = values[offset]
+            hint = self._predecessors(value, strict=True, hint=hint)
+            previous = hint[0][-1]
+
+            if previous is None:
+                target = self.layers[-1].head
+            else:
+                target = previous.next
+
+            if target is not None and target.value == value:
+                # The predecessors all stay put, so the hint remains good.
+                results[offset] = self._unlink(hint[0])
+
+        return results
+
+    def pop(self, offset=-1):
+        """
+        Removes & returns the (bottom layer) node at a given offset in sorted
+        order. By default, the last node is removed.
+
+        Raises an ``IndexError`` if the offset is out of range.
+        """
+        size = len(self)
+
+        if offset < 0:
+            offset += size
+
+        if offset < 0 or offset >= size:
+            raise IndexError("Index '{0}' out of range.".format(offset))
+
+        update = []
+        current = None
+        position = -1
+
+        for layer in self.layers:
+            if current is None:
+                next_node = layer.head
+            else:
+                next_node = current.next
+
+            while next_node is not None and \
+                    position + next_node.width < offset:
+                current = next_node
+                position += current.width
+                next_node = current.next
+
+            update.append(current)
+
+            if current is not None:
+                current = current.down
+
+        return self._unlink(update)
+
+    def pop_min(self):
+        """
+        Removes & returns the node with the smallest value.
+        """
+        return self.pop(0)
+
+    def pop_max(self):
+        """
+        Removes & returns the node with the largest value.
+        """
+        return self.pop(-1)
+
+    def truncate_before(self, value, inclusive=False, detach=False):
+        """
+        Removes every value less than ``value`` (or less than or equal to,
+        if ``inclusive`` is ``True``), say to expire everything older than a
+        watermark.
+
+        Rather than removing the values one at a time, makes a single
+        descent & cuts every layer there (see ``_split``).
+
+        Returns the number of values removed. With ``detach=True``, returns
+        the removed values as a skiplist of their own instead (reusing their
+        nodes, so nothing is re-inserted).
+        """
+        update, positions = self._predecessors(value, strict=not inclusive)
+        return self._truncate(update, positions, keep_before=False,
+                              detach=detach)
+
+    def truncate_after(self, value, inclusive=False, detach=False):
+        """
+        Removes every value greater than ``value`` (or greater than or equal
+        to, if ``inclusive`` is ``True``).
+
+        Works like ``truncate_before``, returning the number of values
+        removed (or, with ``detach=True``, the removed values as a skiplist
+        of their own).
+        """
+        update, positions = self._predecessors(value, strict=inclusive)
+        return self._truncate(update, positions, keep_before=True,
+                              detach=detach)
+
+    def _truncate(self, update, positions, keep_before, detach):
+        count = positions[-1] + 1
+        size = len(self)
+
+        if keep_before:
+            removed = size - count
+        else:
+            removed = count
+
+        if not removed:
+            if detach:
+                return self._spawn()
+
+            return 0
+
+        if self.history is not None:
+            if keep_before:
+                node = update[-1]
+
+                if node is None:
+                    node = self.layers[-1].head
+                else:
+                    node = node.next
+            else:
+                node = self.layers[-1].head
+
+            for offset in range(removed):
+                self.history.append((node, False))
+                node = node.next
+
+        # The kept side always needs to end at the cut, while the removed
+        # side is only cut loose if it's going to be detached (otherwise,
+        # readers partway through it can carry on into the kept side).
+        before, after = self._split(
+            update,
+            positions,
+            cut=keep_before or detach
+        )
+
+        if keep_before:
+            self.layers, rest = before, after
+        else:
+            self.layers, rest = after, before
+
+        if self.cache is not None:
+            self.cache.clear()
+
+        self.version += 1
+
+        if not detach:
+            return removed
+
+        skip = self._spawn()
+        skip.layers = rest
+        skip.version += 1
+        return skip
+
+    def _split(self, update, positions, cut=True):
+        """
+        Splits the layers just after the given predecessors (see
+        ``_predecessors``), returning the layers before & after the split
+        (top first, each with empty top layers dropped).
+
+        The first node of each layer after the split has its width reset,
+        so both sides have correct widths. Unless ``cut`` is ``False``, the
+        last node of each layer before the split is unlinked from the rest.
+
+        The bottom layer's counts come from the positions, but each upper
+        layer's has to be counted, so those are walked on whichever side is
+        smaller.
+        """
+        count = positions[-1] + 1
+        size = len(self)
+        bottom = len(self.layers) - 1
+        before_layers = []
+        after_layers = []
+
+        for offset, layer in enumerate(self.layers):
+            previous = update[offset]
+            before = self.list_class()
+            after = self.list_class()
+
+            if previous is None:
+                following = layer.head
+            else:
+                following = previous.next
+                before.head = layer.head
+
+            if following is not None:
+                following.width += positions[offset] + 1 - count
+                after.head = following
+
+            if offset == bottom:
+                before.size = count
+            elif count <= size - count:
+                node = before.head
+
+                while node is not None and node is not following:
+                    before.size += 1
+                    node = node.next
+            else:
+                node = following
+
+                while node is not None:
+                    after.size += 1
+                    node = node.next
+
+                before.size = len(layer) - after.size
+
+            after.size = len(layer) - before.size
+
+            if cut and previous is not None:
+                previous.next = None
+
+            before_layers.append(before)
+            after_layers.append(after)
+
+        return self._trimmed(before_layers), self._trimmed(after_layers)
+
+    def _trimmed(self, layers):
+        while len(layers) > 1 and layers[0].head is None:
+            layers = layers[1:]
+
+        return layers
+
+    def debug(self, column_width=4):
+        """
+        Prints a representation of the skiplist's structure, followed by how
+        many nodes are in each layer (& how many a perfectly balanced
+        skiplist would have).
+
+        Default ``column_width`` parameter is ``4``.
+
+        Each node's tower height comes from ``heights``, so it's linear in
+        the size of the output.
+        """
+        column_format_string = "{:" + str(column_width) + "} "
+        blank = " " * (column_width + 1)
+        heights = self.heights()
+        values = list(self.values())
+        total = len(self.layers)
+
+        for layer_offset in range(total):
+            # Towers reach the top ``height`` layers of the bottom.
+            needed = total - layer_offset
+            print("{:<3}".format(layer_offset), end=": ")
+            print("".join(
+                column_format_string.format(value)
+                if height >= needed else blank
+                for value, height in zip(values, heights)
+            ))
+
+        print()
+        print(self.report())
+
+    def report(self):
+        """
+        Returns a summary of the structure: the number of nodes in each layer
+        (top first), next to the number expected from ``probability``, plus
+        how the tower heights are distributed.
+        """
+        size = len(self)
+        lines = ['{0}: {1} items, {2} layers'.format(
+            self.__class__.__name__,
+            size,
+            len(self.layers)
+        )]
+        counts = self.layer_counts()
+
+        for layer_offset, count in enumerate(counts):
+            level = len(counts) - 1 - layer_offset
+            expected = size * self.probability ** level
+            lines.append('{0:<3}: {1:>10} nodes ({2:.1f} expected)'.format(
+                layer_offset,
+                count,
+                expected
+            ))
+
+        heights = collections.Counter(self.heights())
+
+        for height in sorted(heights):
+            lines.append('height {0:<3}: {1:>10} towers'.format(
+                height,
+                heights[height]
+            ))
+
+        return '\n'.join(lines)
+
+    def enable_stats(self, callback=None):
+        """
+        Turns on stats mode, which records what each ``find``, ``insert`` &
+        ``remove`` costs: the comparisons made, the horizontal hops taken,
+        the layers descended through & (for writes) the tower's height.
+
+        The counts are gathered into histograms (see ``stats``). If given,
+        ``callback(operation, record)`` is also called after each one, with
+        the operation's name & a dict of its counts, say to feed a metrics
+        system.
+
+        It works by swapping instrumented versions of a few methods onto the
+        instance, so there's no overhead at all once ``disable_stats`` is
+        called (or before this is). The comparisons are counted by searching
+        for a stand-in for the value (see ``CountingKey``), so values need
+        to return ``NotImplemented`` when compared with an unknown type (as
+        the built-in types do). It isn't meant for use across threads.
+        """
+        if self._stats is not None:
+            self._stats['callback'] = callback
+            return
+
+        self._stats = {
+            'callback': callback,
+            'current': None,
+            'histograms': {},
+        }
+
+        for name in STATS_METHODS:
+            original = getattr(self, name)
+
+            if name in ('find', 'insert', 'remove'):
+                wrapper = self._stats_operation(name, original)
+            elif name == 'generate_height':
+                wrapper = self._stats_height(original)
+            elif name == '_unlink':
+                wrapper = self._stats_unlink(original)
+            elif name == '_climb':
+                wrapper = self._stats_climb(original)
+            else:
+                # ``_climb`` counts the levels for ``_predecessors``.
+                wrapper = self._stats_search(
+                    original,
+                    levels=name == '_predecessor'
+                )
+
+            setattr(self, name, wrapper)
+
+    def disable_stats(self):
+        """
+        Turns stats mode back off, discarding anything recorded.
+        """
+        for name in STATS_METHODS:
+            self.__dict__.pop(name, None)
+
+        self._stats = None
+
+    def reset_stats(self):
+        """
+        Clears the recorded stats (without turning stats mode off).
+        """
+        if self._stats is not None:
+            self._stats['histograms'] = {}
+
+    def stats(self):
+        """
+        Returns a snapshot of the recorded stats, as a dict per operation
+        with its ``count`` & a histogram (a dict of value to frequency) for
+        each of ``comparisons``, ``hops``, ``levels`` & ``height``.
+
+        Returns ``None`` if stats mode is off.
+        """
+        if self._stats is None:
+            return None
+
+        return dict(
+            (operation, dict(
+                (metric, dict(histogram)) if metric != 'count'
+                else (metric, histogram)
+                for metric, histogram in histograms.items()
+            ))
+            for operation, histograms in self._stats['histograms'].items()
+        )
+
+    def _stats_operation(self, operation, original):
+        stats = self._stats
+
+        def wrapper(*args, **kwargs):
+            record = {
+                'comparisons': 0,
+                'hops': 0,
+                'levels': 0,
+                'height': 0,
+            }
+            outer = stats['current']
+            stats['current'] = record
+
+            try:
+                result = original(*args, **kwargs)
+            finally:
+                stats['current'] = outer
+
+            histograms = stats['histograms'].get(operation)
+
+            if histograms is None:
+                histograms = stats['histograms'][operation] = {'count': 0}
+
+            histograms['count'] += 1
+
+            for metric, count in record.items():
+                histograms.setdefault(metric, collections.Counter())[
+                    count] += 1
+
+            if stats['callback'] is not None:
+                stats['callback'](operation, record)
+
+            return result
+
+        return wrapper
+
+    def _stats_search(self, original, levels):
+        stats = self._stats
+
+        def wrapper(value, *args, **kwargs):
+            record = stats['current']
+
+            if record is None:
+                return original(value, *args, **kwargs)
+
+            if levels:
+                record['levels'] += len(self.layers)
+
+            return original(CountingKey(value, record), *args, **kwargs)
+
+        return wrapper
+
+    def _stats_climb(self, original):
+        def wrapper(value, strict, hint):
+            if not isinstance(value, CountingKey):
+                return original(value, strict, hint)
+
+            value.climbing = True
+
+            try:
+                update, positions, start = original(value, strict, hint)
+            finally:
+                value.climbing = False
+
+            # Only the layers from ``start`` down are searched.
+            value.record['levels'] += len(self.layers) - start
+            return update, positions, start
+
+        return wrapper
+
+    def _stats_height(self, original):
+        stats = self._stats
+
+        def wrapper():
+            height = original()
+
+            if stats['current'] is not None:
+                stats['current']['height'] = height
+
+            return height
+
+        return wrapper
+
+    def _stats_unlink(self, original):
+        stats = self._stats
+
+        def wrapper(update):
+            before = sum(self.layer_counts())
+            target = original(update)
+
+            if stats['current'] is not None:
+                stats['current']['height'] = before - sum(self.layer_counts())
+
+            return target
+
+        return wrapper
+
+
+class ConcurrentSkiplistSnapshot(SkiplistSnapshot):
+    """
+    A snapshot of a ``ConcurrentSkiplist``.
+
+    Each lookup & each batch of a scan briefly takes the writer lock, so
+    the log of changes & the live nodes are read together. Only the changes
+    logged since the last one are folded in while it's held.
+    """
+    def __len__(self):
+        with self.skiplist.lock:
+            return super(ConcurrentSkiplistSnapshot, self).__len__()
+
+    def close(self):
+        with self.skiplist.lock:
+            super(ConcurrentSkiplistSnapshot, self).close()
+
+    def find(self, value):
+        with self.skiplist.lock:
+            return super(ConcurrentSkiplistSnapshot, self).find(value)
+
+    def _batch(self, lo, hi, inclusive, limit):
+        with self.skiplist.lock:
+            return super(ConcurrentSkiplistSnapshot, self)._batch(
+                lo,
+                hi,
+                inclusive,
+                limit
+            )
+
+
+class ConcurrentSkiplist(Skiplist):
+    """
+    A skiplist that can be shared between threads.
+
+    Writers (``insert``, ``remove``, ``pop``, truncation & the batch
+    methods) are serialized by a single lock. Value lookups (``find``
+    without a finger or cache, ``in``, ``floor``/``ceiling``, forward
+    ``irange`` & iteration) don't lock at all: writers only ever link a
+    node in once it's fully set up, unlinked nodes keep pointing forward &
+    the list of layers is replaced rather than changed in place, so readers
+    always see a consistent path.
+
+    The widths are only consistent between writes, so the positional
+    methods (``rank``, ``select``/``[]``, ``bisect_*`` & reverse ``irange``)
+    take the writer lock, as do ``heights``, ``dump``, ``report`` &
+    ``debug``.
+    """
+    snapshot_class = ConcurrentSkiplistSnapshot
+
+    def __init__(self, *args, **kwargs):
+        super(ConcurrentSkiplist, self).__init__(*args, **kwargs)
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        with self.lock:
+            state = super(ConcurrentSkiplist, self).__getstate__()
+
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.lock = threading.RLock()
+        super(ConcurrentSkiplist, self).__setstate__(state)
+
+    def heights(self):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).heights()
+
+    def dump(self, path):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).dump(path)
+
+    def report(self):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).report()
+
+    def debug(self, column_width=4):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).debug(column_width)
+
+    def snapshot(self):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).snapshot()
+
+    def _combined(self, *args, **kwargs):
+        with self.lock:
+            return super(ConcurrentSkiplist, self)._combined(*args, **kwargs)
+
+    def _adjust(self, *args, **kwargs):
+        with self.lock:
+            return super(ConcurrentSkiplist, self)._adjust(*args, **kwargs)
+
+    def _release(self, ref):
+        with self.lock:
+            return super(ConcurrentSkiplist, self)._release(ref)
+
+    def find(self, value, finger=None):
+        if finger is None and self.cache is None:
+            return super(ConcurrentSkiplist, self).find(value)
+
+        # A finger's recorded path is only good between writes, & a cache
+        # could pick up a node just as it's being removed.
+        with self.lock:
+            return super(ConcurrentSkiplist, self).find(value, finger=finger)
+
+    def insert(self, value, finger=None, **kwargs):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).insert(
+                value,
+                finger=finger,
+                **kwargs
+            )
+
+    def insert_many(self, values, **kwargs):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).insert_many(
+                values,
+                **kwargs
+            )
+
+    def bulk_insert(self, values):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).bulk_insert(values)
+
+    def remove(self, value, finger=None):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).remove(
+                value,
+                finger=finger
+            )
+
+    def _remove_matching(self, value, match):
+        with self.lock:
+            return super(ConcurrentSkiplist, self)._remove_matching(
+                value,
+                match
+            )
+
+    def remove_many(self, values):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).remove_many(values)
+
+    def pop(self, offset=-1):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).pop(offset)
+
+    def truncate_before(self, value, inclusive=False, detach=False):
+        """
+        See ``Skiplist.truncate_before``.
+
+        Detaching the removed values would mean cutting them loose from the
+        rest, stranding any lock-free reader partway through them. So here,
+        they're left linked & copied into a new skiplist instead (in a
+        single linear pass).
+        """
+        with self.lock:
+            if not detach:
+                return super(ConcurrentSkiplist, self).truncate_before(
+                    value,
+                    inclusive=inclusive
+                )
+
+            nodes = list(self.irange(hi=value, inclusive=(True, inclusive)))
+            payloads = [self._payload(node) or {} for node in nodes]
+            skip = self._spawn()
+            skip._build([node.value for node in nodes], payloads=payloads)
+            super(ConcurrentSkiplist, self).truncate_before(
+                value,
+                inclusive=inclusive
+            )
+            return skip
+
+    def truncate_after(self, value, inclusive=False, detach=False):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).truncate_after(
+                value,
+                inclusive=inclusive,
+                detach=detach
+            )
+
+    def rank(self, value):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).rank(value)
+
+    def bisect_right(self, value):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).bisect_right(value)
+
+    def select(self, offset):
+        with self.lock:
+            return super(ConcurrentSkiplist, self).select(offset)
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True), reverse=False):
+        if not reverse:
+            return super(ConcurrentSkiplist, self).irange(
+                lo,
+                hi,
+                inclusive=inclusive
+            )
+
+        # Walking backwards is positional, so take a consistent copy of the
+        # matching nodes.
+        with self.lock:
+            return iter(list(super(ConcurrentSkiplist, self).irange(
+                lo,
+                hi,
+                inclusive=inclusive,
+                reverse=True
+            )))
+
+
+class SkipDictNode(SkiplistNode):
+    """
+    A skiplist node that also carries a mapping's key & value.
+
+    The node's ``value`` holds the sort key (the result of the key function),
+    so comparisons never need to call back into it.
+    """
+    def __init__(self, value=None, next=None, down=None, width=1, key=None,
+                 data=None):
+        super(SkipDictNode, self).__init__(
+            value=value,
+            next=next,
+            down=down,
+            width=width
+        )
+        self.key = key
+        self.data = data
+
+
+class SkipDict(object):
+    """
+    A sorted mapping, built on top of a ``Skiplist``.
+
+    Keys are kept in sorted order. If a ``key`` function is provided, it's
+    called once per key on insert (& once per lookup) & the result is cached
+    on the node, so all the comparisons during a descent run on the cached
+    sort keys.
+    """
+    skiplist_class = Skiplist
+    node_class = SkipDictNode
+
+    def __init__(self, items=None, key=None, skiplist_class=None,
+                 node_class=None):
+        if skiplist_class is not None:
+            self.skiplist_class = skiplist_class
+
+        if node_class is not None:
+            self.node_class = node_class
+
+        self.key = key
+        self.skiplist = self.skiplist_class(node_class=self.node_class)
+
+        if items is not None:
+            if hasattr(items, 'items'):
+                items = items.items()
+
+            for key, data in items:
+                self[key] = data
+
+    def __str__(self):
+        return 'SkipDict: {0} items'.format(len(self))
+
+    def __len__(self):
+        return len(self.skiplist)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __getitem__(self, key):
+        node = self._find(key)
+
+        if node is None:
+            raise KeyError(key)
+
+        return node.data
+
+    def __setitem__(self, key, data):
+        sort_key = self._sort_key(key)
+        node = self._find(key, sort_key=sort_key)
+
+        if node is None:
+            node = self.skiplist.insert(sort_key)
+            node.key = key
+
+        node.data = data
+
+    def __delitem__(self, key):
+        if self._remove(key) is None:
+            raise KeyError(key)
+
+    def _sort_key(self, key):
+        if self.key is None:
+            return key
+
+        return self.key(key)
+
+    def _find(self, key, sort_key=None):
+        """
+        Returns the bottom layer node for a key, or ``None`` if the key isn't
+        present.
+        """
+        if sort_key is None:
+            sort_key = self._sort_key(key)
+
+        node = self.skiplist.ceiling(sort_key)
+
+        # Several keys may share a sort key. Walk along to the right one.
+        while node is not None and node.value == sort_key:
+            if node.key == key:
+                return node
+
+            node = node.next
+
+        return None
+
+    def _remove(self, key):
+        """
+        Removes the bottom layer node for a key in a single descent,
+        returning it (or ``None`` if the key isn't present).
+        """
+        # Several keys may share a sort key, so it has to be the right one.
+        return self.skiplist._remove_matching(
+            self._sort_key(key),
+            lambda node: node.key == key
+        )
+
+    def get(self, key, default=None):
+        """
+        Returns the value for a key, or ``default`` if it isn't present.
+        """
+        node = self._find(key)
+
+        if node is None:
+            return default
+
+        return node.data
+
+    def setdefault(self, key, default=None):
+        """
+        Returns the value for a key. If it isn't present, inserts it with
+        ``default`` as the value first.
+        """
+        sort_key = self._sort_key(key)
+        node = self._find(key, sort_key=sort_key)
+
+        if node is None:
+            node = self.skiplist.insert(sort_key)
+            node.key = key
+            node.data = default
+
+        return node.data
+
+    def pop(self, key, *args):
+        """
+        Removes a key & returns its value.
+
+        If the key isn't present, returns the default (if provided) or raises
+        a ``KeyError``.
+        """
+        node = self._remove(key)
+
+        if node is None:
+            if args:
+                return args[0]
+
+            raise KeyError(key)
+
+        return node.data
+
+    def keys(self):
+        """
+        Lazily yields the keys in sorted order.
+        """
+        for node in self.skiplist:
+            yield node.key
+
+    def values(self):
+        """
+        Lazily yields the values, in the sorted order of their keys.
+        """
+        for node in self.skiplist:
+            yield node.data
+
+    def items(self):
+        """
+        Lazily yields ``(key, value)`` pairs in sorted order.
+        """
+        for node in self.skiplist:
+            yield node.key, node.data
+
+
+class SkipBagNode(SkiplistNode):
+    """
+    A skiplist node that also carries how many times its value occurs.
+    """
+    def __init__(self, value=None, next=None, down=None, width=1, count=1):
+        super(SkipBagNode, self).__init__(
+            value=value,
+            next=next,
+            down=down,
+            width=width
+        )
+        self.count = count
+
+
+class SkipBag(object):
+    """
+    A sorted multiset, built on top of a ``Skiplist``.
+
+    Each distinct value gets a single tower, with a count of its
+    occurrences on the bottom layer node. So adding or discarding a
+    duplicate is a lookup & an increment (rather than splicing in or out a
+    whole tower of its own), & duplicates take no extra memory.
+
+    ``len()`` is the total number of occurrences, while iterating yields
+    each value as many times as it occurs.
+    """
+    skiplist_class = Skiplist
+    node_class = SkipBagNode
+
+    def __init__(self, values=None, skiplist_class=None, node_class=None):
+        if skiplist_class is not None:
+            self.skiplist_class = skiplist_class
+
+        if node_class is not None:
+            self.node_class = node_class
+
+        self.skiplist = self.skiplist_class(node_class=self.node_class)
+        self.size = 0
+
+        if values is not None:
+            if hasattr(values, 'items'):
+                for value, count in values.items():
+                    self.add(value, count)
+            else:
+                for value in values:
+                    self.add(value)
+
+    def __str__(self):
+        return 'SkipBag: {0} items'.format(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for node in self.skiplist:
+            for i in range(node.count):
+                yield node.value
+
+    def __contains__(self, value):
+        return self.skiplist.find(value) is not None
+
+    def add(self, value, n=1):
+        """
+        Adds ``n`` occurrences of a value.
+
+        Returns the value's node.
+        """
+        if n < 1:
+            raise ValueError("Counts must be positive.")
+
+        node = self.skiplist.find(value)
+
+        if node is None:
+            node = self.skiplist.insert(value, count=n)
+        else:
+            node.count += n
+
+        self.size += n
+        return node
+
+    def discard(self, value, n=1):
+        """
+        Removes up to ``n`` occurrences of a value. The value's tower is only
+        unlinked once none are left.
+
+        Returns how many occurrences were removed (``0`` if the value wasn't
+        present).
+        """
+        if n < 1:
+            raise ValueError("Counts must be positive.")
+
+        node = self.skiplist.find(value)
+
+        if node is None:
+            return 0
+
+        if node.count > n:
+            node.count -= n
+        else:
+            n = node.count
+            self.skiplist.remove(value)
+
+        self.size -= n
+        return n
+
+    def count(self, value):
+        """
+        Returns how many times a value occurs (``0`` if it isn't present).
+        """
+        node = self.skiplist.find(value)
+
+        if node is None:
+            return 0
+
+        return node.count
+
+    def distinct(self):
+        """
+        Returns the number of distinct values.
+        """
+        return len(self.skiplist)
+
+    def keys(self):
+        """
+        Lazily yields each distinct value in sorted order.
+        """
+        for node in self.skiplist:
+            yield node.value
+
+    def items(self):
+        """
+        Lazily yields ``(value, count)`` pairs in sorted order.
+        """
+        for node in self.skiplist:
+            yield node.value, node.count
+
+
+class TowerNode(object):
+    """
+    A compact skiplist node: one object per value, holding a forward pointer
+    for each layer it appears in (``next[0]`` is the bottom layer).
+
+    Uses ``__slots__``, so there's no per-node ``__dict__`` & the value is
+    only referenced once, however tall the tower is.
+    """
+    __slots__ = ('value', 'next')
+
+    def __init__(self, value=None, height=1):
+        self.value = value
+        self.next = [None] * height
+
+    def __repr__(self):
+        return "{0}: {1}".format(self.__class__.__name__, self.value)
+
+
+class CompactSkiplist(object):
+    """
+    A memory-conscious skiplist, using a single ``TowerNode`` per value
+    (rather than a linked list per layer & a node per layer per value).
+
+    Provides the core ``insert``/``find``/``remove``/iteration API of
+    ``Skiplist``. Nodes don't carry widths, so there's no positional access.
+    """
+    node_class = TowerNode
+    max_layers = 32
+    probability = 0.5
+
+    def __init__(self, node_class=None, max_layers=None, probability=None,
+                 seed=None):
+        if node_class is not None:
+            self.node_class = node_class
+
+        if max_layers is not None:
+            self.max_layers = max_layers
+
+        if probability is not None:
+            self.probability = probability
+
+        # A sentinel tower, as tall as we'll ever need.
+        self.head = self.node_class(height=self.max_layers)
+        self.height = 1
+        self.size = 0
+        self.random = random.Random(seed)
+
+    def __str__(self):
+        return 'CompactSkiplist: {0} items'.format(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, value):
+        return self.find(value) is not None
+
+    def __iter__(self):
+        node = self.head.next[0]
+
+        while node is not None:
+            yield node
+            node = node.next[0]
+
+    def generate_height(self):
+        """
+        Generates a random height for a new node.
+
+        Heights are geometrically distributed: each additional layer is added
+        with a chance of ``self.probability``, capped at one more than the
+        current height (& never more than ``self.max_layers``).
+        """
+        limit = min(self.height + 1, self.max_layers)
+        height = 1
+
+        while height < limit and self.random.random() < self.probability:
+            height += 1
+
+        return height
+
+    def _predecessors(self, value, strict=False):
+        """
+        Descends once from the top layer, recording the last node in each
+        layer whose value is less than or equal to (or, if ``strict``,
+        strictly less than) ``value``.
+
+        Returns a list indexed by layer (``0`` is the bottom layer). The head
+        sentinel stands in wherever the value belongs first.
+        """
+        update = [self.head] * self.height
+        node = self.head
+
+        for level in range(self.height - 1, -1, -1):
+            next_node = node.next[level]
+
+            if strict:
+                while next_node is not None and next_node.value < value:
+                    node = next_node
+                    next_node = node.next[level]
+            else:
+                while next_node is not None and next_node.value <= value:
+                    node = next_node
+                    next_node = node.next[level]
+
+            update[level] = node
+
+        return update
+
+    def find(self, value):
+        """
+        Looks for a given value within the skiplist.
+
+        Returns the node holding the first occurrence of the value if found,
+        ``None`` if the value was not found.
+        """
+        node = self.head
+
+        for level in range(self.height - 1, -1, -1):
+            next_node = node.next[level]
+
+            while next_node is not None and next_node.value < value:
+                node = next_node
+                next_node = node.next[level]
+
+        node = node.next[0]
+
+        if node is not None and node.value == value:
+            return node
+
+        return None
+
+    def insert(self, value):
+        """
+        Inserts a new value into the skiplist, after any existing equal
+        values.
+
+        Returns the new node.
+        """
+        height = self.generate_height()
+        update = self._predecessors(value)
+
+        if height > self.height:
+            update.extend([self.head] * (height - self.height))
+            self.height = height
+
+        new_node = self.node_class(value=value, height=height)
+        forward = new_node.next
+
+        for level in range(height):
+            previous = update[level].next
+            forward[level] = previous[level]
+            previous[level] = new_node
+
+        self.size += 1
+        return new_node
+
+    def remove(self, value):
+        """
+        Removes the first occurrence of a value from the skiplist.
+
+        Returns the removed node, or ``None`` if the value was not found.
+        """
+        update = self._predecessors(value, strict=True)
+        target = update[0].next[0]
+
+        if target is None or target.value != value:
+            return None
+
+        forward = target.next
+
+        for level in range(len(forward)):
+            update[level].next[level] = forward[level]
+
+        while self.height > 1 and self.head.next[self.height - 1] is None:
+            self.height -= 1
+
+        self.size -= 1
+        return target
+
+
+class DeterministicSkiplist(object):
+    """
+    A deterministic (1-2-3) skiplist, with worst-case O(log n) ``find``,
+    ``insert`` & ``remove``, & a structure that depends only on the order of
+    the operations (no randomness at all).
+
+    Like ``CompactSkiplist``, it uses a ``TowerNode`` per value. Rather than
+    picking heights at random, it keeps every gap (the nodes one layer down
+    between two neighbouring nodes of a layer, or after the head) to 1, 2
+    or 3 nodes. So a search never takes more than 3 hops along any layer,
+    & there are at most ~log2(n) layers.
+
+    Both writes fix gaps up on the way down (after Munro, Papadakis &
+    Sedgewick's top-down 1-2-3 skiplists). ``insert`` splits any full gap
+    it's about to enter by promoting its middle node. ``remove`` tops up
+    any single-node gap it's about to enter, by demoting the node between it
+    & a neighbouring gap (merging the two) & promoting one back if that
+    makes too many. A removed value with a tall tower has its tower handed
+    to the node just before it, so other nodes never change value.
+    """
+    node_class = TowerNode
+
+    def __init__(self, node_class=None):
+        if node_class is not None:
+            self.node_class = node_class
+
+        # A sentinel tower, grown as layers are added.
+        self.head = self.node_class(height=1)
+        self.height = 1
+        self.size = 0
+
+    def __str__(self):
+        return 'DeterministicSkiplist: {0} items'.format(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, value):
+        return self.find(value) is not None
+
+    def __iter__(self):
+        node = self.head.next[0]
+
+        while node is not None:
+            yield node
+            node = node.next[0]
+
+    def _gap(self, start, end, level):
+        """
+        Returns the nodes in ``level`` between ``start`` & ``end`` (``None``
+        for the end of the layer).
+        """
+        nodes = []
+        node = start.next[level]
+
+        while node is not end:
+            nodes.append(node)
+            node = node.next[level]
+
+        return nodes
+
+    def _promote(self, node, previous, level):
+        # Adds ``node`` (whose tower reaches just below ``level``) to
+        # ``level``, after ``previous``.
+        node.next.append(previous.next[level])
+        previous.next[level] = node
+
+    def _demote(self, node, previous, level):
+        # Takes ``node`` (whose tower tops out at ``level``) out of ``level``,
+        # where it follows ``previous``.
+        previous.next[level] = node.next[level]
+        node.next.pop()
+
+    def find(self, value):
+        """
+        Looks for a given value within the skiplist.
+
+        Returns the node holding the first occurrence of the value if found,
+        ``None`` if the value was not found.
+        """
+        node = self.head
+
+        for level in range(self.height - 1, -1, -1):
+            next_node = node.next[level]
+
+            while next_node is not None and next_node.value < value:
+                node = next_node
+                next_node = node.next[level]
+
+        node = node.next[0]
+
+        if node is not None and node.value == value:
+            return node
+
+        return None
+
+    def insert(self, value):
+        """
+        Inserts a new value into the skiplist, after any existing equal
+        values.
+
+        Returns the new node.
+        """
+        top = self.height - 1
+        top_gap = self._gap(self.head, None, top)
+
+        if len(top_gap) == 3:
+            # Full at the top, so start a new layer with the middle node.
+            self.head.next.append(None)
+            self._promote(top_gap[1], self.head, top + 1)
+            self.height += 1
+
+        node = self.head
+
+        for level in range(self.height - 1, 0, -1):
+            next_node = node.next[level]
+
+            while next_node is not None and next_node.value <= value:
+                node = next_node
+                next_node = node.next[level]
+
+            gap = self._gap(node, next_node, level - 1)
+
+            if len(gap) == 3:
+                middle = gap[1]
+                self._promote(middle, node, level)
+
+                if middle.value <= value:
+                    node = middle
+
+        next_node = node.next[0]
+
+        while next_node is not None and next_node.value <= value:
+            node = next_node
+            next_node = node.next[0]
+
+        new_node = self.node_class(value=value, height=1)
+        new_node.next[0] = next_node
+        node.next[0] = new_node
+        self.size += 1
+        return new_node
+
+    def remove(self, value):
+        """
+        Removes the first occurrence of a value from the skiplist.
+
+        Returns the removed node, or ``None`` if the value was not found.
+        """
+        # The last node before the value in each layer.
+        update = [self.head] * self.height
+        node = self.head
+
+        for level in range(self.height - 1, 0, -1):
+            previous = None
+            next_node = node.next[level]
+
+            while next_node is not None and next_node.value < value:
+                previous = node
+                node = next_node
+                next_node = node.next[level]
+
+            if len(self._gap(node, next_node, level - 1)) == 1:
+                # The layer above was topped up already (or is the top
+                # layer), so there's always a node on one side or the other
+                # that's the top of its tower.
+                if next_node is not None and len(next_node.next) == level + 1:
+                    following = next_node.next[level]
+                    self._demote(next_node, node, level)
+                    gap = self._gap(node, following, level - 1)
+
+                    if len(gap) > 3:
+                        self._promote(gap[2], node, level)
+                else:
+                    gap = self._gap(previous, node, level - 1)
+                    self._demote(node, previous, level)
+
+                    if len(gap) > 1:
+                        self._promote(gap[-1], previous, level)
+                        node = gap[-1]
+                    else:
+                        node = previous
+
+            update[level] = node
+
+        previous = None
+        next_node = node.next[0]
+
+        while next_node is not None and next_node.value < value:
+            previous = node
+            node = next_node
+            next_node = node.next[0]
+
+        target = next_node
+
+        if target is None or target.value != value:
+            self._shrink()
+            return None
+
+        forward = target.next
+        node.next[0] = forward[0]
+
+        # Any taller tower is handed over to the node before it, which the
+        # fix-ups guarantee is only a single layer high.
+        for level in range(1, len(forward)):
+            node.next.append(forward[level])
+            update[level].next[level] = node
+
+        self.size -= 1
+        self._shrink()
+        return target
+
+    def _shrink(self):
+        while self.height > 1 and self.head.next[self.height - 1] is None:
+            self.head.next.pop()
+            self.height -= 1
+
+
+class ArraySkiplist(object):
+    """
+    A skiplist for numeric keys, stored in contiguous ``array`` buffers
+    rather than as Python node objects.
+
+    Each value gets an integer slot. The keys live in one typed array, & the
+    forward pointers for every slot live in a second, flat array (a slot of
+    height ``h`` owns ``h`` consecutive entries, starting at its base
+    offset). Links are slot numbers, with ``-1`` meaning "nothing".
+    Removed slots are recycled through free lists (one per height), which
+    are themselves threaded through the forward pointer array.
+
+    ``typecode`` is any ``array`` module typecode (``'d'`` for floats by
+    default, ``'q'`` for 64-bit ints, etc).
+
+    Provides the core ``insert``/``find``/``remove``/iteration API of
+    ``Skiplist``, but deals in values & slot numbers, since there are no
+    nodes to hand back.
+    """
+    max_layers = 32
+    probability = 0.5
+    typecode = 'd'
+
+    def __init__(self, typecode=None, max_layers=None, probability=None,
+                 seed=None):
+        if typecode is not None:
+            self.typecode = typecode
+
+        if max_layers is not None:
+            self.max_layers = max_layers
+
+        if probability is not None:
+            self.probability = probability
+
+        self.keys = array.array(self.typecode)
+        self.heights = array.array('B')
+        self.bases = array.array('q')
+        self.forward = array.array('q')
+        # The head's forward pointers, one per layer.
+        self.head = array.array('q', [-1] * self.max_layers)
+        # The first free slot of each height.
+        self.free = array.array('q', [-1] * (self.max_layers + 1))
+        self.height = 1
+        self.size = 0
+        self.random = random.Random(seed)
+
+    def __str__(self):
+        return 'ArraySkiplist: {0} items'.format(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, value):
+        return self.find(value) is not None
+
+    def __iter__(self):
+        keys = self.keys
+        bases = self.bases
+        forward = self.forward
+        slot = self.head[0]
+
+        while slot != -1:
+            yield keys[slot]
+            slot = forward[bases[slot]]
+
+    def generate_height(self):
+        """
+        Generates a random height for a new slot.
+
+        Heights are geometrically distributed: each additional layer is added
+        with a chance of ``self.probability``, capped at one more than the
+        current height (& never more than ``self.max_layers``).
+        """
+        limit = min(self.height + 1, self.max_layers)
+        height = 1
+
+        while height < limit and self.random.random() < self.probability:
+            height += 1
+
+        return height
+
+    def _predecessors(self, value, strict=False):
+        """
+        Descends once from the top layer, recording the last slot in each
+        layer whose key is less than or equal to (or, if ``strict``,
+        strictly less than) ``value``.
+
+        Returns a list indexed by layer (``0`` is the bottom layer), where
+        ``-1`` stands for the head.
+        """
+        keys = self.keys
+        bases = self.bases
+        forward = self.forward
+        head = self.head
+        update = [-1] * self.height
+        slot = -1
+
+        for level in range(self.height - 1, -1, -1):
+            if slot == -1:
+                next_slot = head[level]
+            else:
+                next_slot = forward[bases[slot] + level]
+
+            if strict:
+                while next_slot != -1 and keys[next_slot] < value:
+                    slot = next_slot
+                    next_slot = forward[bases[slot] + level]
+            else:
+                while next_slot != -1 and keys[next_slot] <= value:
+                    slot = next_slot
+                    next_slot = forward[bases[slot] + level]
+
+            update[level] = slot
+
+        return update
+
+    def _next(self, slot, level):
+        if slot == -1:
+            return self.head[level]
+
+        return self.forward[self.bases[slot] + level]
+
+    def _set_next(self, slot, level, next_slot):
+        if slot == -1:
+            self.head[level] = next_slot
+        else:
+            self.forward[self.bases[slot] + level] = next_slot
+
+    def _allocate(self, value, height):
+        """
+        Finds a slot for a new value, reusing a free one of the same height
+        if there is one.
+        """
+        slot = self.free[height]
+
+        if slot != -1:
+            self.free[height] = self.forward[self.bases[slot]]
+            self.keys[slot] = value
+            return slot
+
+        slot = len(self.keys)
+        self.keys.append(value)
+        self.heights.append(height)
+        self.bases.append(len(self.forward))
+        self.forward.extend(array.array('q', [-1]) * height)
+        return slot
+
+    def find(self, value):
+        """
+        Looks for a given value within the skiplist.
+
+        Returns the slot holding the first occurrence of the value if found,
+        ``None`` if the value was not found.
+        """
+        update = self._predecessors(value, strict=True)
+        slot = self._next(update[0], 0)
+
+        if slot != -1 and self.keys[slot] == value:
+            return slot
+
+        return None
+
+    def insert(self, value):
+        """
+        Inserts a new value into the skiplist, after any existing equal
+        values.
+
+        Returns the slot used for the value.
+        """
+        height = self.generate_height()
+        update = self._predecessors(value)
+
+        if height > self.height:
+            update.extend([-1] * (height - self.height))
+            self.height = height
+
+        slot = self._allocate(value, height)
+        base = self.bases[slot]
+
+        for level in range(height):
+            self.forward[base + level] = self._next(update[level], level)
+            self._set_next(update[level], level, slot)
+
+        self.size += 1
+        return slot
+
+    def remove(self, value):
+        """
+        Removes the first occurrence of a value from the skiplist & frees its
+        slot for reuse.
+
+        Returns the removed value, or ``None`` if the value was not found.
+        """
+        update = self._predecessors(value, strict=True)
+        slot = self._next(update[0], 0)
+
+        if slot == -1 or self.keys[slot] != value:
+            return None
+
+        height = self.heights[slot]
+        base = self.bases[slot]
+
+        for level in range(height):
+            self._set_next(update[level], level, self.forward[base + level])
+
+        # Thread the slot onto the free list for its height.
+        self.forward[base] = self.free[height]
+        self.free[height] = slot
+
+        while self.height > 1 and self.head[self.height - 1] == -1:
+            self.height -= 1
+
+        self.size -= 1
+        return self.keys[slot]
+
+
+def snapshot_kind(values):
+    """
+    Works out how a list of values should be stored in a snapshot (see
+    ``Skiplist.dump``). Raises a ``SnapshotError`` if they can't be.
+    """
+    kinds = set()
+
+    for value in values:
+        if isinstance(value, bool) or not isinstance(
+                value, (int, float, str, bytes)):
+            raise SnapshotError(
+                "Can't store {0!r} in a snapshot.".format(value)
+            )
+
+        kinds.add(type(value))
+
+    if not kinds or kinds == set([int]):
+        if values and not (-2 ** 63 <= values[0] and values[-1] < 2 ** 63):
+            raise SnapshotError("Ints must fit in 64 bits.")
+
+        return b'q'
+
+    if kinds <= set([int, float]):
+        return b'd'
+
+    if kinds == set([str]):
+        return b's'
+
+    if kinds == set([bytes]):
+        return b'b'
+
+    raise SnapshotError("Values must all be numbers, str or bytes.")
+
+
+class MappedKeys(object):
+    """
+    A read-only sequence over the variable-width (``str``/``bytes``) keys in
+    a mapped snapshot, decoding each one only when it's asked for.
+    """
+    def __init__(self, offsets, data, decode=False):
+        self.offsets = offsets
+        self.data = data
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, offset):
+        if offset < 0:
+            offset += len(self)
+
+        if offset < 0 or offset >= len(self):
+            raise IndexError("Index '{0}' out of range.".format(offset))
+
+        value = self.data[self.offsets[offset]:self.offsets[offset + 1]]
+
+        if self.decode:
+            return str(value, 'utf-8')
+
+        return bytes(value)
+
+
+class MappedSkiplist(object):
+    """
+    A read-only view of a skiplist snapshot (see ``Skiplist.dump``), served
+    straight from an ``mmap`` of the file.
+
+    Nothing is loaded up front & no node objects are created, so opening
+    one is near-instant & several processes mapping the same file share the
+    page cache. Lookups are binary searches over the sorted keys, so they
+    stay O(log n) without needing the towers.
+
+    ``find`` hands back offsets (there are no nodes) & iteration yields
+    values.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mmap = None
+        self.buffer = None
+
+        # Empty files can't be mapped at all.
+        if os.fstat(self.file.fileno()).st_size < SNAPSHOT_HEADER.size:
+            self.close()
+            raise SnapshotError("'{0}' is too short.".format(path))
+
+        try:
+            self.mmap = mmap.mmap(
+                self.file.fileno(),
+                0,
+                access=mmap.ACCESS_READ
+            )
+        except Exception:
+            self.close()
+            raise
+
+        self.buffer = memoryview(self.mmap)
+        magic, version, kind, count = SNAPSHOT_HEADER.unpack_from(self.buffer)
+
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or \
+                kind not in (b'q', b'd', b's', b'b'):
+            self.close()
+            raise SnapshotError("'{0}' isn't a snapshot.".format(path))
+
+        start = SNAPSHOT_HEADER.size
+        self.kind = kind
+        self.size = count
+
+        if kind in (b'q', b'd'):
+            end = start + count * 8
+            self._require(end + count)
+            self.keys = self.buffer[start:end].cast(kind.decode('ascii'))
+        else:
+            data_start = start + (count + 1) * 8
+            self._require(data_start)
+            offsets = self.buffer[start:data_start].cast('Q')
+            end = data_start + offsets[-1]
+
+            if len(self.buffer) < end + count:
+                offsets.release()
+                self._require(end + count)
+
+            self.keys = MappedKeys(
+                offsets,
+                self.buffer[data_start:end],
+                decode=kind == b's'
+            )
+
+        self.heights = self.buffer[end:end + count]
+
+    def _require(self, size):
+        """
+        Closes up & raises a ``SnapshotError`` if the file is shorter than
+        the header says it should be.
+        """
+        if len(self.buffer) < size:
+            self.close()
+            raise SnapshotError("'{0}' is too short.".format(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __str__(self):
+        return 'MappedSkiplist: {0} items'.format(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, value):
+        return self.find(value) is not None
+
+    def __iter__(self):
+        keys = self.keys
+
+        for offset in range(self.size):
+            yield keys[offset]
+
+    def __getitem__(self, offset):
+        return self.keys[offset]
+
+    def close(self):
+        """
+        Releases the mapping & closes the file.
+        """
+        for name in ('keys', 'heights', 'buffer'):
+            view = getattr(self, name, None)
+
+            if isinstance(view, MappedKeys):
+                view.offsets.release()
+                view.data.release()
+            elif view is not None:
+                view.release()
+
+            setattr(self, name, None)
+
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+        self.file.close()
+
+    def find(self, value):
+        """
+        Looks for a given value within the snapshot.
+
+        Returns the offset of the first occurrence of the value if found,
+        ``None`` if the value was not found.
+        """
+        offset = bisect.bisect_left(self.keys, value)
+
+        if offset < self.size and self.keys[offset] == value:
+            return offset
+
+        return None
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True), reverse=False):
+        """
+        Lazily yields the values between ``lo`` & ``hi`` (see
+        ``Skiplist.irange``).
+        """
+        include_lo, include_hi = inclusive
+        keys = self.keys
+
+        if lo is None:
+            start = 0
+        elif include_lo:
+            start = bisect.bisect_left(keys, lo)
+        else:
+            start = bisect.bisect_right(keys, lo)
+
+        if hi is None:
+            stop = self.size
+        elif include_hi:
+            stop = bisect.bisect_right(keys, hi)
+        else:
+            stop = bisect.bisect_left(keys, hi)
+
+        if reverse:
+            offsets = range(stop - 1, start - 1, -1)
+        else:
+            offsets = range(start, stop)
+
+        for offset in offsets:
+            yield keys[offset]
+
+
+def encode_value(value):
+    """
+    Encodes a single value for a log record, using the same kinds as
+    snapshots. Returns a ``(kind, payload)`` tuple.
+    """
+    kind = snapshot_kind([value])
+
+    if kind in (b'q', b'd'):
+        return kind, struct.pack('<' + kind.decode('ascii'), value)
+
+    if kind == b's':
+        return kind, value.encode('utf-8')
+
+    return kind, value
+
+
+def decode_value(kind, payload):
+    """
+    Reverses ``encode_value``.
+    """
+    if kind in (b'q', b'd'):
+        return struct.unpack('<' + kind.decode('ascii'), payload)[0]
+
+    if kind == b's':
+        return payload.decode('utf-8')
+
+    if kind == b'b':
+        return payload
+
+    raise SnapshotError("Unknown value kind {0!r}.".format(kind))
+
+
+def fsync_directory(directory):
+    """
+    Makes renames & new files within a directory durable, where the platform
+    allows it.
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DurableSkiplist(object):
+    """
+    A ``Skiplist`` that survives crashes, by keeping a write-ahead log &
+    periodic snapshots in a directory.
+
+    Every ``insert`` & ``remove`` is appended to the log before it's
+    applied. The log is fsync'ed once every ``sync_every`` writes (a group
+    commit), so raising it trades how many of the latest writes a crash can
+    lose for throughput. ``sync`` forces it.
+
+    ``checkpoint`` (called automatically every ``checkpoint_every`` writes,
+    if given) dumps a fresh snapshot & starts an empty log. Snapshots &
+    logs are numbered by generation, so a crash mid-checkpoint leaves either
+    the old pair or the new one to recover from, never a log that's already
+    folded into its snapshot.
+
+    On open, the newest snapshot is loaded & its log replayed on top. A torn
+    record at the end of the log (from a crash mid-write) is dropped.
+
+    Values are limited to what snapshots can store (ints, floats, ``str``
+    or ``bytes``), & all the values held at once must be the same kind (so
+    ints never come back as floats). Reads go straight to
+    ``self.skiplist``.
+    """
+    skiplist_class = Skiplist
+    sync_every = 1
+    checkpoint_every = None
+
+    def __init__(self, directory, sync_every=None, checkpoint_every=None,
+                 skiplist_class=None):
+        if sync_every is not None:
+            self.sync_every = sync_every
+
+        if checkpoint_every is not None:
+            self.checkpoint_every = checkpoint_every
+
+        if skiplist_class is not None:
+            self.skiplist_class = skiplist_class
+
+        self.directory = directory
+        self.log = None
+        self.unsynced = 0
+        self.since_checkpoint = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.generation = self._latest_generation()
+        snapshot_path = self._path('snapshot', self.generation)
+
+        if os.path.exists(snapshot_path):
+            self.skiplist = self.skiplist_class.load(snapshot_path)
+        else:
+            self.skiplist = self.skiplist_class()
+
+        self.since_checkpoint = self._replay()
+        self.log = open(self._path('log', self.generation), 'ab')
+        self._clean_up()
+
+        # The kind of value held (see ``snapshot_kind``), or ``None`` while
+        # empty.
+        self.kind = None
+
+        if len(self.skiplist):
+            self.kind = encode_value(self.skiplist.min().value)[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __str__(self):
+        return 'DurableSkiplist: {0} items'.format(len(self))
+
+    def __len__(self):
+        return len(self.skiplist)
+
+    def __iter__(self):
+        return iter(self.skiplist)
+
+    def __contains__(self, value):
+        return value in self.skiplist
+
+    def _path(self, name, generation):
+        extension = 'bin' if name == 'snapshot' else 'log'
+        return os.path.join(
+            self.directory,
+            '{0}-{1:010d}.{2}'.format(name, generation, extension)
+        )
+
+    def _generations(self, name):
+        prefix = name + '-'
+        generations = []
+
+        for filename in os.listdir(self.directory):
+            stem, _, extension = filename.partition('.')
+
+            if not stem.startswith(prefix) or extension not in ('bin', 'log'):
+                continue
+
+            try:
+                generations.append(int(stem[len(prefix):]))
+            except ValueError:
+                continue
+
+        return generations
+
+    def _latest_generation(self):
+        return max(self._generations('snapshot') or [0])
+
+    def _clean_up(self):
+        # Anything older than the current generation is already folded into
+        # its snapshot.
+        for name in ('snapshot', 'log'):
+            for generation in self._generations(name):
+                if generation < self.generation:
+                    os.remove(self._path(name, generation))
+
+        leftover = self._path('snapshot', self.generation + 1) + '.tmp'
+
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+    def _replay(self):
+        """
+        Applies the current generation's log to the skiplist. Returns the
+        number of records replayed.
+        """
+        path = self._path('log', self.generation)
+
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'rb') as log:
+            data = log.read()
+
+        position = 0
+        replayed = 0
+
+        while position + LOG_RECORD.size <= len(data):
+            op, kind, length, crc = LOG_RECORD.unpack_from(data, position)
+            start = position + LOG_RECORD.size
+            payload = data[start:start + length]
+
+            if (len(payload) < length or
+                    zlib.crc32(payload) & 0xffffffff != crc):
+                break
+
+            value = decode_value(kind, payload)
+
+            if op == LOG_INSERT:
+                self.skiplist.insert(value)
+            elif op == LOG_REMOVE:
+                self.skiplist.remove(value)
+            else:
+                break
+
+            position = start + length
+            replayed += 1
+
+        if position < len(data):
+            # A torn tail. Cut it off so new records follow good ones.
+            with open(path, 'r+b') as log:
+                log.truncate(position)
+                log.flush()
+                os.fsync(log.fileno())
+
+        return replayed
+
+    def _check_open(self):
+        if self.log is None:
+            raise ValueError("The DurableSkiplist has been closed.")
+
+    def _append(self, op, value):
+        kind, payload = encode_value(value)
+
+        # Checked before anything's logged, so a value that can't be applied
+        # never ends up in the log.
+        if self.kind is not None and kind != self.kind:
+            raise SnapshotError(
+                "Can't mix {0!r} with the stored {1!r} values.".format(
+                    value,
+                    self.kind.decode('ascii')
+                )
+            )
+
+        self.log.write(LOG_RECORD.pack(
+            op,
+            kind,
+            len(payload),
+            zlib.crc32(payload) & 0xffffffff
+        ))
+        self.log.write(payload)
+        self.unsynced += 1
+
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+        return kind
+
+    def _written(self):
+        self.since_checkpoint += 1
+
+        if (self.checkpoint_every is not None and
+                self.since_checkpoint >= self.checkpoint_every):
+            self.checkpoint()
+
+    def insert(self, value):
+        """
+        Logs & inserts a new value. Returns the new node.
+
+        Raises a ``SnapshotError`` (logging nothing) if the value can't be
+        stored, or is a different kind from the values already stored.
+        """
+        self._check_open()
+        kind = self._append(LOG_INSERT, value)
+        node = self.skiplist.insert(value)
+        self.kind = kind
+        self._written()
+        return node
+
+    def remove(self, value):
+        """
+        Logs & removes the first occurrence of a value.
+
+        Returns the removed node, or ``None`` if the value wasn't present
+        (in which case nothing is logged).
+        """
+        self._check_open()
+        existing = self.skiplist.find(value)
+
+        if existing is None:
+            return None
+
+        # Log the stored value, since an equal one may be a different kind.
+        self._append(LOG_REMOVE, existing.value)
+        node = self.skiplist.remove(value)
+
+        if not len(self.skiplist):
+            self.kind = None
+
+        self._written()
+        return node
+
+    def find(self, value):
+        """
+        Looks for a given value. Returns the node if found, ``None`` if not.
+        """
+        return self.skiplist.find(value)
+
+    def sync(self):
+        """
+        Forces any buffered log records to disk.
+        """
+        if self.log is None or not self.unsynced:
+            return
+
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.unsynced = 0
+
+    def checkpoint(self):
+        """
+        Writes a snapshot of the current contents & starts a new, empty log,
+        removing the previous generation's files.
+        """
+        self._check_open()
+        self.sync()
+        generation = self.generation + 1
+        path = self._path('snapshot', generation)
+        temp_path = path + '.tmp'
+
+        self.skiplist.dump(temp_path)
+
+        with open(temp_path, 'rb') as snapshot:
+            os.fsync(snapshot.fileno())
+
+        os.rename(temp_path, path)
+        fsync_directory(self.directory)
+
+        self.log.close()
+        self.generation = generation
+        self.log = open(self._path('log', generation), 'ab')
+        self.since_checkpoint = 0
+        self._clean_up()
+
+    def close(self):
+        """
+        Syncs & closes the log. The skiplist can still be read afterwards,
+        but any further writes raise a ``ValueError``.
+        """
+        if self.log is None:
+            return
 
-            print()
+        self.sync()
+        self.log.close()
+        self.log = None
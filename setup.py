@@ -13,6 +13,7 @@ setup(
     long_description=open('README.rst', 'r').read(),
     py_modules=[
         'pyskip',
+        'aiopyskip',
     ],
     classifiers=[
         'Development Status :: 5 - Production/Stable',
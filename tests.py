@@ -1,8 +1,25 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import copy
+import gc
+import io
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import warnings
+
 try:
     import unittest2 as unittest
 except ImportError:
     import unittest
 
+import aiopyskip
 import pyskip
 
 
@@ -149,6 +166,33 @@ class LinkedListTestCase(unittest.TestCase):
         with self.assertRaises(StopIteration):
             next(the_list)
 
+    def test_nested_iter(self):
+        pairs = [(a.value, b.value) for a in self.ll for b in self.ll]
+        self.assertEqual(len(pairs), 16)
+        self.assertEqual(pairs[:4], [(0, 0), (0, 2), (0, 5), (0, 6)])
+
+        # Lookups mid-iteration don't disturb it either.
+        seen = []
+
+        for node in self.ll:
+            self.assertTrue(6 in self.ll)
+            seen.append(node.value)
+
+        self.assertEqual(seen, [0, 2, 5, 6])
+
+    def test_nodes_values(self):
+        self.assertEqual(list(self.ll.nodes()), [
+            self.head,
+            self.first,
+            self.second,
+            self.third,
+        ])
+        self.assertEqual(list(self.ll.values()), [0, 2, 5, 6])
+        self.assertEqual(
+            [node.value for node in reversed(self.ll)],
+            [6, 5, 2, 0]
+        )
+
     def test_offsets(self):
         self.assertEqual(self.ll[0].value, 0)
         self.assertEqual(self.ll[1].value, 2)
@@ -214,6 +258,13 @@ class SortedLinkedListTestCase(unittest.TestCase):
         self.assertEqual(next(the_list).value, 0)
         self.assertEqual(next(the_list).value, 5)
 
+    def test_remove_head(self):
+        self.assertEqual(self.sll.remove(pyskip.SingleNode(value=0)).value, 0)
+        self.assertEqual(list(self.sll.values()), [2, 2, 3, 5, 6])
+        self.assertEqual(self.sll.remove(pyskip.SingleNode(value=-1)), None)
+        self.assertEqual(self.sll.remove(pyskip.SingleNode(value=4)), None)
+        self.assertEqual(len(self.sll), 5)
+
     def test_contains(self):
         self.assertTrue(0 in self.sll)
         self.assertTrue(5 in self.sll)
@@ -222,7 +273,46 @@ class SortedLinkedListTestCase(unittest.TestCase):
         self.assertFalse(4 in self.sll)
 
 
-class SkiplistTestCase(unittest.TestCase):
+class SkiplistAssertionsMixin(object):
+    def assertSkiplistValid(self, skip):
+        """
+        Checks the structural invariants of a skiplist: every layer is
+        sorted, links down to a matching node & has correct widths/counts.
+        """
+        positions = {}
+
+        for offset, node in enumerate(skip.layers[-1]):
+            positions[id(node)] = offset
+            self.assertEqual(node.width, 1)
+
+        for layer in skip.layers:
+            previous = None
+            position = -1
+            count = 0
+
+            for node in layer:
+                count += 1
+                bottom = node
+
+                while bottom.down is not None:
+                    self.assertEqual(bottom.down.value, node.value)
+                    bottom = bottom.down
+
+                self.assertEqual(
+                    node.width,
+                    positions[id(bottom)] - position
+                )
+                position = positions[id(bottom)]
+
+                if previous is not None:
+                    self.assertTrue(previous.value <= node.value)
+
+                previous = node
+
+            self.assertEqual(len(layer), count)
+
+
+class SkiplistTestCase(SkiplistAssertionsMixin, unittest.TestCase):
     def setUp(self):
         super(SkiplistTestCase, self).setUp()
         self.skip = pyskip.Skiplist()
@@ -307,12 +397,2316 @@ class SkiplistTestCase(unittest.TestCase):
         with self.assertRaises(StopIteration):
             next(the_list)
 
+    def test_nested_iter(self):
+        pairs = [(a.value, b.value) for a in self.skip for b in self.skip]
+        self.assertEqual(len(pairs), 49)
+
+        values = []
+
+        for node in self.skip:
+            self.assertTrue(node.value in self.skip)
+            values.append(node.value)
+
+        self.assertEqual(values, [3, 4, 7, 12, 13, 14, 17])
+
+    def test_nodes_values(self):
+        self.assertEqual(
+            [node.value for node in self.skip.nodes()],
+            [3, 4, 7, 12, 13, 14, 17]
+        )
+        self.assertEqual(list(self.skip.values()), [3, 4, 7, 12, 13, 14, 17])
+
+        skip = pyskip.Skiplist.from_sorted([1, 2, 2, 3])
+        self.assertEqual([node.value for node in reversed(skip)], [3, 2, 2, 1])
+
     def test_insert(self):
         self.assertFalse(6 in self.skip)
         self.skip.insert(6)
         self.assertTrue(6 in self.skip)
 
+    def test_insert_returns_node(self):
+        node = self.skip.insert(6)
+        self.assertEqual(node.value, 6)
+        self.assertEqual(node.down, None)
+        self.assertTrue(self.skip.find(6) is node)
+
     def test_remove(self):
         self.assertTrue(4 in self.skip)
         self.skip.remove(4)
         self.assertFalse(4 in self.skip)
+
+    def test_generate_height(self):
+        skip = pyskip.Skiplist()
+
+        # An empty skiplist only has one layer, so heights are capped at two.
+        for i in range(100):
+            self.assertTrue(1 <= skip.generate_height() <= 2)
+
+        never = pyskip.Skiplist(probability=0)
+        self.assertEqual(never.generate_height(), 1)
+
+        always = pyskip.Skiplist(probability=1, max_layers=4)
+        self.assertEqual(always.generate_height(), 2)
+        always.layers = [pyskip.SortedLinkedList() for i in range(6)]
+        self.assertEqual(always.generate_height(), 4)
+
+    def test_seed(self):
+        values = list(range(500))
+        random.shuffle(values)
+        first = pyskip.Skiplist(seed=7)
+        second = pyskip.Skiplist(seed=7)
+
+        for value in values:
+            first.insert(value)
+            second.insert(value)
+
+        self.assertEqual(first.heights(), second.heights())
+        self.assertEqual(first._spawn().seed, 7)
+
+        # Each skiplist draws from its own generator.
+        random.seed(7)
+        unseeded = pyskip.Skiplist()
+        self.assertFalse(unseeded.random is random._inst)
+
+    def test_insert_ordering(self):
+        skip = pyskip.Skiplist(probability=0.25)
+        values = list(range(200)) * 2
+        random.shuffle(values)
+
+        for value in values:
+            skip.insert(value)
+
+        self.assertEqual([node.value for node in skip], sorted(values))
+        self.assertSkiplistValid(skip)
+
+        for value in range(200):
+            self.assertTrue(value in skip)
+
+    def test_remove_missing(self):
+        self.assertEqual(self.skip.remove(5), None)
+        self.assertEqual(self.skip.remove(25), None)
+        self.assertEqual(self.skip.remove(-1), None)
+        self.assertEqual(len(self.skip), 7)
+
+        empty = pyskip.Skiplist()
+        self.assertEqual(empty.remove(6), None)
+
+    def test_remove_towers(self):
+        # Removing ``7`` has to unlink it from all three layers.
+        self.assertEqual(self.skip.remove(7).value, 7)
+        self.assertFalse(7 in self.skip)
+
+        for layer in self.skip.layers:
+            self.assertFalse(7 in [node.value for node in layer])
+
+        # Dropping ``17`` empties the top layer, which should go away.
+        self.assertEqual(self.skip.remove(17).value, 17)
+        self.assertEqual(len(self.skip.layers), 2)
+        self.assertEqual(
+            [node.value for node in self.skip],
+            [3, 4, 12, 13, 14]
+        )
+
+    def test_remove_duplicates(self):
+        skip = pyskip.Skiplist()
+        values = list(range(100)) * 3
+        random.shuffle(values)
+
+        for value in values:
+            skip.insert(value)
+
+        random.shuffle(values)
+
+        for value in values:
+            self.assertEqual(skip.remove(value).value, value)
+
+            if random.random() < 0.1:
+                self.assertSkiplistValid(skip)
+
+        self.assertEqual(len(skip), 0)
+        self.assertEqual(len(skip.layers), 1)
+        self.assertEqual(skip.remove(5), None)
+
+    def test_layer_counts(self):
+        self.assertEqual(self.skip.layer_counts(), [2, 4, 7])
+
+        self.skip.insert(6)
+        self.assertEqual(self.skip.layer_counts()[-1], 8)
+        self.assertEqual(len(self.skip), 8)
+        self.assertEqual(str(self.skip), 'Skiplist: 8 items')
+
+        self.skip.remove(7)
+        self.skip.remove(17)
+        self.assertEqual(len(self.skip), 6)
+
+        for layer, count in zip(self.skip.layers, self.skip.layer_counts()):
+            self.assertEqual(count, len(list(iter(layer))))
+
+        empty = pyskip.Skiplist()
+        self.assertEqual(empty.layer_counts(), [0])
+
+    def test_select(self):
+        skip = pyskip.Skiplist()
+        values = [random.randint(0, 50) for i in range(300)]
+
+        for value in values:
+            skip.insert(value)
+
+        values.sort()
+
+        for offset, value in enumerate(values):
+            self.assertEqual(skip.select(offset).value, value)
+            self.assertEqual(skip[offset].value, value)
+            self.assertEqual(skip[offset - len(values)].value, value)
+
+        # Always hands back the bottom layer node.
+        self.assertEqual(skip.select(0).down, None)
+
+        with self.assertRaises(IndexError):
+            skip[300]
+
+        with self.assertRaises(IndexError):
+            skip[-301]
+
+        with self.assertRaises(IndexError):
+            pyskip.Skiplist()[0]
+
+    def test_rank(self):
+        skip = pyskip.Skiplist()
+        values = [random.randint(0, 50) for i in range(300)]
+
+        for value in values:
+            skip.insert(value)
+
+        for i in range(50):
+            skip.remove(values.pop())
+
+        self.assertSkiplistValid(skip)
+        values.sort()
+
+        for value in range(-1, 52):
+            self.assertEqual(
+                skip.rank(value),
+                len([v for v in values if v < value])
+            )
+
+        self.assertEqual(pyskip.Skiplist().rank(3), 0)
+
+    def build_random(self, count=300, high=50):
+        skip = pyskip.Skiplist()
+        values = [random.randint(0, high) for i in range(count)]
+
+        for value in values:
+            skip.insert(value)
+
+        return skip, sorted(values)
+
+    def test_bisect(self):
+        skip, values = self.build_random()
+
+        for value in range(-1, 52):
+            self.assertEqual(
+                skip.bisect_left(value),
+                bisect.bisect_left(values, value)
+            )
+            self.assertEqual(
+                skip.bisect_right(value),
+                bisect.bisect_right(values, value)
+            )
+
+    def test_floor_ceiling(self):
+        self.assertEqual(self.skip.floor(13).value, 13)
+        self.assertEqual(self.skip.floor(11).value, 7)
+        self.assertEqual(self.skip.floor(25).value, 17)
+        self.assertEqual(self.skip.floor(2), None)
+
+        self.assertEqual(self.skip.ceiling(13).value, 13)
+        self.assertEqual(self.skip.ceiling(11).value, 12)
+        self.assertEqual(self.skip.ceiling(-1).value, 3)
+        self.assertEqual(self.skip.ceiling(18), None)
+
+        # Always the bottom layer nodes.
+        self.assertEqual(self.skip.floor(17).down, None)
+        self.assertEqual(self.skip.ceiling(5).down, None)
+
+    def test_min_max(self):
+        self.assertEqual(self.skip.min().value, 3)
+        self.assertEqual(self.skip.max().value, 17)
+        self.assertEqual(self.skip.max().down, None)
+
+        empty = pyskip.Skiplist()
+        self.assertEqual(empty.min(), None)
+        self.assertEqual(empty.max(), None)
+
+    def test_pop(self):
+        skip, values = self.build_random()
+
+        self.assertEqual(skip.pop_min().value, values.pop(0))
+        self.assertEqual(skip.pop_max().value, values.pop())
+        self.assertEqual(skip.pop(10).value, values.pop(10))
+        self.assertEqual(skip.pop(-20).value, values.pop(-20))
+        self.assertEqual([node.value for node in skip], values)
+        self.assertSkiplistValid(skip)
+
+        while len(skip):
+            skip.pop_max()
+
+        self.assertEqual(len(skip.layers), 1)
+
+        with self.assertRaises(IndexError):
+            skip.pop_min()
+
+        with self.assertRaises(IndexError):
+            skip.pop()
+
+    def test_irange(self):
+        skip, values = self.build_random()
+
+        def expected(lo, hi, inclusive):
+            return [
+                v for v in values
+                if (lo is None or v > lo or (inclusive[0] and v == lo))
+                and (hi is None or v < hi or (inclusive[1] and v == hi))
+            ]
+
+        for lo, hi in [(None, None), (10, 20), (None, 5), (45, None),
+                       (-5, 100), (20, 10), (7, 7)]:
+            for inclusive in [(True, True), (False, False), (True, False)]:
+                result = skip.irange(lo, hi, inclusive=inclusive)
+                self.assertEqual(
+                    [node.value for node in result],
+                    expected(lo, hi, inclusive)
+                )
+
+                result = skip.irange(lo, hi, inclusive=inclusive, reverse=True)
+                self.assertEqual(
+                    [node.value for node in result],
+                    expected(lo, hi, inclusive)[::-1]
+                )
+
+        # It's lazy.
+        ranged = skip.irange(10)
+        self.assertTrue(next(ranged) is skip.ceiling(10))
+
+
+class SkipDictTestCase(unittest.TestCase):
+    def setUp(self):
+        super(SkipDictTestCase, self).setUp()
+        self.sd = pyskip.SkipDict()
+        self.sd['c'] = 3
+        self.sd['a'] = 1
+        self.sd['b'] = 2
+
+    def test_init(self):
+        sd = pyskip.SkipDict({'b': 2, 'a': 1})
+        self.assertEqual(list(sd.items()), [('a', 1), ('b', 2)])
+
+        sd = pyskip.SkipDict([('b', 2), ('a', 1)])
+        self.assertEqual(list(sd.items()), [('a', 1), ('b', 2)])
+
+    def test_str(self):
+        self.assertEqual(str(self.sd), 'SkipDict: 3 items')
+
+    def test_getitem(self):
+        self.assertEqual(self.sd['a'], 1)
+        self.assertEqual(self.sd['c'], 3)
+
+        with self.assertRaises(KeyError):
+            self.sd['d']
+
+    def test_setitem(self):
+        self.sd['a'] = 'one'
+        self.assertEqual(self.sd['a'], 'one')
+        self.assertEqual(len(self.sd), 3)
+
+        self.sd['0'] = 0
+        self.assertEqual(len(self.sd), 4)
+        self.assertEqual(list(self.sd), ['0', 'a', 'b', 'c'])
+
+    def test_delitem(self):
+        del self.sd['b']
+        self.assertFalse('b' in self.sd)
+        self.assertEqual(list(self.sd), ['a', 'c'])
+
+        with self.assertRaises(KeyError):
+            del self.sd['b']
+
+    def test_get(self):
+        self.assertEqual(self.sd.get('a'), 1)
+        self.assertEqual(self.sd.get('d'), None)
+        self.assertEqual(self.sd.get('d', 4), 4)
+
+    def test_setdefault(self):
+        self.assertEqual(self.sd.setdefault('a', 10), 1)
+        self.assertEqual(self.sd.setdefault('d', 4), 4)
+        self.assertEqual(self.sd['d'], 4)
+        self.assertEqual(len(self.sd), 4)
+
+    def test_pop(self):
+        self.assertEqual(self.sd.pop('a'), 1)
+        self.assertEqual(self.sd.pop('a', None), None)
+        self.assertEqual(len(self.sd), 2)
+
+        with self.assertRaises(KeyError):
+            self.sd.pop('a')
+
+    def test_ordered_views(self):
+        self.assertEqual(list(self.sd.keys()), ['a', 'b', 'c'])
+        self.assertEqual(list(self.sd.values()), [1, 2, 3])
+        self.assertEqual(
+            list(self.sd.items()),
+            [('a', 1), ('b', 2), ('c', 3)]
+        )
+
+    def test_key_function(self):
+        calls = []
+
+        def lowered(key):
+            calls.append(key)
+            return key.lower()
+
+        sd = pyskip.SkipDict(key=lowered)
+        sd['b'] = 1
+        sd['A'] = 2
+        sd['a'] = 3
+        sd['C'] = 4
+
+        # Once per insert, no matter how many comparisons happen.
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(list(sd.keys()), ['A', 'a', 'b', 'C'])
+        self.assertEqual(sd['A'], 2)
+        self.assertEqual(sd['a'], 3)
+
+        # Keys sharing a sort key stay distinct.
+        del sd['a']
+        self.assertEqual(list(sd.items()), [('A', 2), ('b', 1), ('C', 4)])
+
+        with self.assertRaises(KeyError):
+            del sd['a']
+
+        # Once per removal too.
+        del calls[:]
+        self.assertEqual(sd.pop('b'), 1)
+        del sd['C']
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(list(sd.items()), [('A', 2)])
+
+    def test_delete_within_run(self):
+        sd = pyskip.SkipDict(key=len)
+
+        for word in ['aa', 'bb', 'cc', 'dd', 'e', 'fff']:
+            sd[word] = word.upper()
+
+        self.assertEqual(sd.pop('cc'), 'CC')
+        del sd['dd']
+        del sd['aa']
+        self.assertEqual(list(sd.keys()), ['e', 'bb', 'fff'])
+
+        for node in sd.skiplist.layers[-1]:
+            self.assertEqual(node.width, 1)
+
+        with self.assertRaises(KeyError):
+            del sd['cc']
+
+
+class SkipBagTestCase(unittest.TestCase):
+    def setUp(self):
+        super(SkipBagTestCase, self).setUp()
+        self.bag = pyskip.SkipBag(['c', 'a', 'b', 'a', 'a'])
+
+    def test_init(self):
+        bag = pyskip.SkipBag({'b': 2, 'a': 1})
+        self.assertEqual(list(bag.items()), [('a', 1), ('b', 2)])
+        self.assertEqual(len(bag), 3)
+
+    def test_str(self):
+        self.assertEqual(str(self.bag), 'SkipBag: 5 items')
+
+    def test_add(self):
+        node = self.bag.add('a', 3)
+        self.assertEqual(node.count, 6)
+        self.assertEqual(len(self.bag), 8)
+        self.assertTrue(self.bag.add('d') is self.bag.skiplist.find('d'))
+        self.assertEqual(list(self.bag), ['a'] * 6 + ['b', 'c', 'd'])
+
+        with self.assertRaises(ValueError):
+            self.bag.add('a', 0)
+
+    def test_duplicates_share_a_tower(self):
+        bag = pyskip.SkipBag()
+
+        for i in range(1000):
+            bag.add(i % 10)
+
+        self.assertEqual(len(bag), 1000)
+        self.assertEqual(bag.distinct(), 10)
+        self.assertEqual(len(bag.skiplist.layers[-1]), 10)
+
+    def test_discard(self):
+        self.assertEqual(self.bag.discard('a'), 1)
+        self.assertEqual(self.bag.count('a'), 2)
+        self.assertEqual(self.bag.discard('a', 5), 2)
+        self.assertFalse('a' in self.bag)
+        self.assertEqual(self.bag.discard('a'), 0)
+        self.assertEqual(self.bag.discard('z'), 0)
+        self.assertEqual(len(self.bag), 2)
+        self.assertEqual(list(self.bag.keys()), ['b', 'c'])
+
+        with self.assertRaises(ValueError):
+            self.bag.discard('b', -1)
+
+    def test_count(self):
+        self.assertEqual(self.bag.count('a'), 3)
+        self.assertEqual(self.bag.count('c'), 1)
+        self.assertEqual(self.bag.count('z'), 0)
+        self.assertTrue('b' in self.bag)
+        self.assertFalse('z' in self.bag)
+
+    def test_against_counter(self):
+        rand = random.Random(5)
+        bag = pyskip.SkipBag()
+        expected = collections.Counter()
+
+        for i in range(2000):
+            value = rand.randint(0, 50)
+            n = rand.randint(1, 3)
+
+            if rand.random() < 0.6:
+                bag.add(value, n)
+                expected[value] += n
+            else:
+                removed = bag.discard(value, n)
+                self.assertEqual(removed, min(n, expected[value]))
+                expected[value] -= removed
+
+                if not expected[value]:
+                    del expected[value]
+
+        self.assertEqual(list(bag), sorted(expected.elements()))
+        self.assertEqual(list(bag.items()), sorted(expected.items()))
+        self.assertEqual(len(bag), sum(expected.values()))
+        self.assertEqual(bag.distinct(), len(expected))
+
+    def test_pickle(self):
+        bag = pickle.loads(pickle.dumps(self.bag))
+        self.assertEqual(list(bag.items()), [('a', 3), ('b', 1), ('c', 1)])
+        self.assertEqual(len(bag), 5)
+
+
+class CompactSkiplistTestCase(unittest.TestCase):
+    def setUp(self):
+        super(CompactSkiplistTestCase, self).setUp()
+        self.skip = pyskip.CompactSkiplist()
+        self.values = list(range(100)) * 2
+        random.shuffle(self.values)
+
+        for value in self.values:
+            self.skip.insert(value)
+
+    def assertStructureValid(self, skip):
+        for level in range(skip.height):
+            node = skip.head.next[level]
+            previous = None
+
+            while node is not None:
+                self.assertTrue(len(node.next) > level)
+
+                if previous is not None:
+                    self.assertTrue(previous.value <= node.value)
+
+                previous = node
+                node = node.next[level]
+
+    def test_slots(self):
+        node = pyskip.TowerNode(value=3, height=4)
+        self.assertEqual(node.next, [None, None, None, None])
+
+        with self.assertRaises(AttributeError):
+            node.__dict__
+
+    def test_insert(self):
+        self.assertEqual(len(self.skip), 200)
+        self.assertEqual(str(self.skip), 'CompactSkiplist: 200 items')
+        self.assertEqual(
+            [node.value for node in self.skip],
+            sorted(self.values)
+        )
+        self.assertStructureValid(self.skip)
+
+        node = self.skip.insert(150)
+        self.assertEqual(node.value, 150)
+        self.assertTrue(self.skip.find(150) is node)
+
+    def test_find(self):
+        self.assertEqual(self.skip.find(0).value, 0)
+        self.assertEqual(self.skip.find(99).value, 99)
+        self.assertEqual(self.skip.find(100), None)
+        self.assertEqual(self.skip.find(-1), None)
+        self.assertTrue(50 in self.skip)
+        self.assertFalse(500 in self.skip)
+        self.assertEqual(pyskip.CompactSkiplist().find(3), None)
+
+    def test_remove(self):
+        self.assertEqual(self.skip.remove(500), None)
+
+        for value in self.values:
+            self.assertEqual(self.skip.remove(value).value, value)
+
+        self.assertEqual(len(self.skip), 0)
+        self.assertEqual(self.skip.height, 1)
+        self.assertEqual(list(self.skip), [])
+        self.assertEqual(self.skip.remove(3), None)
+
+    def test_seed(self):
+        first = pyskip.CompactSkiplist(seed=3)
+        second = pyskip.CompactSkiplist(seed=3)
+
+        for value in self.values:
+            first.insert(value)
+            second.insert(value)
+
+        self.assertEqual(
+            [len(node.next) for node in first],
+            [len(node.next) for node in second]
+        )
+
+    def test_remove_partial(self):
+        for value in range(0, 100, 3):
+            self.skip.remove(value)
+
+        self.assertStructureValid(self.skip)
+        self.assertEqual(len(self.skip), 200 - 34)
+        # One of each multiple of three is left behind.
+        expected = [v for v in range(100) if v % 3] * 2
+        expected.extend(range(0, 100, 3))
+        self.assertEqual([node.value for node in self.skip], sorted(expected))
+
+
+class ArraySkiplistTestCase(unittest.TestCase):
+    def setUp(self):
+        super(ArraySkiplistTestCase, self).setUp()
+        self.skip = pyskip.ArraySkiplist(typecode='q')
+        self.values = list(range(100)) * 2
+        random.shuffle(self.values)
+
+        for value in self.values:
+            self.skip.insert(value)
+
+    def test_insert(self):
+        self.assertEqual(len(self.skip), 200)
+        self.assertEqual(str(self.skip), 'ArraySkiplist: 200 items')
+        self.assertEqual(list(self.skip), sorted(self.values))
+
+        slot = self.skip.insert(150)
+        self.assertEqual(self.skip.keys[slot], 150)
+        self.assertEqual(self.skip.find(150), slot)
+
+    def test_typecode(self):
+        floats = pyskip.ArraySkiplist()
+        floats.insert(2.5)
+        floats.insert(-1.0)
+        self.assertEqual(list(floats), [-1.0, 2.5])
+
+        with self.assertRaises(TypeError):
+            floats.insert('nope')
+
+    def test_find(self):
+        self.assertEqual(self.skip.keys[self.skip.find(0)], 0)
+        self.assertEqual(self.skip.keys[self.skip.find(99)], 99)
+        self.assertEqual(self.skip.find(100), None)
+        self.assertEqual(self.skip.find(-1), None)
+        self.assertTrue(50 in self.skip)
+        self.assertFalse(500 in self.skip)
+        self.assertEqual(pyskip.ArraySkiplist().find(3), None)
+
+    def test_remove(self):
+        self.assertEqual(self.skip.remove(500), None)
+
+        for value in self.values[:100]:
+            self.assertEqual(self.skip.remove(value), value)
+
+        remaining = sorted(self.values[100:])
+        self.assertEqual(list(self.skip), remaining)
+
+        for value in self.values[100:]:
+            self.assertEqual(self.skip.remove(value), value)
+
+        self.assertEqual(len(self.skip), 0)
+        self.assertEqual(self.skip.height, 1)
+        self.assertEqual(list(self.skip), [])
+
+    def test_seed(self):
+        first = pyskip.ArraySkiplist(typecode='q', seed=3)
+        second = pyskip.ArraySkiplist(typecode='q', seed=3)
+
+        for value in self.values:
+            first.insert(value)
+            second.insert(value)
+
+        self.assertEqual(first.heights, second.heights)
+
+    def test_free_list(self):
+        slots = len(self.skip.keys)
+
+        for value in range(50):
+            self.skip.remove(value)
+
+        for value in range(50):
+            self.skip.insert(value)
+
+        # Most slots get recycled rather than growing the arrays.
+        self.assertTrue(len(self.skip.keys) < slots + 50)
+        self.assertEqual(list(self.skip), sorted(self.values))
+
+
+class DeterministicSkiplistTestCase(unittest.TestCase):
+    def setUp(self):
+        super(DeterministicSkiplistTestCase, self).setUp()
+        self.skip = pyskip.DeterministicSkiplist()
+        self.values = list(range(100)) * 2
+        random.shuffle(self.values)
+
+        for value in self.values:
+            self.skip.insert(value)
+
+    def assertBalanced(self, skip):
+        """
+        Checks the 1-2-3 invariants: the top layer & every gap below it hold
+        one to three nodes, & the bottom layer is sorted.
+        """
+        values = [node.value for node in skip]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(skip), len(values))
+        self.assertEqual(len(skip.head.next), skip.height)
+
+        if not values:
+            self.assertEqual(skip.height, 1)
+            return
+
+        top = skip.height - 1
+        self.assertTrue(1 <= len(skip._gap(skip.head, None, top)) <= 3)
+
+        for level in range(top, 0, -1):
+            node = skip.head
+
+            while node is not None:
+                next_node = node.next[level]
+                gap = skip._gap(node, next_node, level - 1)
+                self.assertTrue(1 <= len(gap) <= 3, (level, len(gap)))
+
+                for member in gap:
+                    self.assertEqual(len(member.next), level)
+
+                node = next_node
+
+    def test_insert(self):
+        self.assertEqual(len(self.skip), 200)
+        self.assertEqual(str(self.skip), 'DeterministicSkiplist: 200 items')
+        self.assertEqual(
+            [node.value for node in self.skip],
+            sorted(self.values)
+        )
+        self.assertBalanced(self.skip)
+
+        node = self.skip.insert(150)
+        self.assertEqual(node.value, 150)
+        self.assertTrue(self.skip.find(150) is node)
+        self.assertBalanced(self.skip)
+
+    def test_find(self):
+        self.assertEqual(self.skip.find(0).value, 0)
+        self.assertEqual(self.skip.find(99).value, 99)
+        self.assertEqual(self.skip.find(100), None)
+        self.assertEqual(self.skip.find(-1), None)
+        self.assertTrue(50 in self.skip)
+        self.assertFalse(500 in self.skip)
+        self.assertEqual(pyskip.DeterministicSkiplist().find(3), None)
+
+    def test_remove(self):
+        self.assertEqual(self.skip.remove(500), None)
+        self.assertBalanced(self.skip)
+
+        for value in self.values:
+            self.assertEqual(self.skip.remove(value).value, value)
+            self.assertBalanced(self.skip)
+
+        self.assertEqual(len(self.skip), 0)
+        self.assertEqual(self.skip.height, 1)
+        self.assertEqual(list(self.skip), [])
+        self.assertEqual(self.skip.remove(3), None)
+
+    def test_remove_first_occurrence(self):
+        skip = pyskip.DeterministicSkiplist()
+        first = skip.insert(5)
+        second = skip.insert(5)
+        self.assertTrue(skip.remove(5) is first)
+        self.assertTrue(skip.find(5) is second)
+
+    def test_remove_towers(self):
+        # Always pick the tallest tower, so its layers get handed on.
+        while len(self.skip):
+            node = max(self.skip, key=lambda node: len(node.next))
+            value = node.value
+            values = [node.value for node in self.skip]
+            removed = self.skip.remove(value)
+            self.assertEqual(removed.value, value)
+            values.remove(value)
+            self.assertEqual([node.value for node in self.skip], values)
+            self.assertBalanced(self.skip)
+
+    def test_random_operations(self):
+        rand = random.Random(42)
+        skip = pyskip.DeterministicSkiplist()
+        expected = []
+
+        for i in range(3000):
+            value = rand.randint(0, 300)
+
+            if rand.random() < 0.55:
+                skip.insert(value)
+                bisect.insort_right(expected, value)
+            else:
+                removed = skip.remove(value)
+
+                if value in expected:
+                    self.assertEqual(removed.value, value)
+                    expected.remove(value)
+                else:
+                    self.assertEqual(removed, None)
+
+            if i % 100 == 0:
+                self.assertBalanced(skip)
+
+        self.assertEqual([node.value for node in skip], expected)
+        self.assertBalanced(skip)
+
+    def test_height_bound(self):
+        for values in (range(4096), range(4096, 0, -1), [1] * 4096):
+            skip = pyskip.DeterministicSkiplist()
+
+            for value in values:
+                skip.insert(value)
+
+            # Gaps hold at least one node, so each layer at most halves.
+            self.assertTrue(skip.height <= 13, skip.height)
+            self.assertBalanced(skip)
+
+    def test_deterministic(self):
+        first = pyskip.DeterministicSkiplist()
+        second = pyskip.DeterministicSkiplist()
+
+        for skip in (first, second):
+            for value in self.values:
+                skip.insert(value)
+
+            for value in self.values[::3]:
+                skip.remove(value)
+
+        self.assertEqual(
+            [(node.value, len(node.next)) for node in first],
+            [(node.value, len(node.next)) for node in second]
+        )
+
+
+class BulkLoadTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def test_sorted_list_from_sorted(self):
+        sll = pyskip.SortedLinkedList.from_sorted([1, 2, 2, 5])
+        self.assertEqual([node.value for node in sll], [1, 2, 2, 5])
+        self.assertEqual(len(sll), 4)
+
+        empty = pyskip.SortedLinkedList.from_sorted([])
+        self.assertEqual(len(empty), 0)
+
+        with self.assertRaises(pyskip.InsertError):
+            pyskip.SortedLinkedList.from_sorted([1, 3, 2])
+
+    def test_sorted_list_bulk_insert(self):
+        sll = pyskip.SortedLinkedList.from_sorted([2, 4, 6])
+        sll.bulk_insert([7, 1, 4, 3, 0])
+        self.assertEqual(
+            [node.value for node in sll],
+            [0, 1, 2, 3, 4, 4, 6, 7]
+        )
+        self.assertEqual(len(sll), 8)
+
+    def test_skiplist_from_sorted(self):
+        values = sorted(random.randint(0, 100) for i in range(500))
+        skip = pyskip.Skiplist.from_sorted(values)
+        self.assertEqual([node.value for node in skip], values)
+        self.assertSkiplistValid(skip)
+
+        for offset in (0, 17, 250, 499):
+            self.assertEqual(skip[offset].value, values[offset])
+
+        # Keeps working as a normal skiplist afterwards.
+        skip.insert(50)
+        skip.remove(values[0])
+        self.assertSkiplistValid(skip)
+
+        skip = pyskip.Skiplist.from_sorted([], max_layers=4)
+        self.assertEqual(len(skip), 0)
+        self.assertEqual(skip.max_layers, 4)
+
+        with self.assertRaises(pyskip.InsertError):
+            pyskip.Skiplist.from_sorted([1, 3, 2])
+
+    def test_skiplist_from_sorted_deterministic(self):
+        skip = pyskip.Skiplist.from_sorted(range(16), deterministic=True)
+        self.assertSkiplistValid(skip)
+        self.assertEqual(skip.layer_counts(), [1, 2, 4, 8, 16])
+
+        skip = pyskip.Skiplist.from_sorted(
+            range(64),
+            deterministic=True,
+            probability=0.25
+        )
+        self.assertEqual(skip.layer_counts(), [1, 4, 16, 64])
+
+    def test_skiplist_bulk_insert(self):
+        skip = pyskip.Skiplist()
+        skip.bulk_insert([5, 3, 9, 1])
+        self.assertEqual([node.value for node in skip], [1, 3, 5, 9])
+        self.assertSkiplistValid(skip)
+
+        skip.bulk_insert([4, 10, 0])
+        self.assertEqual(
+            [node.value for node in skip],
+            [0, 1, 3, 4, 5, 9, 10]
+        )
+        self.assertSkiplistValid(skip)
+
+    def test_skiplist_bulk_insert_reuses_fingers(self):
+        hints = []
+
+        class HintedSkiplist(pyskip.Skiplist):
+            def _insert(self, value, hint=None, kwargs=None):
+                hints.append(hint)
+                return super(HintedSkiplist, self)._insert(
+                    value,
+                    hint=hint,
+                    kwargs=kwargs
+                )
+
+        skip = HintedSkiplist.from_sorted(range(0, 100, 2))
+        existing = set(id(node) for node in skip)
+        skip.bulk_insert([51, 7, 33, 99])
+
+        # Only the first search starts from the top.
+        self.assertEqual(hints[0], None)
+        self.assertTrue(all(hint is not None for hint in hints[1:]))
+        self.assertEqual(
+            list(skip.values()),
+            sorted(list(range(0, 100, 2)) + [7, 33, 51, 99])
+        )
+        # The existing nodes are kept, not rebuilt.
+        self.assertEqual(
+            existing,
+            set(id(node) for node in skip if node.value % 2 == 0)
+        )
+        self.assertSkiplistValid(skip)
+
+
+class SnapshotTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'skip.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_heights(self):
+        skip = pyskip.Skiplist.from_sorted(range(8), deterministic=True)
+        self.assertEqual(skip.heights(), [1, 2, 1, 3, 1, 2, 1, 4])
+        self.assertEqual(pyskip.Skiplist().heights(), [])
+
+    def test_dump_load(self):
+        values = sorted(random.randint(-1000, 1000) for i in range(500))
+        skip = pyskip.Skiplist.from_sorted(values)
+        skip.dump(self.path)
+
+        loaded = pyskip.Skiplist.load(self.path, max_layers=32)
+        self.assertEqual(list(loaded.values()), values)
+        self.assertEqual(loaded.heights(), skip.heights())
+        self.assertEqual(loaded.layer_counts(), skip.layer_counts())
+        self.assertEqual(loaded.max_layers, 32)
+        self.assertSkiplistValid(loaded)
+
+        # Keeps working as a normal skiplist afterwards.
+        loaded.insert(5)
+        loaded.remove(values[0])
+        self.assertSkiplistValid(loaded)
+
+    def test_dump_load_kinds(self):
+        for values in (
+            [],
+            [-2 ** 63, 0, 2 ** 63 - 1],
+            [0.5, 1, 2.25],
+            [u'', u'apple', u'caf\xe9', u'zebra'],
+            [b'', b'\x00\xff', b'abc'],
+        ):
+            pyskip.Skiplist.from_sorted(values).dump(self.path)
+            loaded = pyskip.Skiplist.load(self.path)
+            self.assertEqual(list(loaded.values()), values)
+            self.assertSkiplistValid(loaded)
+
+        for values in ([(1, 2)], [2 ** 64], [True]):
+            skip = pyskip.Skiplist()
+            skip.bulk_insert(values)
+
+            with self.assertRaises(pyskip.SnapshotError):
+                skip.dump(self.path)
+
+    def test_mapped(self):
+        values = list(range(0, 200, 2)) + [200, 200]
+        pyskip.Skiplist.from_sorted(values).dump(self.path)
+
+        with pyskip.MappedSkiplist(self.path) as mapped:
+            self.assertEqual(len(mapped), 102)
+            self.assertEqual(list(mapped), values)
+            self.assertEqual(mapped[-1], 200)
+            self.assertEqual(mapped.find(10), 5)
+            self.assertEqual(mapped.find(200), 100)
+            self.assertIsNone(mapped.find(11))
+            self.assertTrue(100 in mapped)
+            self.assertFalse(-2 in mapped)
+            self.assertEqual(list(mapped.irange(5, 12)), [6, 8, 10, 12])
+            self.assertEqual(
+                list(mapped.irange(6, 12, (False, False), reverse=True)),
+                [10, 8]
+            )
+            self.assertEqual(list(mapped.irange(hi=2)), [0, 2])
+
+    def test_mapped_strings(self):
+        values = [u'apple', u'banana', u'caf\xe9']
+        pyskip.Skiplist.from_sorted(values).dump(self.path)
+
+        with pyskip.MappedSkiplist(self.path) as mapped:
+            self.assertEqual(list(mapped), values)
+            self.assertEqual(mapped.find(u'banana'), 1)
+            self.assertIsNone(mapped.find(u'cherry'))
+            self.assertEqual(list(mapped.irange(u'b')), values[1:])
+
+    def test_mapped_bad_file(self):
+        with open(self.path, 'wb') as bad:
+            bad.write(b'NOTASKIPLISTFILE')
+
+        with self.assertRaises(pyskip.SnapshotError):
+            pyskip.MappedSkiplist(self.path)
+
+        with open(self.path, 'wb') as bad:
+            bad.write(b'PY')
+
+        with self.assertRaises(pyskip.SnapshotError):
+            pyskip.MappedSkiplist(self.path)
+
+    def test_load_bad_heights(self):
+        pyskip.Skiplist.from_sorted(range(5)).dump(self.path)
+
+        with open(self.path, 'rb') as snapshot:
+            data = bytearray(snapshot.read())
+
+        # The heights are the last byte per value.
+        for height in (0, 33):
+            data[-1] = height
+
+            with open(self.path, 'wb') as bad:
+                bad.write(data)
+
+            with self.assertRaises(pyskip.SnapshotError):
+                pyskip.Skiplist.load(self.path)
+
+        data[-1] = 4
+
+        with open(self.path, 'wb') as bad:
+            bad.write(data)
+
+        with self.assertRaises(pyskip.SnapshotError):
+            pyskip.Skiplist.load(self.path, max_layers=3)
+
+        skip = pyskip.Skiplist.load(self.path)
+        self.assertEqual(skip.heights()[-1], 4)
+        self.assertSkiplistValid(skip)
+
+    def test_mapped_truncated(self):
+        for values in ([1, 2, 3], ['a', 'bb', 'ccc']):
+            pyskip.Skiplist.from_sorted(values).dump(self.path)
+
+            with open(self.path, 'rb') as snapshot:
+                data = snapshot.read()
+
+            # Cut into the heights, the keys & the header.
+            for size in (len(data) - 1, len(data) - 4, 20, 10, 0):
+                with open(self.path, 'wb') as bad:
+                    bad.write(data[:size])
+
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter('always')
+
+                    with self.assertRaises(pyskip.SnapshotError):
+                        pyskip.MappedSkiplist(self.path)
+
+                    with self.assertRaises(pyskip.SnapshotError):
+                        pyskip.Skiplist.load(self.path)
+
+                    gc.collect()
+
+                # The file's closed, rather than left for the collector.
+                self.assertEqual(
+                    [w for w in caught
+                     if issubclass(w.category, ResourceWarning)],
+                    []
+                )
+
+
+class SetOperationsTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    operations = {
+        'merge': lambda mine, theirs: mine + theirs,
+        'union': lambda mine, theirs: mine | theirs,
+        'intersection': lambda mine, theirs: mine & theirs,
+        'difference': lambda mine, theirs: mine - theirs,
+        'symmetric_difference': lambda mine, theirs: (
+            (mine - theirs) + (theirs - mine)
+        ),
+    }
+
+    def expected(self, name, mine, theirs):
+        counts = self.operations[name](
+            collections.Counter(mine),
+            collections.Counter(theirs)
+        )
+        return sorted(counts.elements())
+
+    def random_values(self, count, top):
+        return sorted(random.randint(0, top) for i in range(count))
+
+    def test_sorted_runs(self):
+        left = pyskip.SortedLinkedList.from_sorted([1, 2, 2, 5])
+        right = pyskip.SortedLinkedList.from_sorted([2, 3, 5, 5])
+        self.assertEqual(
+            list(pyskip.sorted_runs(left.head, right.head)),
+            [(1, 1, 0), (2, 2, 1), (3, 0, 1), (5, 1, 2)]
+        )
+        self.assertEqual(list(pyskip.sorted_runs(None, None)), [])
+
+    def test_skiplist(self):
+        for sizes in ((200, 200), (20, 2000), (2000, 20), (0, 50)):
+            mine = self.random_values(sizes[0], 300)
+            theirs = self.random_values(sizes[1], 300)
+            left = pyskip.Skiplist.from_sorted(mine, max_layers=20)
+            right = pyskip.Skiplist.from_sorted(theirs)
+
+            for name in self.operations:
+                result = getattr(left, name)(right)
+                self.assertEqual(
+                    list(result.values()),
+                    self.expected(name, mine, theirs)
+                )
+                self.assertEqual(result.max_layers, 20)
+                self.assertSkiplistValid(result)
+
+                in_place = pyskip.Skiplist.from_sorted(mine)
+                update = name + '_update'
+
+                if name == 'union':
+                    update = 'update'
+
+                getattr(in_place, update)(right)
+                self.assertEqual(
+                    list(in_place.values()),
+                    self.expected(name, mine, theirs)
+                )
+                self.assertSkiplistValid(in_place)
+
+            # Neither side is changed by the non in-place operations.
+            self.assertEqual(list(left.values()), mine)
+            self.assertEqual(list(right.values()), theirs)
+
+    def test_sorted_linked_list(self):
+        mine = self.random_values(100, 60)
+        theirs = self.random_values(150, 60)
+
+        for name in self.operations:
+            left = pyskip.SortedLinkedList.from_sorted(mine)
+            right = pyskip.SortedLinkedList.from_sorted(theirs)
+            result = getattr(left, name)(right)
+            self.assertEqual(
+                [node.value for node in result],
+                self.expected(name, mine, theirs)
+            )
+
+            update = 'update' if name == 'union' else name + '_update'
+            getattr(left, update)(right)
+            self.assertEqual(
+                [node.value for node in left],
+                self.expected(name, mine, theirs)
+            )
+            self.assertEqual(len(left), len(result))
+
+    def test_gallops(self):
+        small = pyskip.Skiplist.from_sorted(
+            [CountedInt(value) for value in (10, 50000, 99990)]
+        )
+        big = pyskip.Skiplist.from_sorted(
+            [CountedInt(value) for value in range(0, 100000, 10)]
+        )
+        CountedInt.comparisons = 0
+
+        self.assertEqual(
+            list(small.intersection(big).values()),
+            [10, 50000, 99990]
+        )
+        # Nowhere near a walk through all 10000 values.
+        self.assertTrue(CountedInt.comparisons < 1000)
+
+        CountedInt.comparisons = 0
+        big.difference_update(small)
+        self.assertEqual(len(big), 9997)
+        self.assertTrue(CountedInt.comparisons < 1000)
+        self.assertSkiplistValid(big)
+
+
+class StatsTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def setUp(self):
+        super(StatsTestCase, self).setUp()
+        self.skip = pyskip.Skiplist.from_sorted(range(0, 2000, 2))
+
+    def test_off_by_default(self):
+        self.assertIsNone(self.skip.stats())
+        self.assertFalse('find' in self.skip.__dict__)
+
+    def test_records(self):
+        records = []
+        self.skip.enable_stats(
+            callback=lambda operation, record: records.append(
+                (operation, record)
+            )
+        )
+
+        self.assertEqual(self.skip.find(1000).value, 1000)
+        self.assertIsNone(self.skip.find(1001))
+        self.skip.insert(1001)
+        self.skip.remove(1000)
+        self.assertSkiplistValid(self.skip)
+
+        self.assertEqual(
+            [operation for operation, record in records],
+            ['find', 'find', 'insert', 'remove']
+        )
+
+        for operation, record in records:
+            self.assertTrue(record['comparisons'] > 0)
+            self.assertTrue(record['hops'] <= record['comparisons'])
+            self.assertEqual(record['levels'], len(self.skip.layers))
+
+        self.assertTrue(records[2][1]['height'] >= 1)
+        self.assertTrue(records[3][1]['height'] >= 1)
+
+        stats = self.skip.stats()
+        self.assertEqual(stats['find']['count'], 2)
+        self.assertEqual(sum(stats['find']['comparisons'].values()), 2)
+        self.assertEqual(stats['insert']['count'], 1)
+        self.assertEqual(
+            stats['insert']['height'],
+            {records[2][1]['height']: 1}
+        )
+
+        self.skip.reset_stats()
+        self.assertEqual(self.skip.stats(), {})
+
+    def test_exact_counts(self):
+        # A single layer, so the search is a plain walk.
+        skip = pyskip.Skiplist.from_sorted(range(10), max_layers=1)
+        records = []
+        skip.enable_stats(lambda operation, record: records.append(record))
+        skip.find(5)
+        self.assertEqual(
+            records,
+            [{'comparisons': 6, 'hops': 5, 'levels': 1, 'height': 0}]
+        )
+
+    def test_finger_counts(self):
+        skip = pyskip.Skiplist.from_sorted(range(0, 2000, 2),
+                                           deterministic=True)
+        finger = skip.finger(1000)
+        records = []
+        skip.enable_stats(lambda operation, record: records.append(record))
+        skip.find(1002, finger=finger)
+        skip.find(1502)
+
+        # Only the layers below the climb are searched, & climbing back up
+        # isn't moving right.
+        self.assertEqual(records[0]['levels'], 2)
+        self.assertEqual(records[0]['hops'], 1)
+        self.assertEqual(records[1]['levels'], len(skip.layers))
+
+    def test_disable(self):
+        self.skip.enable_stats()
+        self.skip.find(4)
+        self.skip.disable_stats()
+
+        self.assertIsNone(self.skip.stats())
+
+        for name in pyskip.STATS_METHODS:
+            self.assertFalse(name in self.skip.__dict__)
+
+        self.assertEqual(self.skip.find(4).value, 4)
+
+    def test_pickle(self):
+        self.skip.enable_stats()
+        loaded = pickle.loads(pickle.dumps(self.skip))
+        self.assertIsNone(loaded.stats())
+        self.assertEqual(len(loaded), 1000)
+
+    def test_report(self):
+        skip = pyskip.Skiplist.from_sorted(range(8), deterministic=True)
+        report = skip.report().splitlines()
+        self.assertEqual(report[0], 'Skiplist: 8 items, 4 layers')
+        self.assertEqual(report[1], '0  :          1 nodes (1.0 expected)')
+        self.assertEqual(report[4], '3  :          8 nodes (8.0 expected)')
+        self.assertEqual(report[5], 'height 1  :          4 towers')
+
+
+class SnapshotViewTestCase(unittest.TestCase):
+    def test_point_in_time(self):
+        skip = pyskip.Skiplist.from_sorted(range(0, 20, 2))
+        snapshot = skip.snapshot()
+
+        skip.insert(5)
+        skip.remove(4)
+        skip.remove(18)
+        skip.insert(-1)
+
+        self.assertEqual(list(snapshot.values()), list(range(0, 20, 2)))
+        self.assertEqual(len(snapshot), 10)
+        self.assertEqual(len(skip), 10)
+        self.assertEqual(snapshot.find(4).value, 4)
+        self.assertIsNone(snapshot.find(5))
+        self.assertTrue(18 in snapshot)
+        self.assertFalse(-1 in snapshot)
+        self.assertEqual(
+            [node.value for node in snapshot.irange(3, 12)],
+            [4, 6, 8, 10, 12]
+        )
+        self.assertEqual(
+            [node.value for node in snapshot.irange(
+                4, 18, (False, True), reverse=True)],
+            [18, 16, 14, 12, 10, 8, 6]
+        )
+
+        # The live skiplist is unaffected.
+        self.assertIsNone(skip.find(4))
+        self.assertEqual(skip.find(5).value, 5)
+
+    def test_duplicates(self):
+        skip = pyskip.Skiplist.from_sorted([1, 2, 2, 2, 3])
+        snapshot = skip.snapshot()
+        skip.remove(2)
+        skip.insert(2)
+        skip.insert(2)
+        # In & out again, unseen by the snapshot.
+        skip.insert(7)
+        skip.remove(7)
+
+        self.assertEqual(list(snapshot.values()), [1, 2, 2, 2, 3])
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(len(skip), 6)
+        self.assertIsNone(snapshot.find(7))
+
+    def test_reads_between_writes(self):
+        rand = random.Random(9)
+        skip = pyskip.Skiplist()
+        skip.bulk_insert(rand.randint(0, 50) for i in range(100))
+        snapshots = []
+
+        for step in range(400):
+            if step % 100 == 0:
+                snapshots.append((skip.snapshot(), list(skip.values())))
+
+            value = rand.randint(0, 50)
+
+            if rand.random() < 0.5:
+                skip.insert(value)
+            else:
+                skip.remove(value)
+
+            # Each read only folds in what changed since the last one.
+            for snapshot, expected in snapshots:
+                self.assertEqual(
+                    snapshot.find(value) is not None,
+                    value in expected
+                )
+                self.assertEqual(len(snapshot), len(expected))
+
+        for snapshot, expected in snapshots:
+            self.assertEqual(list(snapshot.values()), expected)
+            self.assertEqual(snapshot._delta_stamp, len(skip.history))
+
+    def test_scan_during_writes(self):
+        values = list(range(0, 300, 3))
+        skip = pyskip.Skiplist.from_sorted(values)
+        snapshot = skip.snapshot()
+        snapshot.batch_size = 7
+        seen = []
+
+        for node in snapshot:
+            seen.append(node.value)
+            # Churn on both sides of where the scan's got to.
+            skip.insert(node.value + 1)
+            skip.remove(node.value)
+            skip.insert(300 - node.value)
+
+        self.assertEqual(seen, values)
+
+    def test_release(self):
+        skip = pyskip.Skiplist()
+        self.assertIsNone(skip.history)
+
+        first = skip.snapshot()
+        skip.insert(1)
+        second = skip.snapshot()
+        skip.insert(2)
+        self.assertEqual(len(skip.history), 2)
+
+        first.close()
+        self.assertEqual(len(skip.history), 1)
+        self.assertEqual(skip.history_base, 1)
+        self.assertEqual(list(second.values()), [1])
+
+        with self.assertRaises(ValueError):
+            first.find(1)
+
+        # Dropping the last one lets go of the log entirely.
+        del second
+        gc.collect()
+        self.assertIsNone(skip.history)
+        self.assertEqual(skip.snapshots, {})
+
+        with skip.snapshot() as third:
+            skip.insert(3)
+            self.assertEqual(list(third.values()), [1, 2])
+
+        self.assertIsNone(skip.history)
+
+    def test_concurrent(self):
+        skip = pyskip.ConcurrentSkiplist.from_sorted(range(0, 1000, 2))
+        snapshot = skip.snapshot()
+        self.assertTrue(
+            isinstance(snapshot, pyskip.ConcurrentSkiplistSnapshot)
+        )
+
+        def writer():
+            rand = random.Random(0)
+
+            for i in range(2000):
+                if rand.random() < 0.5:
+                    skip.insert(rand.randint(0, 999))
+                else:
+                    skip.remove(rand.randint(0, 999))
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        scans = []
+
+        while thread.is_alive():
+            scans.append(list(snapshot.values()))
+
+        thread.join()
+        scans.append(list(snapshot.values()))
+
+        for scan in scans:
+            self.assertEqual(scan, list(range(0, 1000, 2)))
+
+
+class PickleTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def test_pickle(self):
+        # Long enough that pickling node by node would hit the recursion
+        # limit.
+        values = sorted(random.randint(0, 1000) for i in range(20000))
+        skip = pyskip.Skiplist.from_sorted(values, max_layers=24)
+        loaded = pickle.loads(pickle.dumps(skip, pickle.HIGHEST_PROTOCOL))
+
+        self.assertEqual(list(loaded.values()), values)
+        self.assertEqual(loaded.heights(), skip.heights())
+        self.assertEqual(loaded.max_layers, 24)
+        self.assertSkiplistValid(loaded)
+
+        loaded.insert(-1)
+        loaded.remove(values[-1])
+        self.assertSkiplistValid(loaded)
+
+    def test_pickle_empty(self):
+        skip = pickle.loads(pickle.dumps(pyskip.Skiplist(cache_size=4)))
+        self.assertEqual(len(skip), 0)
+        self.assertEqual(skip.cache_size, 4)
+        skip.insert(3)
+        self.assertTrue(3 in skip)
+
+    def test_pickle_payloads(self):
+        ages = pyskip.SkipDict([('bob', 42), ('Alice', 37)], key=str.lower)
+        loaded = pickle.loads(pickle.dumps(ages))
+        self.assertEqual(list(loaded.items()), [('Alice', 37), ('bob', 42)])
+        self.assertEqual(loaded['bob'], 42)
+        loaded['carol'] = 29
+        self.assertEqual(list(loaded), ['Alice', 'bob', 'carol'])
+
+    def test_pickle_concurrent(self):
+        skip = pyskip.ConcurrentSkiplist.from_sorted(range(100))
+        loaded = pickle.loads(pickle.dumps(skip))
+        self.assertTrue(isinstance(loaded, pyskip.ConcurrentSkiplist))
+        self.assertEqual(list(loaded.values()), list(range(100)))
+        self.assertTrue(hasattr(loaded, 'lock'))
+        loaded.insert(5)
+        self.assertSkiplistValid(loaded)
+
+    def test_copy(self):
+        skip = pyskip.Skiplist()
+        skip.insert([1, 2])
+        skip.insert([0])
+        shallow = copy.copy(skip)
+        deep = copy.deepcopy(skip)
+
+        self.assertEqual(list(shallow.values()), [[0], [1, 2]])
+        self.assertEqual(list(deep.values()), [[0], [1, 2]])
+        self.assertTrue(shallow.max().value is skip.max().value)
+        self.assertFalse(deep.max().value is skip.max().value)
+        self.assertSkiplistValid(deep)
+
+        # The structure isn't shared.
+        shallow.insert([3])
+        self.assertEqual(len(skip), 2)
+        self.assertEqual(len(shallow), 3)
+
+    def test_copy_seeded(self):
+        skip = pyskip.Skiplist(seed=5)
+        skip.insert_many(range(100))
+
+        for copier in (copy.copy, copy.deepcopy):
+            duplicate = copier(skip)
+            self.assertFalse(duplicate.random is skip.random)
+
+            # Each draws the same heights from here on, whatever the other
+            # does in between.
+            heights = [duplicate.generate_height() for i in range(50)]
+            self.assertEqual(
+                [skip.generate_height() for i in range(50)],
+                heights
+            )
+
+
+class DurableSkiplistTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_replay(self):
+        with pyskip.DurableSkiplist(self.directory) as durable:
+            for value in (5, 1, 3, 3, 9):
+                durable.insert(value)
+
+            self.assertEqual(durable.remove(3).value, 3)
+            self.assertIsNone(durable.remove(4))
+            self.assertEqual(len(durable), 4)
+
+        durable = pyskip.DurableSkiplist(self.directory)
+        self.assertEqual(list(durable.skiplist.values()), [1, 3, 5, 9])
+        self.assertTrue(5 in durable)
+        self.assertSkiplistValid(durable.skiplist)
+        durable.close()
+
+    def test_group_commit(self):
+        durable = pyskip.DurableSkiplist(self.directory, sync_every=3)
+        durable.insert(1)
+        durable.insert(2)
+        self.assertEqual(durable.unsynced, 2)
+        durable.insert(3)
+        self.assertEqual(durable.unsynced, 0)
+        durable.insert(4)
+        durable.sync()
+        self.assertEqual(durable.unsynced, 0)
+        durable.close()
+
+        durable = pyskip.DurableSkiplist(self.directory)
+        self.assertEqual(list(durable.skiplist.values()), [1, 2, 3, 4])
+        durable.close()
+
+    def test_checkpoint(self):
+        durable = pyskip.DurableSkiplist(
+            self.directory,
+            checkpoint_every=10
+        )
+
+        for value in range(25):
+            durable.insert(value)
+
+        # Two checkpoints so far, with only the latest generation kept.
+        self.assertEqual(durable.generation, 2)
+        self.assertEqual(
+            self.files(),
+            ['log-0000000002.log', 'snapshot-0000000002.bin']
+        )
+        durable.remove(0)
+        durable.close()
+
+        durable = pyskip.DurableSkiplist(self.directory)
+        self.assertEqual(list(durable.skiplist.values()), list(range(1, 25)))
+        self.assertEqual(durable.since_checkpoint, 6)
+        self.assertSkiplistValid(durable.skiplist)
+        durable.close()
+
+    def test_torn_tail(self):
+        with pyskip.DurableSkiplist(self.directory) as durable:
+            durable.insert(u'apple')
+            durable.insert(u'banana')
+
+        path = os.path.join(self.directory, 'log-0000000000.log')
+
+        with open(path, 'ab') as log:
+            log.write(b'+s\x05\x00')
+
+        durable = pyskip.DurableSkiplist(self.directory)
+        self.assertEqual(
+            list(durable.skiplist.values()),
+            [u'apple', u'banana']
+        )
+        durable.insert(u'cherry')
+        durable.close()
+
+        durable = pyskip.DurableSkiplist(self.directory)
+        self.assertEqual(
+            list(durable.skiplist.values()),
+            [u'apple', u'banana', u'cherry']
+        )
+        durable.close()
+
+    def test_unsupported_value(self):
+        with pyskip.DurableSkiplist(self.directory) as durable:
+            with self.assertRaises(pyskip.SnapshotError):
+                durable.insert((1, 2))
+
+            self.assertEqual(len(durable), 0)
+
+    def test_closed(self):
+        durable = pyskip.DurableSkiplist(self.directory)
+        durable.insert(1)
+        durable.close()
+        durable.close()
+
+        self.assertTrue(1 in durable)
+        self.assertEqual(durable.find(1).value, 1)
+
+        for write in (lambda: durable.insert(2),
+                      lambda: durable.remove(1),
+                      durable.checkpoint):
+            with self.assertRaises(ValueError):
+                write()
+
+        self.assertEqual(list(durable.skiplist.values()), [1])
+
+    def test_mixed_kinds(self):
+        with pyskip.DurableSkiplist(self.directory) as durable:
+            durable.insert(1)
+
+            for value in (u'a', 2.5, b'b'):
+                with self.assertRaises(pyskip.SnapshotError):
+                    durable.insert(value)
+
+            # Equal values of another kind are logged as the stored one.
+            self.assertEqual(durable.remove(1.0).value, 1)
+            durable.insert(2.5)
+            self.assertEqual(durable.kind, b'd')
+
+        # Nothing rejected was logged, so it still opens.
+        with pyskip.DurableSkiplist(self.directory) as durable:
+            self.assertEqual(list(durable.skiplist.values()), [2.5])
+            self.assertEqual(durable.kind, b'd')
+
+            with self.assertRaises(pyskip.SnapshotError):
+                durable.insert(3)
+
+    def test_exact_ints(self):
+        values = [1, 2, 2 ** 62 + 1]
+
+        with pyskip.DurableSkiplist(self.directory) as durable:
+            for value in values:
+                durable.insert(value)
+
+            durable.checkpoint()
+
+        with pyskip.DurableSkiplist(self.directory) as durable:
+            stored = list(durable.skiplist.values())
+            self.assertEqual(stored, values)
+            self.assertEqual([type(value) for value in stored], [int] * 3)
+
+
+class BatchTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def setUp(self):
+        super(BatchTestCase, self).setUp()
+        self.values = [random.randint(0, 1000) for i in range(500)]
+        self.skip = pyskip.Skiplist.from_sorted(sorted(self.values))
+
+    def test_hinted_predecessors(self):
+        hint = None
+
+        for value in range(-10, 1010, 7):
+            for strict in (True, False):
+                expected = self.skip._predecessors(value, strict=strict)
+                found = self.skip._predecessors(
+                    value,
+                    strict=strict,
+                    hint=hint
+                )
+                self.assertEqual(found, expected)
+
+            hint = found
+
+    def test_insert_many(self):
+        batch = [random.randint(0, 1000) for i in range(300)]
+        nodes = self.skip.insert_many(batch)
+
+        self.assertEqual([node.value for node in nodes], batch)
+        self.assertEqual(
+            [node.value for node in self.skip],
+            sorted(self.values + batch)
+        )
+        self.assertSkiplistValid(self.skip)
+
+        empty = pyskip.Skiplist()
+        empty.insert_many([3, 1, 2, 1])
+        self.assertEqual([node.value for node in empty], [1, 1, 2, 3])
+        self.assertSkiplistValid(empty)
+        self.assertEqual(empty.insert_many([]), [])
+
+    def test_remove_many(self):
+        batch = self.values[:200] + [-1, 2000]
+        random.shuffle(batch)
+        removed = self.skip.remove_many(batch)
+
+        for value, node in zip(batch, removed):
+            if value in (-1, 2000):
+                self.assertEqual(node, None)
+            else:
+                self.assertEqual(node.value, value)
+
+        self.assertEqual(
+            [node.value for node in self.skip],
+            sorted(self.values[200:])
+        )
+        self.assertSkiplistValid(self.skip)
+
+        removed = self.skip.remove_many(self.values[200:])
+        self.assertTrue(all(node is not None for node in removed))
+        self.assertEqual(len(self.skip), 0)
+        self.assertEqual(len(self.skip.layers), 1)
+
+    def test_contains_many(self):
+        batch = list(range(-5, 1005))
+        random.shuffle(batch)
+        present = set(self.values)
+
+        self.assertEqual(
+            self.skip.contains_many(batch),
+            [value in present for value in batch]
+        )
+        self.assertEqual(
+            pyskip.Skiplist().contains_many([1, 2]),
+            [False, False]
+        )
+
+
+class TruncateTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def setUp(self):
+        super(TruncateTestCase, self).setUp()
+        self.values = sorted(random.randint(0, 100) for i in range(300))
+        self.skip = pyskip.Skiplist()
+
+        for value in self.values:
+            self.skip.insert(value)
+
+    def test_truncate_before(self):
+        expected = [value for value in self.values if value >= 40]
+        removed = self.skip.truncate_before(40)
+        self.assertEqual(removed, len(self.values) - len(expected))
+        self.assertEqual(list(self.skip.values()), expected)
+        self.assertSkiplistValid(self.skip)
+
+        expected = [value for value in expected if value > 60]
+        self.skip.truncate_before(60, inclusive=True)
+        self.assertEqual(list(self.skip.values()), expected)
+        self.assertSkiplistValid(self.skip)
+
+        # Still fully usable afterward.
+        self.skip.insert(0)
+        self.assertEqual(self.skip.remove(expected[0]).value, expected[0])
+        self.assertEqual(self.skip[0].value, 0)
+        self.assertSkiplistValid(self.skip)
+
+    def test_truncate_after(self):
+        expected = [value for value in self.values if value <= 60]
+        removed = self.skip.truncate_after(60)
+        self.assertEqual(removed, len(self.values) - len(expected))
+        self.assertEqual(list(self.skip.values()), expected)
+        self.assertSkiplistValid(self.skip)
+
+        expected = [value for value in expected if value < 40]
+        self.skip.truncate_after(40, inclusive=True)
+        self.assertEqual(list(self.skip.values()), expected)
+        self.assertSkiplistValid(self.skip)
+
+        self.skip.insert(1000)
+        self.assertEqual(self.skip.max().value, 1000)
+        self.assertSkiplistValid(self.skip)
+
+    def test_nothing_to_remove(self):
+        version = self.skip.version
+        self.assertEqual(self.skip.truncate_before(-1), 0)
+        self.assertEqual(self.skip.truncate_after(1000), 0)
+        self.assertEqual(self.skip.version, version)
+        self.assertEqual(len(self.skip.truncate_before(-1, detach=True)), 0)
+        self.assertEqual(list(self.skip.values()), self.values)
+
+        empty = pyskip.Skiplist()
+        self.assertEqual(empty.truncate_before(5), 0)
+        self.assertEqual(empty.truncate_after(5), 0)
+
+    def test_everything(self):
+        self.assertEqual(self.skip.truncate_before(1000), len(self.values))
+        self.assertEqual(len(self.skip), 0)
+        self.assertEqual(len(self.skip.layers), 1)
+        self.assertSkiplistValid(self.skip)
+
+    def test_detach(self):
+        head = self.skip.truncate_before(50, detach=True)
+        tail = self.skip.truncate_after(75, detach=True)
+        self.assertEqual(
+            list(head.values()),
+            [value for value in self.values if value < 50]
+        )
+        self.assertEqual(
+            list(self.skip.values()),
+            [value for value in self.values if 50 <= value <= 75]
+        )
+        self.assertEqual(
+            list(tail.values()),
+            [value for value in self.values if value > 75]
+        )
+
+        for skip in (head, self.skip, tail):
+            self.assertSkiplistValid(skip)
+            skip.insert(60)
+            self.assertSkiplistValid(skip)
+
+        self.assertTrue(isinstance(tail, pyskip.Skiplist))
+
+    def test_against_list(self):
+        rand = random.Random(3)
+
+        for trial in range(200):
+            values = sorted(rand.randint(0, 30) for i in range(50))
+            skip = pyskip.Skiplist(seed=trial)
+            skip.insert_many(values)
+            value = rand.randint(-1, 31)
+            inclusive = rand.random() < 0.5
+
+            if rand.random() < 0.5:
+                rest = skip.truncate_before(value, inclusive, detach=True)
+                split = bisect.bisect(values, value) if inclusive else \
+                    bisect.bisect_left(values, value)
+                kept, removed = values[split:], values[:split]
+            else:
+                rest = skip.truncate_after(value, inclusive, detach=True)
+                split = bisect.bisect_left(values, value) if inclusive else \
+                    bisect.bisect(values, value)
+                kept, removed = values[:split], values[split:]
+
+            self.assertEqual(list(skip.values()), kept)
+            self.assertEqual(list(rest.values()), removed)
+            self.assertSkiplistValid(skip)
+            self.assertSkiplistValid(rest)
+
+    def test_snapshot(self):
+        with self.skip.snapshot() as snapshot:
+            self.skip.truncate_before(30)
+            self.skip.truncate_after(70, detach=True)
+            self.assertEqual(list(snapshot.values()), self.values)
+
+        self.assertEqual(
+            list(self.skip.values()),
+            [value for value in self.values if 30 <= value <= 70]
+        )
+
+    def test_cache(self):
+        skip = pyskip.Skiplist(cache_size=10)
+        skip.bulk_insert(range(10))
+        self.assertEqual(skip.find(2).value, 2)
+        skip.truncate_before(5)
+        self.assertEqual(skip.find(2), None)
+
+    def test_concurrent(self):
+        skip = pyskip.ConcurrentSkiplist()
+        skip.bulk_insert(range(100))
+        self.assertEqual(skip.truncate_before(10), 10)
+        tail = skip.truncate_after(89, detach=True)
+        self.assertTrue(isinstance(tail, pyskip.ConcurrentSkiplist))
+        self.assertEqual(list(tail.values()), list(range(90, 100)))
+        self.assertEqual(list(skip.values()), list(range(10, 90)))
+
+    def test_concurrent_detach_keeps_readers(self):
+        skip = pyskip.ConcurrentSkiplist(seed=4)
+        skip.bulk_insert(range(1000))
+
+        # A lock-free reader that loaded the layers before truncating keeps
+        # descending through the detached values.
+        reader = pyskip.Skiplist()
+        reader.layers = skip.layers
+        head = skip.truncate_before(500, detach=True)
+
+        for value in (0, 499, 500, 700, 999):
+            self.assertEqual(reader.find(value).value, value)
+
+        self.assertEqual(reader.ceiling(250.5).value, 251)
+        self.assertEqual(list(head.values()), list(range(500)))
+        self.assertEqual(list(skip.values()), list(range(500, 1000)))
+        self.assertTrue(isinstance(head, pyskip.ConcurrentSkiplist))
+        self.assertSkiplistValid(head)
+        self.assertSkiplistValid(skip)
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        super(CacheTestCase, self).setUp()
+        self.skip = pyskip.Skiplist(cache_size=3)
+        self.skip.bulk_insert(range(10))
+
+    def cache_counts(self):
+        return self.skip.cache_hits, self.skip.cache_misses
+
+    def test_disabled(self):
+        skip = pyskip.Skiplist()
+        skip.insert(3)
+        self.assertEqual(skip.cache, None)
+        self.assertTrue(3 in skip)
+        self.assertEqual(skip.cache_hits + skip.cache_misses, 0)
+
+    def test_hits_misses(self):
+        self.assertEqual(self.skip.find(4).value, 4)
+        self.assertEqual(self.cache_counts(), (0, 1))
+
+        node = self.skip.find(4)
+        self.assertTrue(node is self.skip.find(4))
+        self.assertTrue(4 in self.skip)
+        self.assertEqual(self.cache_counts(), (3, 1))
+
+        # Missing values aren't cached.
+        self.assertFalse(20 in self.skip)
+        self.assertFalse(20 in self.skip)
+        self.assertEqual(self.skip.cache_misses, 3)
+        self.assertEqual(list(self.skip.cache), [4])
+
+        self.skip.clear_cache()
+        self.assertEqual(list(self.skip.cache), [])
+        self.assertEqual(self.cache_counts(), (0, 0))
+
+    def test_lru_eviction(self):
+        for value in (1, 2, 3, 1, 4):
+            self.skip.find(value)
+
+        # ``2`` was the least recently used.
+        self.assertEqual(list(self.skip.cache), [3, 1, 4])
+
+    def test_invalidation(self):
+        self.skip.insert(5)
+        first = self.skip.find(5)
+
+        # Inserting a duplicate doesn't change the first occurrence.
+        self.skip.insert(5)
+        self.assertTrue(self.skip.find(5) is first)
+
+        self.assertTrue(self.skip.remove(5) is first)
+        second = self.skip.find(5)
+        self.assertFalse(second is first)
+        self.assertEqual(second.value, 5)
+
+        self.skip.remove(5)
+        self.skip.remove(5)
+        self.assertFalse(5 in self.skip)
+
+        self.skip.find(0)
+        self.skip.find(9)
+        self.skip.pop_min()
+        self.skip.pop_max()
+        self.assertEqual(self.skip.find(0), None)
+        self.assertEqual(self.skip.find(9), None)
+
+        self.skip.find(3)
+        self.skip.remove_many([3])
+        self.assertEqual(self.skip.find(3), None)
+
+
+class CountedInt(int):
+    """
+    An ``int`` that counts how often it's compared.
+    """
+    comparisons = 0
+
+    def __lt__(self, other):
+        CountedInt.comparisons += 1
+        return int(self) < int(other)
+
+    def __le__(self, other):
+        CountedInt.comparisons += 1
+        return int(self) <= int(other)
+
+
+class FingerTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def setUp(self):
+        super(FingerTestCase, self).setUp()
+        self.values = sorted(random.randint(0, 5000) for i in range(2000))
+        self.skip = pyskip.Skiplist.from_sorted(self.values)
+
+    def test_find(self):
+        finger = self.skip.finger()
+        self.assertEqual(finger.node, None)
+
+        # Forward, backward & repeated lookups all work.
+        lookups = list(range(0, 5000, 37)) + list(range(5000, 0, -53))
+        lookups += [random.randint(-10, 5010) for i in range(300)]
+
+        for value in lookups:
+            found = self.skip.find(value, finger=finger)
+            self.assertEqual(found, self.skip.find(value))
+
+            if found is not None:
+                self.assertTrue(finger.node is found)
+
+    def test_finger_at(self):
+        finger = self.skip.finger(self.values[10])
+        self.assertEqual(finger.node.value, self.values[10])
+
+    def test_insert_remove(self):
+        finger = self.skip.finger()
+        values = list(self.values)
+
+        for i in range(500):
+            value = random.randint(0, 5000)
+
+            if random.random() < 0.5:
+                node = self.skip.insert(value, finger=finger)
+                self.assertTrue(finger.node is node)
+                values.append(value)
+            elif self.skip.remove(value, finger=finger) is not None:
+                values.remove(value)
+
+        values.sort()
+        self.assertEqual(list(self.skip.values()), values)
+        self.assertSkiplistValid(self.skip)
+
+    def test_stale(self):
+        finger = self.skip.finger(self.values[100])
+        self.assertTrue(finger.get_hint() is not None)
+
+        # Changed behind the finger's back.
+        self.skip.remove(self.values[50])
+        self.assertEqual(finger.get_hint(), None)
+        self.assertEqual(
+            self.skip.find(self.values[100], finger=finger).value,
+            self.values[100]
+        )
+        self.assertTrue(finger.get_hint() is not None)
+
+    def test_nearby_searches_are_cheaper(self):
+        skip = pyskip.Skiplist.from_sorted(
+            [CountedInt(value) for value in range(20000)],
+            deterministic=True
+        )
+        finger = skip.finger()
+        CountedInt.comparisons = 0
+
+        for value in range(5000, 5500):
+            skip.find(CountedInt(value), finger=finger)
+
+        with_finger = CountedInt.comparisons
+        CountedInt.comparisons = 0
+
+        for value in range(5000, 5500):
+            skip.find(CountedInt(value))
+
+        self.assertTrue(with_finger * 2 < CountedInt.comparisons)
+
+
+class ConcurrentSkiplistTestCase(SkiplistAssertionsMixin, unittest.TestCase):
+    def setUp(self):
+        super(ConcurrentSkiplistTestCase, self).setUp()
+        self.old_interval = sys.getswitchinterval()
+        # Switch threads as often as possible, to shake out races.
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.old_interval)
+        super(ConcurrentSkiplistTestCase, self).tearDown()
+
+    def test_value_slips_in_after_predecessor(self):
+        class RacedSkiplist(pyskip.ConcurrentSkiplist):
+            # Plays a writer linking a value in right after the descent.
+            slip_in = None
+
+            def _predecessor(self, value, strict=False):
+                previous = super(RacedSkiplist, self)._predecessor(
+                    value,
+                    strict=strict
+                )
+
+                if self.slip_in is not None:
+                    slip_in, self.slip_in = self.slip_in, None
+                    self.insert(slip_in)
+
+                return previous
+
+        skip = RacedSkiplist()
+        skip.bulk_insert(range(0, 100, 10))
+
+        skip.slip_in = 25
+        self.assertEqual(skip.find(30).value, 30)
+
+        skip.slip_in = 35
+        self.assertEqual(skip.ceiling(40).value, 40)
+
+        skip.slip_in = 45
+        self.assertEqual(
+            [node.value for node in skip.irange(50, 70)],
+            [50, 60, 70]
+        )
+
+        # An excluded ``lo`` can slip in again, after the existing one.
+        skip.slip_in = 60
+        self.assertEqual(
+            [node.value for node in skip.irange(60, 80, (False, True))],
+            [70, 80]
+        )
+        self.assertEqual(
+            list(skip.values()),
+            [0, 10, 20, 25, 30, 35, 40, 45, 50, 60, 60, 70, 80, 90]
+        )
+
+    def test_stress(self):
+        skip = pyskip.ConcurrentSkiplist()
+        # Values that are never removed, so readers must always find them.
+        stable = list(range(0, 2000, 10))
+        skip.bulk_insert(stable)
+        errors = []
+        done = threading.Event()
+
+        def writer(seed):
+            rand = random.Random(seed)
+
+            for i in range(1500):
+                value = rand.randint(0, 1999)
+
+                if value % 10 == 0:
+                    continue
+
+                if rand.random() < 0.6:
+                    skip.insert(value)
+                else:
+                    skip.remove(value)
+
+        def reader(seed):
+            rand = random.Random(seed)
+
+            while not done.is_set():
+                try:
+                    value = rand.choice(stable)
+
+                    if skip.find(value) is None:
+                        errors.append('{0} went missing'.format(value))
+
+                    previous = None
+
+                    for node in skip.irange(value, value + 100):
+                        if previous is not None and previous > node.value:
+                            errors.append('Out of order at {0}'.format(
+                                node.value
+                            ))
+
+                        previous = node.value
+                except Exception as e:
+                    errors.append(repr(e))
+
+        writers = [
+            threading.Thread(target=writer, args=(i,)) for i in range(4)
+        ]
+        readers = [
+            threading.Thread(target=reader, args=(i,)) for i in range(4)
+        ]
+
+        for thread in readers + writers:
+            thread.start()
+
+        for thread in writers:
+            thread.join()
+
+        done.set()
+
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertSkiplistValid(skip)
+        self.assertEqual(len(skip), len(list(skip)))
+
+        for value in stable:
+            self.assertTrue(value in skip)
+
+    def test_positional(self):
+        skip = pyskip.ConcurrentSkiplist()
+        skip.insert_many([5, 1, 3])
+        self.assertEqual(skip.rank(3), 1)
+        self.assertEqual(skip[1].value, 3)
+        self.assertEqual(
+            [node.value for node in skip.irange(reverse=True)],
+            [5, 3, 1]
+        )
+        self.assertEqual(skip.pop_min().value, 1)
+
+    def test_dump_while_writing(self):
+        skip = pyskip.ConcurrentSkiplist()
+        skip.bulk_insert(range(0, 2000, 2))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'skip.bin')
+        done = threading.Event()
+
+        def writer():
+            rand = random.Random(1)
+
+            while not done.is_set():
+                value = rand.randint(0, 1999)
+
+                if rand.random() < 0.5:
+                    skip.insert(value)
+                else:
+                    skip.remove(value)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+
+        try:
+            for i in range(20):
+                heights = skip.heights()
+                self.assertTrue(min(heights) >= 1)
+                skip.dump(path)
+                values = list(pyskip.Skiplist.load(path).values())
+                self.assertEqual(values, sorted(values))
+                self.assertTrue(
+                    skip.report().startswith('ConcurrentSkiplist: ')
+                )
+
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                skip.debug()
+
+            self.assertTrue('nodes' in output.getvalue())
+        finally:
+            done.set()
+            thread.join()
+
+
+class AsyncSkiplistTestCase(unittest.TestCase):
+    def setUp(self):
+        super(AsyncSkiplistTestCase, self).setUp()
+        self.skip = aiopyskip.AsyncSkiplist(
+            pyskip.Skiplist.from_sorted([1, 2, 2, 3, 5, 8, 13]),
+            yield_every=2
+        )
+
+    def collect(self, nodes):
+        async def run():
+            return [node.value async for node in nodes]
+
+        return asyncio.run(run())
+
+    def test_str(self):
+        self.assertEqual(str(self.skip), 'AsyncSkiplist: 7 items')
+        self.assertEqual(len(aiopyskip.AsyncSkiplist()), 0)
+
+    def test_find(self):
+        self.assertEqual(asyncio.run(self.skip.find(5)).value, 5)
+        self.assertEqual(asyncio.run(self.skip.find(4)), None)
+        self.assertTrue(asyncio.run(self.skip.contains(13)))
+        self.assertFalse(asyncio.run(self.skip.contains(14)))
+
+    def test_writes(self):
+        async def run():
+            await self.skip.insert(4)
+            await self.skip.remove(13)
+            await self.skip.insert_many([9, 0, 7])
+            removed = await self.skip.remove_many([1, 100])
+            return removed
+
+        removed = asyncio.run(run())
+        self.assertEqual(removed[0].value, 1)
+        self.assertEqual(removed[1], None)
+        self.assertEqual(
+            list(self.skip.skiplist.values()),
+            [0, 2, 2, 3, 4, 5, 7, 8, 9]
+        )
+
+    def test_iteration(self):
+        self.assertEqual(self.collect(self.skip), [1, 2, 2, 3, 5, 8, 13])
+        self.assertEqual(self.collect(self.skip.irange(2, 8)), [2, 2, 3, 5, 8])
+        self.assertEqual(
+            self.collect(self.skip.irange(2, 8, inclusive=(False, False))),
+            [3, 5]
+        )
+        self.assertEqual(
+            self.collect(self.skip.irange(reverse=True)),
+            [13, 8, 5, 3, 2, 2, 1]
+        )
+        self.assertEqual(
+            self.collect(self.skip.irange(2, 9, reverse=True)),
+            [8, 5, 3, 2, 2]
+        )
+        self.assertEqual(
+            self.collect(self.skip.irange(
+                2,
+                8,
+                inclusive=(False, False),
+                reverse=True
+            )),
+            [5, 3]
+        )
+
+    def test_scans_yield_to_the_loop(self):
+        skip = aiopyskip.AsyncSkiplist(
+            pyskip.Skiplist.from_sorted(range(1000)),
+            yield_every=10
+        )
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0)
+
+        async def run():
+            task = asyncio.ensure_future(ticker())
+            await asyncio.sleep(0)
+            seen = 0
+
+            async for node in skip.irange(reverse=True):
+                seen += 1
+
+                # Writers slipping in mid-scan don't derail it.
+                if seen == 500:
+                    await skip.insert(10000)
+                    await skip.remove(100)
+
+            task.cancel()
+            return seen
+
+        self.assertEqual(asyncio.run(run()), 999)
+        # The ticker got to run many times during the scan.
+        self.assertTrue(len(ticks) > 50)